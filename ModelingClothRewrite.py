@@ -42,6 +42,7 @@ try:
     from numpy import newaxis as nax
     import time
     import copy # for duplicate cloth objects
+    import atexit
 
 
 except ImportError:
@@ -70,6 +71,27 @@ except:
 
     fix_all_shape_key_nans = rbu.fix_all_shape_key_nans
 
+# div_eps is the floor for divisions in the solver. Zero
+#   length springs and flat tris divide by it instead of making NaNs
+try:
+    from garments_render.simulation.bary_kernels import bary_project, bary_buffers, bary_linear, div_eps
+except ImportError:
+    bary_kernels = bpy.data.texts['bary_kernels.py'].as_module()
+    bary_project = bary_kernels.bary_project
+    bary_buffers = bary_kernels.bary_buffers
+    bary_linear = bary_kernels.bary_linear
+    div_eps = bary_kernels.div_eps
+
+try:
+    from garments_render.simulation.edge_sets import pair_keys, key_pairs, unique_pairs, pairs_in, face_pairs
+except ImportError:
+    edge_sets = bpy.data.texts['edge_sets.py'].as_module()
+    pair_keys = edge_sets.pair_keys
+    key_pairs = edge_sets.key_pairs
+    unique_pairs = edge_sets.unique_pairs
+    pairs_in = edge_sets.pairs_in
+    face_pairs = edge_sets.face_pairs
+
 
 
 
@@ -79,6 +101,20 @@ MC_data['colliders'] = {}
 MC_data['cloths'] = {}
 MC_data['iterator'] = 0
 
+# scene cache bundle header and the frame last read from it
+MC_data['bundle'] = None
+MC_data['bundle_frame'] = None
+
+# compressed caches that have been loaded for playback
+MC_data['pca'] = {}
+
+# cache_only bookkeeping for objects without a cloth instance
+MC_data['cache_states'] = {}
+
+# frames stored as references or sparse on top of each
+#   cache frame, by cache folder. See get_cache_index
+MC_data['cache_index'] = {}
+
 # recent_object allows cloth object in ui
 #   when selecting empties such as for pinning.
 MC_data['recent_object'] = None
@@ -163,37 +199,812 @@ def cache_interpolation(cloth):
     ob = cloth.ob
     f = ob.MC_props.current_cache_frame
     fp = cloth.cache_dir
-    idx = np.array([int(i.parts[-1]) for i in fp.iterdir()])
+    idx = cache_frame_numbers(fp)
 
 
 def cache_only(ob, frame=None):
 
-    self = ob.MC_props
+    # same folder the bake writes to
+    final_path = cache_folder_path(ob)
+
+    #f = bpy.context.scene.frame_current
+    f = ob.MC_props.current_cache_frame
+    ob.MC_props['current_cache_frame'] = f + 1
+    if frame is not None:
+        f = frame
+
+    # a cloth instance keeps the key frames the bake
+    #   wrote to this folder
+    state = get_cache_state(ob, final_path)
+    if 'MC_cloth_id' in ob:
+        if ob['MC_cloth_id'] in MC_data['cloths']:
+            state = get_cloth(ob)
+
+    co = get_proxy_co(ob)
+    write_cache_frame(state, final_path, f, co)
+
+    # playback reads the RAM cache before the folder
+    ram = getattr(state, 'ram_cache', None)
+    if ram is not None:
+        if f in ram.lookup:
+            ram_cache_put(state, f, co)
+
+    if bpy.context.scene.MC_props.bundle_record:
+        write_bundle_frame(get_bundle_header(create=True), f, ob.name, co)
+
+
+# Cache functions ---------------
+def cache_frame_numbers(fp):
+    """Sorted array of the frames stored in a cache folder.
+    Frame files are named by frame number with an optional
+    suffix for binary, back-reference and sparse frames."""
+    names = [i.name.split('.')[0] for i in fp.iterdir()]
+    return np.unique(np.array([int(i) for i in names if i.isdigit()], dtype=np.int32))
+
+
+# Cache functions ---------------
+def cache_frame_path(fp, f):
+    """Find the file storing frame f.
+    Returns None when the frame isn't cached."""
+    for suffix in ['', '.npy', '.ref', '.npz']:
+        txt = fp.joinpath(str(f) + suffix)
+        if txt.exists():
+            return txt
+
+
+# Cache functions ---------------
+def read_cache_frame(fp, f, seen=None):
+    """Load frame f as Nx3 coords. Back-references load
+    the full frame they point to. Sparse frames overwrite
+    the verts that moved on top of their full frame.
+    References that loop back on themselves return None."""
+    txt = cache_frame_path(fp, f)
+    if txt is None:
+        return read_pca_frame(fp, f)
+
+    if txt.suffix in ['.ref', '.npz']:
+        if seen is None:
+            seen = set()
+        if f in seen:
+            print('cache reference loop at frame', f, 'in', fp)
+            return
+        seen.add(f)
+
+    if txt.suffix == '.ref':
+        return read_cache_frame(fp, int(txt.read_text()), seen)
+
+    if txt.suffix == '.npz':
+        sparse = np.load(txt)
+        co = read_cache_frame(fp, int(sparse['base']), seen)
+        if co is None:
+            return
+        co[sparse['idx']] = sparse['co']
+        return co
+
+    if txt.suffix == '.npy':
+        return np.load(txt)
+
+    return np.loadtxt(txt)
+
+
+# Cache functions ---------------
+def cache_frame_base(txt):
+    """The frame a reference or sparse frame file
+    is built on. None for full frames."""
+    if txt.suffix == '.ref':
+        return int(txt.read_text())
+
+    if txt.suffix == '.npz':
+        with np.load(txt) as sparse:
+            return int(sparse['base'])
+
+
+# Cache functions ---------------
+def get_cache_index(fp):
+    """{frame: set of frames built on it} for a cache folder.
+    The folder is scanned the first time then the writers
+    keep it up to date so overwrites don't rescan."""
+    index = MC_data['cache_index'].get(str(fp))
+    if index is not None:
+        return index
+
+    index = {}
+    for g in cache_frame_numbers(fp):
+        base = cache_frame_base(cache_frame_path(fp, int(g)))
+        if base is not None:
+            index.setdefault(base, set()).add(int(g))
+    MC_data['cache_index'][str(fp)] = index
+    return index
+
+
+# Cache functions ---------------
+def clear_cache_frame(fp, f):
+    """Delete every file stored for frame f"""
+    for suffix in ['', '.npy', '.ref', '.npz']:
+        old = fp.joinpath(str(f) + suffix)
+        if old.exists():
+            old.unlink()
+
+
+# Cache functions ---------------
+def write_full_frame(ob, fp, f, co):
+    """Store all the coords of frame f"""
+    if ob.MC_props.cache_binary:
+        np.save(fp.joinpath(str(f) + '.npy'), np.array(co, dtype=np.float32))
+    else:
+        np.savetxt(fp.joinpath(str(f)), co)
+
+
+# Cache functions ---------------
+def overwrite_cache_frame(cloth, fp, f):
+    """Clear frame f before it gets written again. Frames that
+    reference it or were stored sparse on top of it are stored
+    as full frames first so they keep their coords."""
+    index = get_cache_index(fp)
+
+    # f is no longer built on anything
+    base = cache_frame_base(cache_frame_path(fp, f))
+    if base in index:
+        index[base].discard(f)
+
+    dependents = {}
+    for g in index.pop(f, set()):
+        txt = cache_frame_path(fp, g)
+        if txt is None:
+            continue
+        if cache_frame_base(txt) == f:
+            dependents[g] = read_cache_frame(fp, g)
+
+    clear_cache_frame(fp, f)
+    for g, co in dependents.items():
+        clear_cache_frame(fp, g)
+        if co is not None:
+            write_full_frame(cloth.ob, fp, g, co)
+
+    # the frames we would build on may be gone or rewritten
+    cloth.cache_key_frame = None
+    cloth.cache_key_co = None
+    cloth.cache_last_frame = None
+    cloth.cache_last_co = None
+
+
+# Cache functions ---------------
+def cache_base_ok(fp, base, f, full=False):
+    """True if frame base is an earlier frame still on disk.
+    With full it also has to be stored as a full frame."""
+    if base is None:
+        return False
+    if base >= f:
+        return False
+    txt = cache_frame_path(fp, base)
+    if txt is None:
+        return False
+    if full:
+        return txt.suffix in ['', '.npy']
+    return True
+
+
+# Cache functions ---------------
+def write_cache_frame(cloth, fp, f, co):
+    """Store frame f. If no vert moved further than the tolerance
+    since the last stored frame we only store a reference to it.
+    With sparse on, frames where less than half the verts moved
+    from the last full frame store just those verts.
+    References only point back to earlier frames on disk."""
+    ob = cloth.ob
+    tol = ob.MC_props.cache_tolerance
+
+    # clear what was there so the reader doesn't find a stale version
+    if cache_frame_path(fp, f) is not None:
+        overwrite_cache_frame(cloth, fp, f)
+
+    index = get_cache_index(fp)
+
+    last_co = cloth.cache_last_co
+    if cache_base_ok(fp, cloth.cache_last_frame, f):
+        if last_co.shape == co.shape:
+            if np.all(np.abs(co - last_co) <= tol):
+                fp.joinpath(str(f) + '.ref').write_text(str(cloth.cache_last_frame))
+                index.setdefault(cloth.cache_last_frame, set()).add(f)
+                return
+
+    key_co = cloth.cache_key_co
+    if ob.MC_props.cache_sparse & cache_base_ok(fp, cloth.cache_key_frame, f, full=True):
+        if key_co.shape == co.shape:
+            moved = np.any(np.abs(co - key_co) > tol, axis=1)
+            moved_count = np.count_nonzero(moved)
+
+            # nothing moved from the key frame. Reference it
+            #   instead of saving an empty sparse frame
+            if moved_count == 0:
+                fp.joinpath(str(f) + '.ref').write_text(str(cloth.cache_key_frame))
+                index.setdefault(cloth.cache_key_frame, set()).add(f)
+                cloth.cache_last_frame = cloth.cache_key_frame
+                cloth.cache_last_co = key_co
+                return
+
+            if moved_count < moved.shape[0] * 0.5:
+                idx = np.arange(co.shape[0], dtype=np.int32)[moved]
+                np.savez(fp.joinpath(str(f) + '.npz'), base=cloth.cache_key_frame, idx=idx, co=co[moved])
+                index.setdefault(cloth.cache_key_frame, set()).add(f)
+                cloth.cache_last_frame = f
+                cloth.cache_last_co = np.array(co, dtype=np.float32)
+                return
+
+    write_full_frame(ob, fp, f, co)
+    cloth.cache_key_frame = f
+    cloth.cache_key_co = np.array(co, dtype=np.float32)
+    cloth.cache_last_frame = f
+    cloth.cache_last_co = cloth.cache_key_co
+
+
+# Cache functions ---------------
+class CacheState(object):
+    # stands in for the cloth in write_cache_frame
+    #   when cache_only runs on objects without one
+    pass
 
-    path = os.path.expanduser("~/Desktop")
-    self['cache_folder'] = path
-    mc_path = pathlib.Path(path).joinpath('MC_cache_files')
+
+# Cache functions ---------------
+def get_cache_state(ob, fp):
+    """Last and key frames written to a cache_only folder.
+    One per folder so a cloth caching elsewhere isn't affected."""
+    states = MC_data['cache_states']
+    state = states.get(str(fp))
+    if state is None:
+        state = CacheState()
+        state.cache_key_frame = None
+        state.cache_key_co = None
+        state.cache_last_frame = None
+        state.cache_last_co = None
+        states[str(fp)] = state
+    state.ob = ob
+    return state
+
+
+# Cache functions ---------------
+class RamCache(object):
+    # ring buffer of recent frames kept in memory
+    pass
+
+
+# Cache functions ---------------
+def get_ram_cache(cloth, vc):
+    """Return the ring buffer for the cloth. Rebuilds it when
+    the memory budget or the vertex count changes.
+    Returns None when the RAM cache is turned off."""
+    mb = cloth.ob.MC_props.cache_ram_mb
+    ram = cloth.ram_cache
+    if ram is not None:
+        if (ram.budget == mb) & (ram.buffer.shape[1] == vc):
+            return ram
+        ram_cache_flush(cloth)
+        cloth.ram_cache = None
+
+    slots = int(mb * 1024 * 1024) // (vc * 12)
+    if slots < 1:
+        return
+
+    ram = RamCache()
+    ram.budget = mb
+    ram.buffer = np.empty((slots, vc, 3), dtype=np.float32)
+    ram.slot_frame = [None] * slots
+    ram.dirty = np.zeros(slots, dtype=np.bool)
+    ram.lookup = {} # frame: slot
+    ram.next = 0    # oldest slot gets overwritten next
+    ram.hits = 0
+    ram.misses = 0
+    cloth.ram_cache = ram
+    return ram
+
+
+# Cache functions ---------------
+def ram_cache_get(cloth, f):
+    """Copy of frame f if it's in memory."""
+    ram = cloth.ram_cache
+    if ram is None:
+        return
+
+    if f in ram.lookup:
+        ram.hits += 1
+        return np.copy(ram.buffer[ram.lookup[f]])
+
+    ram.misses += 1
+
+
+# Cache functions ---------------
+def ram_cache_put(cloth, f, co, dirty=False):
+    """Keep frame f in memory. Dirty frames haven't been
+    written to disk yet and spill to the cache folder when
+    they get evicted. Returns False if the RAM cache is off."""
+    ram = get_ram_cache(cloth, co.shape[0])
+    if ram is None:
+        return False
+
+    if f in ram.lookup:
+        slot = ram.lookup[f]
+        ram.dirty[slot] |= dirty
+    else:
+        slot = ram.next
+        ram.next = (slot + 1) % ram.buffer.shape[0]
+        old = ram.slot_frame[slot]
+        if old is not None:
+            if ram.dirty[slot]:
+                write_cache_frame(cloth, cloth.cache_dir, old, ram.buffer[slot])
+            del(ram.lookup[old])
+        ram.slot_frame[slot] = f
+        ram.lookup[f] = slot
+        ram.dirty[slot] = dirty
+
+    ram.buffer[slot] = co
+    return True
+
+
+# Cache functions ---------------
+def ram_cache_flush(cloth):
+    """Write every dirty frame to disk oldest first
+    so back-references line up with the recording order."""
+    ram = cloth.ram_cache
+    if ram is None:
+        return
+
+    slots = ram.buffer.shape[0]
+    for i in range(slots):
+        slot = (ram.next + i) % slots
+        if ram.dirty[slot]:
+            write_cache_frame(cloth, cloth.cache_dir, ram.slot_frame[slot], ram.buffer[slot])
+            ram.dirty[slot] = False
+
+
+# Cache functions ---------------
+def compress_cache_pca(fp, error=0.001):
+    """Fit a low-rank basis to every frame in the cache folder.
+    Keeps the fewest components whose RMS vertex error is under
+    the target. Saves pca.npz and returns a report."""
+    frames = cache_frame_numbers(fp)
+    first = read_cache_frame(fp, frames[0])
+    vc = first.shape[0]
+
+    X = np.empty((frames.shape[0], vc * 3), dtype=np.float32)
+    for i, f in enumerate(frames):
+        co = read_cache_frame(fp, f)
+        if co.shape[0] != vc:
+            return
+        X[i] = co.ravel()
+
+    mean = np.mean(X, axis=0)
+    X -= mean
+    U, S, Vt = np.linalg.svd(X, full_matrices=False)
+
+    # rms[k] is the error when keeping k components
+    tail = np.append(np.cumsum((S ** 2)[::-1])[::-1], 0.0)
+    rms = np.sqrt(tail / (frames.shape[0] * vc))
+    k = int(np.argmax(rms <= error))
+
+    basis = np.array(Vt[:k], dtype=np.float32)
+    coeffs = np.array(U[:, :k] * S[:k], dtype=np.float32)
+
+    pca = fp.joinpath('pca.npz')
+    np.savez(pca, frames=frames, mean=mean, basis=basis, coeffs=coeffs)
+
+    # measure the worst vertex one frame at a time
+    worst = 0.0
+    for i in range(frames.shape[0]):
+        dif = X[i] - coeffs[i] @ basis
+        dif.shape = (vc, 3)
+        worst = max(worst, np.sqrt(np.max(np.einsum('ij,ij->i', dif, dif))))
+
+    raw = sum([i.stat().st_size for i in fp.iterdir() if i.name.split('.')[0].isdigit()])
+
+    report = {}
+    report['frames'] = frames.shape[0]
+    report['components'] = k
+    report['rms_error'] = float(rms[k])
+    report['max_error'] = float(worst)
+    report['raw_bytes'] = raw
+    report['pca_bytes'] = pca.stat().st_size
+    return report
+
+
+# Cache functions ---------------
+def read_pca_frame(fp, f):
+    """Rebuild frame f from pca.npz in the cache folder.
+    The arrays are held in MC_data after the first read
+    so each frame is one small matrix product."""
+    pca = fp.joinpath('pca.npz')
+    if not pca.exists():
+        return
+
+    key = str(pca)
+    mtime = pca.stat().st_mtime
+    held = MC_data['pca'].get(key)
+    if held is None:
+        held = (None, None)
+    if held[0] != mtime:
+        data = np.load(pca)
+        held = (mtime, {name: data[name] for name in ['frames', 'mean', 'basis', 'coeffs']})
+        MC_data['pca'][key] = held
+
+    data = held[1]
+    i = np.searchsorted(data['frames'], f)
+    if i == data['frames'].shape[0]:
+        return
+    if data['frames'][i] != f:
+        return
+
+    co = data['mean'] + data['coeffs'][i] @ data['basis']
+    co.shape = (co.shape[0] // 3, 3)
+    return co
+
+
+# Cache functions ---------------
+# the state spring_basic carries from one frame to the next
+checkpoint_arrays = ['co', 'velocity', 'pin_arr', 'feedback', 'vel_zero', 'select_start']
+
+
+# Cache functions ---------------
+def write_checkpoint(cloth, fp, f):
+    """Save the full cloth state at frame f
+    so the sim can be resumed from here."""
+    cp = fp.joinpath('checkpoints')
+    if not cp.exists():
+        cp.mkdir()
+
+    state = {name: getattr(cloth, name) for name in checkpoint_arrays}
+    np.savez(cp.joinpath(str(f) + '.npz'), **state)
+
+
+# Cache functions ---------------
+def read_checkpoint(fp, f):
+    """Find the latest checkpoint at or before frame f.
+    Returns the checkpoint frame and a dict of arrays
+    or None if there isn't one."""
+    cp = fp.joinpath('checkpoints')
+    if not cp.exists():
+        return
+
+    frames = [int(i.stem) for i in cp.iterdir() if i.stem.isdigit()]
+    frames = [i for i in frames if i <= f]
+    if len(frames) == 0:
+        return
+
+    cf = max(frames)
+    state = np.load(cp.joinpath(str(cf) + '.npz'))
+    return cf, {name: state[name] for name in checkpoint_arrays}
+
+
+# Cache functions ---------------
+# scene bundle layout:
+#   b'MCBUNDLE', int32 version, object count, start frame
+#   int32 vertex count for each object
+#   64 byte utf-8 name for each object
+#   then every frame, frame-major, as float32 Nx3 for all
+#   objects back to back in the order of the table
+# a .written file next to the bundle holds a byte for
+#   each object in each frame, frame-major. Zero means
+#   the slot was never written (writing past the end
+#   of the bundle zero fills the frames in between).
+bundle_name_bytes = 64
+
+
+# Cache functions ---------------
+def bundle_written_path(path):
+    """The file flagging which bundle slots hold frames"""
+    return pathlib.Path(str(path) + '.written')
+
+
+# Cache functions ---------------
+def get_bundle_path():
+    """The scene bundle lives next to the object cache folders"""
+    path = bpy.data.filepath
+    if path == '':
+        mc_path = pathlib.Path(os.path.expanduser("~/Desktop")).joinpath('MC_cache_files')
+    else:
+        mc_path = pathlib.Path(path).parent.joinpath('MC_cache_files')
 
     if not mc_path.exists():
         mc_path.mkdir()
 
-    final_path = mc_path.joinpath(ob.name)
-    self['cache_name'] = ob.name
-    final_path = mc_path.joinpath(ob.name)
+    return mc_path.joinpath(bpy.context.scene.MC_props.bundle_name + '.mcb')
 
-    # create dir if it doesn't exist
-    if not final_path.exists():
-        final_path.mkdir()
 
-    #f = bpy.context.scene.frame_current
-    f = ob.MC_props.current_cache_frame
-    ob.MC_props['current_cache_frame'] = f + 1
-    if frame is not None:
-        f = frame
+# Cache functions ---------------
+def create_cache_bundle(path, names, counts, start):
+    """Write the header for a new bundle.
+    Overwrites any existing bundle at path."""
+    with open(path, 'wb') as file:
+        file.write(b'MCBUNDLE')
+        np.array([1, len(names), start], dtype=np.int32).tofile(file)
+        np.array(counts, dtype=np.int32).tofile(file)
+        for name in names:
+            file.write(name.encode('utf-8')[:bundle_name_bytes].ljust(bundle_name_bytes, b'\0'))
+
+    # nothing written yet
+    open(bundle_written_path(path), 'wb').close()
+
+
+# Cache functions ---------------
+def read_bundle_header(path):
+    """Returns a dict with the object table and byte
+    offsets for finding objects and frames in the bundle"""
+    with open(path, 'rb') as file:
+        if file.read(8) != b'MCBUNDLE':
+            return
+        # python ints so the byte offsets can't overflow int32
+        version, count, start = [int(i) for i in np.fromfile(file, dtype=np.int32, count=3)]
+        counts = np.fromfile(file, dtype=np.int32, count=count).astype(np.int64)
+        names = [file.read(bundle_name_bytes).rstrip(b'\0').decode('utf-8') for i in range(count)]
+
+    offsets = np.zeros(count + 1, dtype=np.int64)
+    np.cumsum(counts, out=offsets[1:])
+
+    header = {}
+    header['path'] = str(path)
+    header['start'] = start
+    header['names'] = names
+    header['counts'] = counts
+    header['offsets'] = offsets # in verts
+    header['frame_bytes'] = int(offsets[-1]) * 12
+    header['size'] = 20 + count * (4 + bundle_name_bytes)
+
+    # bundles from before the flags were added trust every slot
+    header['written'] = None
+    written = bundle_written_path(path)
+    if written.exists():
+        header['written'] = str(written)
+    return header
+
+
+# Cache functions ---------------
+def get_bundle_header(create=False):
+    """Header of the scene bundle. Creating a new bundle
+    includes every cloth and cache only object in the scene."""
+    path = get_bundle_path()
+    header = MC_data.get('bundle')
+    if header is not None:
+        if header['path'] == str(path):
+            return header
+
+    MC_data['bundle'] = None
+    MC_data['bundle_frame'] = None
+    if not path.exists():
+        if not create:
+            return
+        obs = [ob for ob in bpy.context.scene.objects if ob.MC_props.cloth]
+        names = [ob.name for ob in obs]
+        counts = [len(ob.data.vertices) for ob in obs]
+        create_cache_bundle(path, names, counts, bpy.context.scene.frame_start)
+
+    MC_data['bundle'] = read_bundle_header(path)
+    return MC_data['bundle']
+
+
+# Cache functions ---------------
+def write_bundle_frame(header, f, name, co):
+    """Write one object's coords into its slot in frame f"""
+    if name not in header['names']:
+        return
+    i = header['names'].index(name)
+    if co.shape[0] != header['counts'][i]:
+        return
+    fi = int(f) - header['start']
+    if fi < 0:
+        return
+
+    offset = header['size'] + fi * header['frame_bytes'] + int(header['offsets'][i]) * 12
+    with open(header['path'], 'r+b') as file:
+        file.seek(offset)
+        np.array(co, dtype=np.float32).tofile(file)
+
+    if header['written'] is not None:
+        with open(header['written'], 'r+b') as file:
+            file.seek(fi * len(header['names']) + i)
+            file.write(b'\1')
+
+    # the frame we were holding for playback is out of date
+    held = MC_data.get('bundle_frame')
+    if held is not None:
+        if held[0] == f:
+            MC_data['bundle_frame'] = None
+
+
+# Cache functions ---------------
+def read_bundle_frame(header, f):
+    """Read every object in frame f with one sequential read.
+    Returns a flat float32 Nx3 array for all objects
+    or None if the frame isn't in the bundle. Check
+    read_bundle_written for the slots that hold coords."""
+    fi = int(f) - header['start']
+    if fi < 0:
+        return
+
+    total = int(header['offsets'][-1])
+    with open(header['path'], 'rb') as file:
+        file.seek(header['size'] + fi * header['frame_bytes'])
+        co = np.fromfile(file, dtype=np.float32, count=total * 3)
+
+    if co.shape[0] < total * 3:
+        # the last frame may only have its first objects written
+        if header['written'] is None:
+            return
+        co = np.concatenate([co, np.zeros(total * 3 - co.shape[0], dtype=np.float32)])
+    co.shape = (total, 3)
+    return co
+
+
+# Cache functions ---------------
+def read_bundle_written(header, f):
+    """Bool for each object, True where frame f was
+    written to its slot in the bundle"""
+    count = len(header['names'])
+    if header['written'] is None:
+        return np.ones(count, dtype=np.bool)
+
+    written = np.zeros(count, dtype=np.bool)
+    fi = int(f) - header['start']
+    if fi < 0:
+        return written
+
+    with open(header['written'], 'rb') as file:
+        file.seek(fi * count)
+        flags = np.fromfile(file, dtype=np.uint8, count=count)
+
+    written[:flags.shape[0]] = flags > 0
+    return written
+
+
+# Cache functions ---------------
+def bundle_co(name, f):
+    """Coords for one object from the scene bundle. The frame
+    is read once and held so the other objects share it."""
+    header = get_bundle_header()
+    if header is None:
+        return
+    if name not in header['names']:
+        return
+
+    held = MC_data.get('bundle_frame')
+    if held is None:
+        held = (f, read_bundle_frame(header, f), read_bundle_written(header, f))
+        MC_data['bundle_frame'] = held
+    elif held[0] != f:
+        held = (f, read_bundle_frame(header, f), read_bundle_written(header, f))
+        MC_data['bundle_frame'] = held
+
+    co = held[1]
+    if co is None:
+        return
+
+    # unwritten slots fall back to the object's own cache
+    i = header['names'].index(name)
+    if not held[2][i]:
+        return
+    return np.copy(co[header['offsets'][i]: header['offsets'][i + 1]])
+
+
+# Cache functions ---------------
+# PC2 point cache:
+#   b'POINTCACHE2\0', int32 version, point count,
+#   float32 start frame, sample rate, int32 sample count
+#   then float32 Nx3 for every sample
+# recorded files get a .written file next to them with
+#   a byte for each sample like the scene bundle. Samples
+#   skipped while recording hold the last written sample
+#   for other apps but read back as None here.
+pc2_header_bytes = 32
+
+
+# Cache functions ---------------
+def pc2_written_path(path):
+    """The file flagging which PC2 samples were recorded"""
+    return pathlib.Path(str(path) + '.written')
+
+
+# Cache functions ---------------
+def get_pc2_path(ob):
+    """PC2 files sit beside the object's cache folder"""
+    fp = check_file_path(ob)[1]
+    return fp.parent.joinpath(fp.name + '.pc2')
+
+
+# Cache functions ---------------
+def write_pc2_header(file, count, start, samples, rate=1.0):
+    file.write(b'POINTCACHE2\0')
+    np.array([1, count], dtype='<i4').tofile(file)
+    np.array([start, rate], dtype='<f4').tofile(file)
+    np.array([samples], dtype='<i4').tofile(file)
+
+
+# Cache functions ---------------
+def read_pc2_header(path):
+    """Returns the point count, start frame,
+    sample rate and sample count"""
+    with open(path, 'rb') as file:
+        if file.read(12) != b'POINTCACHE2\0':
+            return
+        version, count = np.fromfile(file, dtype='<i4', count=2)
+        start, rate = np.fromfile(file, dtype='<f4', count=2)
+        samples = np.fromfile(file, dtype='<i4', count=1)[0]
+    return int(count), float(start), float(rate), int(samples)
+
+
+# Cache functions ---------------
+def write_pc2_frame(path, f, co, start=None):
+    """Write frame f into its sample in a PC2 file so
+    re-recorded frames replace what was there.
+    Passing start begins a new file. The sample count in
+    the header covers the last sample written so the file
+    is always valid."""
+    written = pc2_written_path(path)
+    if start is not None:
+        with open(path, 'wb') as file:
+            write_pc2_header(file, co.shape[0], start, 0)
+        open(written, 'wb').close()
+
+    header = read_pc2_header(path)
+    if header is None:
+        return
+    count, start, rate, samples = header
+    if count != co.shape[0]:
+        return
+
+    # PC2 can't hold frames before its start frame
+    i = int(round((f - start) / rate))
+    if i < 0:
+        print('frame', f, 'is before the start of', path)
+        return
+
+    with open(path, 'r+b') as file:
+        if i > samples:
+            # skipped samples hold the last one written
+            held = np.array(co, dtype='<f4')
+            if samples > 0:
+                file.seek(pc2_header_bytes + (samples - 1) * count * 12)
+                held = np.fromfile(file, dtype='<f4', count=count * 3)
+            file.seek(pc2_header_bytes + samples * count * 12)
+            for s in range(samples, i):
+                held.tofile(file)
+
+        file.seek(pc2_header_bytes + i * count * 12)
+        np.array(co, dtype='<f4').tofile(file)
+        if i >= samples:
+            file.seek(28)
+            np.array([i + 1], dtype='<i4').tofile(file)
+
+    if written.exists():
+        with open(written, 'r+b') as file:
+            file.seek(i)
+            file.write(b'\1')
+
+
+# Cache functions ---------------
+def read_pc2_frame(path, f):
+    """Load the sample nearest frame f from a PC2 file.
+    Returns None outside the sampled range or for
+    samples that were skipped while recording."""
+    header = read_pc2_header(path)
+    if header is None:
+        return
 
-    txt = final_path.joinpath(str(f))
+    count, start, rate, samples = header
+    i = int(round((f - start) / rate))
+    if (i < 0) | (i >= samples):
+        return
 
-    np.savetxt(txt, get_proxy_co(ob))
+    # files from other apps trust every sample
+    written = pc2_written_path(path)
+    if written.exists():
+        with open(written, 'rb') as file:
+            file.seek(i)
+            if file.read(1) != b'\1':
+                return
+
+    with open(path, 'rb') as file:
+        file.seek(pc2_header_bytes + i * count * 12)
+        co = np.fromfile(file, dtype='<f4', count=count * 3)
+
+    co.shape = (count, 3)
+    return co
 
 
 # Cache functions ---------------
@@ -218,18 +1029,39 @@ def cache(cloth, keying=False):
         f = ccf
         ob.MC_props['current_cache_frame'] = ccf + 1
 
-    txt = fp.joinpath(str(f))
-
     #sf = cloth.ob.MC_props.start_frame
     #ef = cloth.ob.MC_props.end_frame
     #if (f >= sf) & (f <= ef):
 
-    nonexistent = not txt.exists()
+    nonexistent = cache_frame_path(fp, f) is None
+    if cloth.ram_cache is not None:
+        nonexistent &= f not in cloth.ram_cache.lookup
 
     #np.savetxt(txt, cloth.co)
     if (nonexistent | ob.MC_props.overwrite_cache):
-        np.savetxt(txt, cloth.co)
-        print('saved a cache file: ', txt)
+        # goes to disk when it gets pushed out of the RAM cache
+        if not ram_cache_put(cloth, f, cloth.co, dirty=True):
+            write_cache_frame(cloth, fp, f, cloth.co)
+            print('saved a cache file: ', fp.joinpath(str(f)))
+
+        if bpy.context.scene.MC_props.bundle_record:
+            write_bundle_frame(get_bundle_header(create=True), f, ob.name, cloth.co)
+
+        if ob.MC_props.pc2_record:
+            start = None
+            if not cloth.pc2_started:
+                start = f
+                cloth.pc2_started = True
+            write_pc2_frame(get_pc2_path(ob), f, cloth.co, start)
+
+        # cache only objects don't have any cloth state to save
+        if ob.MC_props.cache_only:
+            return
+
+        interval = ob.MC_props.checkpoint_interval
+        if interval > 0:
+            if f % interval == 0:
+                write_checkpoint(cloth, fp, f)
 
 
 # Cache functions ---------------
@@ -237,12 +1069,17 @@ def play_cache(cloth, cb=False):
     """Load a text file of Nx3 numpy coords."""
 
     ob = cloth.ob
+    pc2 = ob.MC_props.pc2_file
 
+    # an external PC2 can play without a cache folder
     if not hasattr(cloth, "cache_dir"):
-        ob.MC_props['play_cache'] = False
-        return
+        if pc2 == '':
+            ob.MC_props['play_cache'] = False
+            return
+        cloth.cache_dir = check_file_path(ob)[1]
 
-    cache_interpolation(cloth) # Finish this !!!
+    if cloth.cache_dir.exists():
+        cache_interpolation(cloth) # Finish this !!!
 
     f = bpy.context.scene.frame_current
 
@@ -255,10 +1092,28 @@ def play_cache(cloth, cb=False):
 
     fp = cloth.cache_dir
 
-    txt = fp.joinpath(str(f))
+    co = None
+    if pc2 != '':
+        pc2 = pathlib.Path(bpy.path.abspath(pc2))
+        if pc2.exists():
+            co = read_pc2_frame(pc2, f)
+            if co is not None:
+                if co.shape[0] != len(ob.data.vertices):
+                    co = None
 
-    if txt.exists():
-        cloth.co = np.loadtxt(txt)
+    if co is None:
+        if bpy.context.scene.MC_props.bundle_playback:
+            co = bundle_co(ob.name, f)
+
+    if co is None:
+        co = ram_cache_get(cloth, f)
+    if co is None:
+        co = read_cache_frame(fp, f)
+        if co is not None:
+            ram_cache_put(cloth, f, co)
+
+    if co is not None:
+        cloth.co = co
 
     key = 'MC_current'
     # cache only playback
@@ -301,27 +1156,7 @@ def get_bary_weights(tris, points):
     """Find barycentric weights for triangles.
     Tris is a Nx3x3 set of triangle coords.
     points is the same N in Nx3 coords"""
-    origins = tris[:, 0]
-    cross_vecs = tris[:, 1:] - origins[:, None]
-    v2 = points - origins
-
-    # ---------
-    v0 = cross_vecs[:,0]
-    v1 = cross_vecs[:,1]
-
-    d00_d11 = np.einsum('ijk,ijk->ij', cross_vecs, cross_vecs)
-    d00 = d00_d11[:,0]
-    d11 = d00_d11[:,1]
-    d01 = np.einsum('ij,ij->i', v0, v1)
-    d02 = np.einsum('ij,ij->i', v0, v2)
-    d12 = np.einsum('ij,ij->i', v1, v2)
-
-    div = 1 / (d00 * d11 - d01 * d01)
-    u = (d11 * d02 - d01 * d12) * div
-    v = (d00 * d12 - d01 * d02) * div
-
-    weights = np.array([1 - (u+v), u, v, ]).T
-    return weights
+    return bary_project(tris, points).weights
 
 
 def get_normals_from_tris(tris):
@@ -689,58 +1524,29 @@ def box_bary_weights(poly, point, vals=[]):
 
 
 # universal ---------------
-def inside_triangles(tris, points, check=True, surface_offset=False, cloth=None):
+def inside_triangles(tris, points, check=True, surface_offset=False, cloth=None, out=None):
     """Can check inside triangle.
     Can find barycentric weights for triangles.
     Can find multiplier for distance off surface
-        from non-unit cross product."""
-    origins = tris[:, 0]
-    cross_vecs = tris[:, 1:] - origins[:, nax]
-    v2 = points - origins
-
-    # ---------
-    v0 = cross_vecs[:,0]
-    v1 = cross_vecs[:,1]
-
-    d00_d11 = np.einsum('ijk,ijk->ij', cross_vecs, cross_vecs)
-    d00 = d00_d11[:,0]
-    d11 = d00_d11[:,1]
-    d01 = np.einsum('ij,ij->i', v0, v1)
-    d02 = np.einsum('ij,ij->i', v0, v2)
-    d12 = np.einsum('ij,ij->i', v1, v2)
-
-    div = 1 / (d00 * d11 - d01 * d01)
-    u = (d11 * d02 - d01 * d12) * div
-    v = (d00 * d12 - d01 * d02) * div
-
-    weights = np.array([1 - (u+v), u, v, ]).T
+        from non-unit cross product.
+    out is a set of bary_buffers to write into."""
+    B = bary_project(tris, points, out=out)
     if not check | surface_offset:
-        return weights
+        return B.weights
 
     if not check:
-        cross = np.cross(cross_vecs[:,0], cross_vecs[:,1])
-        d_v2_c = np.einsum('ij,ij->i', v2, cross)
-        d_v2_v2 = np.einsum('ij,ij->i', cross, cross)
-        div = d_v2_c / d_v2_v2
-
-        U_cross = cross / np.sqrt(d_v2_v2)[:, None]
-        U_d = np.einsum('ij,ij->i', v2, U_cross)
-
-
-        return weights, div, U_d# for normalized
+        return B.weights, B.div, B.offset # offset is along the unit normal
 
-    check = np.all(weights > 0, axis=0)
-    # check if bitwise is faster when using lots of tris
-    if False:
-        check = (u > 0) & (v > 0) & (u + v < 1)
-
-    return weights.T, check
+    return B.weights, B.inside
 
 
-def cpoe_bend_plot_values(cloth):
+def cpoe_bend_plot_values(cloth, co=None):
+    """Bend plot values from the rest shape.
+    co defaults to the MC_source shape key."""
 
     # get axis vecs
-    co = get_co_shape(cloth.ob, key="MC_source")
+    if co is None:
+        co = get_co_shape(cloth.ob, key="MC_source")
     be = cloth.bend_edges
     tt = cloth.bend_tri_tips.reshape(be.shape)   #[:, ::-1] # flip it to the other side
     po_vecs = co[tt] - co[be[:, 0]][:, None]
@@ -752,7 +1558,7 @@ def cpoe_bend_plot_values(cloth):
     d_po = np.einsum('ij, ikj->ik', axis_vecs, po_vecs)
     d_axis = np.einsum('ij,ij->i', axis_vecs, axis_vecs)
     # --------------------------------------
-    cloth.axis_div = np.nan_to_num(d_po / d_axis[:, None])
+    cloth.axis_div = d_po / np.maximum(d_axis, div_eps)[:, None]
     """
     A pair of axis dots for each axis. One for each tri tip, and a partridge in a pair tree.
     """
@@ -764,7 +1570,8 @@ def cpoe_bend_plot_values(cloth):
     n_3 = (n_2_3[0] *2, 3)
     cross.shape = n_3
     po_vecs.shape = cross.shape
-    U_cross = cross / np.sqrt(np.einsum('ij, ij->i', cross, cross))[:, None]
+    d_cross = np.einsum('ij, ij->i', cross, cross)
+    U_cross = cross / np.sqrt(np.maximum(d_cross, div_eps))[:, None]
     # --------------------------------------
     cloth.cross_div = np.einsum('ij, ij->i', U_cross, po_vecs)[:, None]
     """
@@ -777,7 +1584,7 @@ def cpoe_bend_plot_values(cloth):
     tri_vecs.shape = n_3
     cross.shape = n_3
     d_tv = np.einsum('ij, ij->i', tri_vecs, tri_vecs)
-    U_tri = tri_vecs / np.sqrt(d_tv)[:, None]
+    U_tri = tri_vecs / np.sqrt(np.maximum(d_tv, div_eps))[:, None]
     # --------------------------------------
     cloth.tri_div = np.einsum('ij, ij->i', U_tri, po_vecs)[:, None]
     """
@@ -785,6 +1592,11 @@ def cpoe_bend_plot_values(cloth):
     along the surface of the tri opposite the tip.
     """
 
+    # zero length hinges and flat tris have no bend direction.
+    #   their tips get no bend force (used to be NaNs)
+    dead = np.repeat(d_axis <= div_eps, 2) | (d_cross <= div_eps) | (d_tv <= div_eps)
+    cloth.bend_dead = np.arange(dead.shape[0])[dead]
+
 
 def cpoe_bend_plot(cloth):
     """Plot values based on cpoe using axis and cross products"""
@@ -811,8 +1623,8 @@ def cpoe_bend_plot(cloth):
     n_3 = (n_2_3[0] * 2, 3)
     cross.shape = n_3
     po_vecs.shape = cross.shape
-    U_cross = cross / np.sqrt(np.einsum('ij, ij->i', cross, cross))[:, None]
-    cross_plot = np.nan_to_num(U_cross) * cross_div
+    U_cross = cross / np.sqrt(np.maximum(np.einsum('ij, ij->i', cross, cross), div_eps))[:, None]
+    cross_plot = U_cross * cross_div
 
     # plot along tri surface
     cross.shape = n_2_3
@@ -820,10 +1632,10 @@ def cpoe_bend_plot(cloth):
     tri_vecs.shape = n_3
     cross.shape = n_3
 
-    d_tv = np.sqrt(np.einsum('ij, ij->i', tri_vecs, tri_vecs))
+    d_tv = np.sqrt(np.maximum(np.einsum('ij, ij->i', tri_vecs, tri_vecs), div_eps))
     U_tri = tri_vecs / d_tv[:, None]
 
-    tri_plot = np.nan_to_num(U_tri) * tri_div
+    tri_plot = U_tri * tri_div
 
     axis_plot.shape = n_3
     plot = tri_plot + axis_plot + cross_plot
@@ -835,6 +1647,7 @@ def get_cloth(ob):
     """Return the cloth instance from the object"""
     return MC_data['cloths'][ob['MC_cloth_id']]
 
+
 # ^                                                          ^ #
 # ^                 END universal functions                  ^ #
 # ============================================================ #
@@ -925,17 +1738,49 @@ def get_bend_sets(cloth):
 
     ob = cloth.ob
     tridex, obm = get_tridex_2(ob)
-    obm.edges.ensure_lookup_table()
     T = time.time()
-    bend_data = np.array([[e.verts[0].index, e.verts[1].index, e.index] for e in obm.edges if len(e.link_faces) == 2], dtype=np.int32)
-    if bend_data.shape[0] == 0:
+
+    hinges = bend_hinges(tridex)
+    if hinges is None:
         cloth.bend_data = None
         return
-    bend_edges = bend_data[:, :2]
-    ed_idx = bend_data[:, -1:].ravel()
+    bend_edges, tri_tips, c, keys = hinges
+
+    # index of each bend edge in the bmesh edges
+    ed_keys = pair_keys([[e.verts[0].index, e.verts[1].index] for e in obm.edges])
+    ed_order = np.argsort(ed_keys)
+    ed_idx = ed_order[np.searchsorted(ed_keys[ed_order], keys)]
+
+    # write to class instance
+    cloth.tridex = tridex
+    cloth.bend_ed_idx = ed_idx
+    cloth.bend_edges = bend_edges
+    cloth.bend_tri_tips = tri_tips
+    cloth.bend_tris = c
+    obm.free()
+
+    # can be dynamic
+    bary_bend_springs(cloth)
+    cloth.bend_tri_tip_array = np.zeros(len(cloth.ob.data.vertices), dtype=np.float32)#[:, None]
 
-    lf = [obm.edges[e].link_faces for e in ed_idx]
-    fidx = np.array([[i[0].index, i[1].index] for i in lf])
+
+def bend_hinges(tridex):
+    """Edges used by exactly two tris are bend edges.
+    Returns the bend edges, the tris on either side,
+    the tip of each tri paired with the tri on the
+    opposite side and the edge keys.
+    None when nothing bends."""
+    # sorting the tri edge keys puts both tris together
+    tri_edges = tridex[:, [0, 1, 1, 2, 2, 0]].reshape(-1, 2)
+    keys = pair_keys(tri_edges)
+    order = np.argsort(keys, kind='stable')
+    sk = keys[order]
+    u, start, counts = np.unique(sk, return_index=True, return_counts=True)
+    two = start[counts == 2]
+    if two.shape[0] == 0:
+        return
+    bend_edges = key_pairs(sk[two]).astype(np.int32)
+    fidx = np.column_stack((order[two], order[two + 1])) // 3
 
     c = tridex[fidx.ravel()]
     a = bend_edges.ravel()[:, None]
@@ -950,18 +1795,7 @@ def get_bend_sets(cloth):
     shape = tri_tips.shape
     tri_tips.shape = (shape[0]//2, 2)
     tri_tips = tri_tips[:,::-1].ravel()
-
-    # write to class instance
-    cloth.tridex = tridex
-    cloth.bend_ed_idx = ed_idx
-    cloth.bend_edges = bend_edges
-    cloth.bend_tri_tips = tri_tips
-    cloth.bend_tris = c
-    obm.free()
-
-    # can be dynamic
-    bary_bend_springs(cloth)
-    cloth.bend_tri_tip_array = np.zeros(len(cloth.ob.data.vertices), dtype=np.float32)#[:, None]
+    return bend_edges, tri_tips, c, sk[two]
 
 
 def bary_bend_springs(cloth):
@@ -970,7 +1804,16 @@ def bary_bend_springs(cloth):
     co = get_co_shape(cloth.ob, key='MC_source')
     tris = co[cloth.bend_tris]
     points = co[cloth.bend_tri_tips]
-    weights, surface_offset, U_d = inside_triangles(tris, points, check=False, surface_offset=True, cloth=cloth)
+
+    # reruns when switching shape keys so keep the buffers
+    #   while the bend set stays the same size
+    if hasattr(cloth, 'bend_bary'):
+        if cloth.bend_bary.weights.shape[0] != points.shape[0]:
+            del(cloth.bend_bary)
+    if not hasattr(cloth, 'bend_bary'):
+        cloth.bend_bary = bary_buffers(points.shape[0])
+
+    weights, surface_offset, U_d = inside_triangles(tris, points, check=False, surface_offset=True, out=cloth.bend_bary)
     # 44444
     cloth.zero_surface_bool = None
     cloth.bend_weights = weights[:,:,None]
@@ -1130,23 +1973,16 @@ def virtual_springs(cloth):
     #   array after we check that all the
     #   verts in the virtual springs are
     #   still in the mesh.
-    verts = cloth.virtual_spring_verts
+    verts = np.array(cloth.virtual_spring_verts, dtype=np.int64)
     ed = cloth.basic_set
 
-    string_spring = [str(e[0]) + str(e[1]) for e in ed]
+    # every ordered pair of the verts
+    v, j = np.meshgrid(verts, verts, indexing='ij')
+    new_ed = np.column_stack((v.ravel(), j.ravel()))
+    new_ed = new_ed[new_ed[:, 0] != new_ed[:, 1]]
 
-    strings = []
-    new_ed = []
-    for v in verts:
-        for j in verts:
-            if j != v:
-                stringy = str(v) + str(j)
-                strings.append(stringy)
-                #if stringy not in string_spring:
-                new_ed.append([v,j])
-
-    in1d = np.in1d(strings, string_spring)
-    cull_ed = np.array(new_ed)[~in1d]
+    in1d = pairs_in(new_ed, ed, ordered=True)
+    cull_ed = new_ed[~in1d]
     cloth.virtual_springs = cull_ed # store it for checking when changing geometry
     cloth.basic_set = np.append(cloth.basic_set, cull_ed, axis=0)
     cloth.basic_v_fancy = cloth.basic_set[:,0]
@@ -1162,18 +1998,11 @@ def get_springs_2(cloth):
     obm.verts.ensure_lookup_table()
 
     TT = time.time()
-    ed = []
-    for v in obm.verts:
-        v_set = []
-        for f in v.link_faces:
-            for vj in f.verts:
-                if vj != v:
-                    stri = str(v.index) + str(vj.index)
-                    if stri not in v_set:
-                        ed.append([v.index, vj.index])
-                        v_set.append(stri)
-
-    cloth.basic_set = np.array(ed)
+    # a spring each way between every pair of verts that share a face
+    faces = [[v.index for v in f.verts] for f in obm.faces]
+    ed = unique_pairs(face_pairs(faces), ordered=True)
+
+    cloth.basic_set = ed
     cloth.basic_v_fancy = cloth.basic_set[:,0]
 
 # ^                                                          ^ #
@@ -1222,6 +2051,12 @@ def create_instance(ob=None):
             cloth.mode = None
         cloth.undo = False
         cloth.selected = np.array([True, True], dtype=np.bool)
+        cloth.cache_key_frame = None # last full frame written to the cache
+        cloth.cache_key_co = None
+        cloth.cache_last_frame = None # last frame that wasn't a reference
+        cloth.cache_last_co = None
+        cloth.ram_cache = None # recent frames in memory for scrubbing
+        cloth.pc2_started = False # recording starts a new PC2 file
         return cloth # don't calculate all this crap if we're just caching
 
     # check for groups:
@@ -1244,6 +2079,12 @@ def create_instance(ob=None):
     cloth.selected = np.zeros(len(ob.data.vertices), dtype=np.bool)
     cloth.grab = np.zeros(len(ob.data.vertices), dtype=np.bool)
     cloth.current_cache_frame = 1 # for the cache continuous playback
+    cloth.cache_key_frame = None # last full frame written to the cache
+    cloth.cache_key_co = None
+    cloth.cache_last_frame = None # last frame that wasn't a reference
+    cloth.cache_last_co = None
+    cloth.ram_cache = None # recent frames in memory for scrubbing
+    cloth.pc2_started = False # recording starts a new PC2 file
 
     # surface follow data ------------------------------------------
     cloth.surface_tridex = None         # (index of tris in surface object)
@@ -1315,6 +2156,7 @@ def create_instance(ob=None):
     cloth.axis_div = None
     cloth.cross_div = None
     cloth.tri_div = None
+    cloth.bend_dead = None
     cpoe_bend_plot_values(cloth)
 
     # poly_quat bend springs ---------
@@ -1417,7 +2259,7 @@ def measure_edges(co, idx):
     r = idx[:,1]
     v = co[r] - co[l]
     d = np.einsum("ij ,ij->i", v, v)
-    return v, d, np.nan_to_num(np.sqrt(d))
+    return v, d, np.sqrt(d)
 
 
 def stretch_springs_basic(cloth, target=None): # !!! need to finish this
@@ -1484,30 +2326,51 @@ def surface_forces(cloth):
 #                  seam wrangler functions                     #
 #                                                              #
 
+# seam wrangler -------------
+def scaled_weights(data, xy_s):
+    """Bary weights for the seam points with the xy
+    scale applied. The tiled start tris only get
+    solved once and each scale only once so changing
+    other settings between stages costs nothing."""
+    key = (float(xy_s[0]), float(xy_s[1]))
+    if key in data['scaled_weights']:
+        return data['scaled_weights'][key]
+
+    if data['bary_grads'] is None:
+        tiled_start = data['tri_co_start'][data['tri_tiler']] # shaped N,3,3
+        data['bary_grads'] = bary_linear(tiled_start) # flat tris are masked out of active_vp
+    grads, offsets = data['bary_grads']
+
+    scaler = np.array([xy_s[0], xy_s[1], 1], dtype=np.float32)
+    uv = np.einsum('ijk,ik->ij', grads, data['with_z'] * scaler) + offsets
+
+    weights = np.empty((uv.shape[0], 3), dtype=np.float32)
+    weights[:, 0] = 1 - (uv[:, 0] + uv[:, 1])
+    weights[:, 1:] = uv
+    data['scaled_weights'][key] = weights
+    return weights
+
+
 # seam wrangler -------------
 def weight_plot(data, cloth):
     """Use trianlges to plot the slices from bary weights"""
 
-    tri_ob = data['tri_mesh_ob']
     tri_co = np.copy(cloth.co)
 
     t_shape = tri_co.shape
     tri_co.shape = (t_shape[0]//3, 3, 3)
-    tiled = tri_co[data['tri_tiler']]
+    rows = data['active_vp'] # vps in seams that haven't converged
+    tiled = tri_co[data['tri_tiler'][rows]]
 
     # apply xy scale
     xy_s = data['xy_scale']
 
     if ((xy_s[0] != 1.0) | (xy_s[1] != 1.0)):
-        tri_co_start = data['tri_co_start'] # shaped N,3,3
-        tiled_start = tri_co_start[data['tri_tiler']]
-        scaler = np.array([xy_s[0], xy_s[1], 1], dtype=np.float32)
-        points = data['with_z'] * scaler
-        new_weights = get_bary_weights(tiled_start, points)
-        plot = np.sum(tiled * new_weights[:,:,None], axis=1)
+        new_weights = scaled_weights(data, xy_s)
+        plot = np.sum(tiled * new_weights[rows][:,:,None], axis=1)
         return plot
 
-    plot = np.sum(tiled * data['weights'][:,:,None], axis=1)
+    plot = np.sum(tiled * data['weights'][rows][:,:,None], axis=1)
     return plot
 
 
@@ -1518,21 +2381,19 @@ def pure_linear(cloth, data):
     #print('pure_linear disabled')
     #return
     co = data['cloth_co']
-    sp = data['springs']
+    sp = data['active_springs'] # converged seams are masked out
     ls = sp[:,0]
     rs = sp[:,1]
-    l = data['dists']
+    l = data['active_dists']
     stretch = data['seam_influence']  * 0.5 # only moving left side
 
-    c = MC_data['count']
-
     s_iters = data['linear_iters']
     for i in range(s_iters):
 
         # current vec, dot, length
         cv = co[rs] - cloth.co[ls]
         cd = np.einsum("ij ,ij->i", cv, cv)
-        cl = np.sqrt(cd)
+        cl = np.maximum(np.sqrt(cd), div_eps)
 
         move_l = (cl - l) * stretch
 
@@ -1540,14 +2401,14 @@ def pure_linear(cloth, data):
         data['stretch_array'][:] = 0.0
         rock_hard_abs = np.abs(move_l)
         np.add.at(data['stretch_array'], ls, rock_hard_abs)
+        np.maximum(data['stretch_array'], div_eps, out=data['stretch_array'])
         weights = rock_hard_abs / data['stretch_array'][ls]
         # mean method -------------------
 
         # apply forces ------------------
         move = cv * (move_l / cl)[:,None]
         move *= weights[:,None]
-        np.add.at(cloth.co, ls, np.nan_to_num(move))
-        #print(np.any(np.isnan(weights)), "nanny here")
+        np.add.at(cloth.co, ls, move)
 
 
 # seam wrangler -------------
@@ -1586,11 +2447,11 @@ def seam_position(cloth, data):
     #cloth.co.ravel()[:] = co.ravel()[:]
     #return
 
-    if MC_data['count'] == 0:
+    if data['sw_count'] == 0:
         cloth.co.ravel()[:] = co.ravel()[:]
         return
 
-    if MC_data['count'] in data['partial_set']:
+    if data['sw_count'] in data['partial_set']:
         mean_idx = data['good_ravel']
         cloth.co.ravel()[mean_idx] = co.ravel()[mean_idx]
         return
@@ -1600,8 +2461,9 @@ def seam_position(cloth, data):
 
 
 # seam wrangler -------------
-def seam_updater(cloth, data):
-    # overwrite co
+def seam_cloth_key(data):
+    """The garment shape key the seams get written to.
+    The last key at full value other than sw_view."""
     ob = data['ob']
 
     cloth_key = 'sw_view'
@@ -1617,6 +2479,38 @@ def seam_updater(cloth, data):
             msg = ["!!! Warning. More than one shape key with value of 1" for i in range(3)]
             msg += names
             b_log(msg)
+    return cloth_key
+
+
+# seam wrangler -------------
+def seam_plot_update(cloth, data, cloth_key):
+    """Pull the seams toward the slices plotted
+    on the tris and write the garment shape key"""
+    ob = data['ob']
+    plot = weight_plot(data, cloth) # scales xy
+    if data['vis_mesh']:
+        link_mesh(plot.tolist(), [], [], 'plot test. Frame: ' + str(bpy.context.scene.frame_current))
+
+    # apply slice force:
+    #if False:
+    b_log(['tri_influence when actually called', data['tri_influence']])
+    vps = data['vps'][data['active_vp']]
+    vecs = (plot - data['cloth_co'][vps]) * data['tri_influence']
+    #print('tri influence on seams', data['tri_influence'])
+    #print("MC_tools.py line 1543 testing influence")
+    #vecs = (plot - data['cloth_co'][data['vps']]) * .01# data['tri_influence']
+
+    data['cloth_co'][vps] += vecs
+
+    ob.data.shape_keys.key_blocks[cloth_key].data.foreach_set('co', data['cloth_co'].ravel())
+    ob.data.update()
+
+
+# seam wrangler -------------
+def seam_updater(cloth, data):
+    # overwrite co
+    ob = data['ob']
+    cloth_key = seam_cloth_key(data)
 
     get_proxy_co(ob, data['cloth_co'])
 
@@ -1634,22 +2528,7 @@ def seam_updater(cloth, data):
     if cloth.current_iter != cloth.last_iter -1:
         return True
 
-    plot = weight_plot(data, cloth) # scales xy
-    if data['vis_mesh']:
-        link_mesh(plot.tolist(), [], [], 'plot test. Frame: ' + str(bpy.context.scene.frame_current))
-
-    # apply slice force:
-    #if False:
-    b_log(['tri_influence when actually called', data['tri_influence']])
-    vecs = (plot - data['cloth_co'][data['vps']]) * data['tri_influence']
-    #print('tri influence on seams', data['tri_influence'])
-    #print("MC_tools.py line 1543 testing influence")
-    #vecs = (plot - data['cloth_co'][data['vps']]) * .01# data['tri_influence']
-
-    data['cloth_co'][data['vps']] += np.nan_to_num(vecs)
-
-    ob.data.shape_keys.key_blocks[cloth_key].data.foreach_set('co', data['cloth_co'].ravel())
-    ob.data.update()
+    seam_plot_update(cloth, data, cloth_key)
     return False
 
 # ^               END seam wrangler functions                ^ #
@@ -1669,8 +2548,8 @@ def bend_spring_force_linear(cloth):
     # swap the mags so that the larger triangles move a shorter distance
     d = np.einsum('ij,ij->i', cv, cv)
     l = np.sqrt(d)[:, None]
-    m1 = np.nan_to_num(l[::2] / l[1::2])
-    m2 = np.nan_to_num(l[1::2] / l[::2])
+    m1 = l[::2] / np.maximum(l[1::2], div_eps)
+    m2 = l[1::2] / np.maximum(l[::2], div_eps)
     cv[1::2] *= m1
     cv[::2] *= m2
 
@@ -1683,7 +2562,9 @@ def bend_spring_force_linear(cloth):
     np.subtract.at(cloth.co, cloth.bend_edges, mix[:, None])
 
 
-def bend_spring_force_mixed(cloth):
+def bend_spring_force_mixed(cloth, bend=None):
+    """bend is the Bend setting. Defaults to
+    the one on the cloth object."""
 
     tris = cloth.co[cloth.bend_tris]
 
@@ -1695,37 +2576,42 @@ def bend_spring_force_mixed(cloth):
         unit = True # for testing unit normalized surface offset
         if unit:
             cross = cross_from_tris(tris)
-            U_cross = cross / np.sqrt(np.einsum('ij,ij->i', cross, cross))[:, None]
+            U_cross = cross / np.sqrt(np.maximum(np.einsum('ij,ij->i', cross, cross), div_eps))[:, None]
             surface_offset = U_cross * cloth.bend_U_d[:, None]
 
         else:
             surface_offset = cross_from_tris(tris) * cloth.bend_surface_offset
         plot = np.sum(tris * cloth.bend_weights, axis=1) + surface_offset
     # -----------------------------------------
-    bend_stiff = cloth.ob.MC_props.bend * 0.2
+    if bend is None:
+        bend = cloth.ob.MC_props.bend
+    bend_stiff = bend * 0.2
 
     cv = plot - cloth.co[cloth.bend_tri_tips]
+    if cpoe:
+        cv[cloth.bend_dead] = 0.0 # masked when the cpoe values were set
     d = np.einsum('ij,ij->i', cv, cv)
     l = np.sqrt(d)
 
-    m1 = l[::2] / l[1::2]
-    m2 = l[1::2] / l[::2]
+    m1 = l[::2] / np.maximum(l[1::2], div_eps)
+    m2 = l[1::2] / np.maximum(l[::2], div_eps)
     cv[1::2] *= m1[:, None]
     cv[::2] *= m2[:, None]
 
     # mean method ----------------------
     cloth.bend_tri_tip_array[:] = 0
     np.add.at(cloth.bend_tri_tip_array, cloth.bend_tri_tips, l)
+    np.maximum(cloth.bend_tri_tip_array, div_eps, out=cloth.bend_tri_tip_array)
     weights = l / cloth.bend_tri_tip_array[cloth.bend_tri_tips]
 
     cv *= weights[:, None]
     cv *= bend_stiff
-    np.add.at(cloth.co, cloth.bend_tri_tips, np.nan_to_num(cv))
+    np.add.at(cloth.co, cloth.bend_tri_tips, cv)
     sh = cv.shape
     cv.shape = (sh[0]//2,2,3)
     mix = np.mean(cv, axis=1)
 
-    np.subtract.at(cloth.co, cloth.bend_edges, np.nan_to_num(mix)[:, None])
+    np.subtract.at(cloth.co, cloth.bend_edges, mix[:, None])
 
 
 def bend_spring_force_U_cross(cloth):
@@ -1733,7 +2619,7 @@ def bend_spring_force_U_cross(cloth):
     tris = cloth.co[cloth.bend_tris]
     #surface_offset = cross_from_tris(tris) * cloth.bend_surface_offset
     cross = cross_from_tris(tris)
-    U_cross = cross / np.sqrt(np.einsum('ij,ij->i', cross, cross))[:, None]
+    U_cross = cross / np.sqrt(np.maximum(np.einsum('ij,ij->i', cross, cross), div_eps))[:, None]
     surface_offset = U_cross * cloth.bend_U_d[:, None]
     plot = np.sum(tris * cloth.bend_weights, axis=1) + surface_offset
     # -----------------------------------------
@@ -1747,7 +2633,8 @@ def bend_spring_force_U_cross(cloth):
     # mean method ----------------------
     cloth.bend_tri_tip_array[:] = 0
     np.add.at(cloth.bend_tri_tip_array, cloth.bend_tri_tips, l)
-    weights = np.nan_to_num(move_l / cloth.bend_tri_tip_array[cloth.bend_tri_tips])
+    np.maximum(cloth.bend_tri_tip_array, div_eps, out=cloth.bend_tri_tip_array)
+    weights = move_l / cloth.bend_tri_tip_array[cloth.bend_tri_tips]
     cv *= weights[:, None]
     cv *= bend_stiff
 
@@ -1755,6 +2642,54 @@ def bend_spring_force_U_cross(cloth):
     np.subtract.at(cloth.co, cloth.bend_edges.ravel(), cv)
 
 
+def spring_basic_stretch(cloth, l, stretch, push):
+    """One iteration of the stretch springs toward lengths l.
+    stretch is half the Stretch setting."""
+    # (current vec, dot, length)
+    cv, cd, cl = measure_edges(cloth.co, cloth.basic_set) # from current cloth state
+    np.maximum(cl, div_eps, out=cl) # zero length springs push nowhere
+    move_l = (cl - l) * stretch
+
+    # separate push springs
+    if push != 1:
+        push_springs = move_l < 0
+        move_l[push_springs] *= push
+
+    # !!! here we could square move_l to accentuate bigger stretch
+    # !!! see if it solves better.
+
+    # mean method -------------------
+    cloth.stretch_array[:] = 0.0
+
+    rock_hard_abs = np.abs(move_l)
+    np.add.at(cloth.stretch_array, cloth.basic_v_fancy, rock_hard_abs)
+    np.maximum(cloth.stretch_array, div_eps, out=cloth.stretch_array)
+    weights = rock_hard_abs / cloth.stretch_array[cloth.basic_v_fancy]
+    # mean method -------------------
+
+    # apply forces ------------------
+    #if False:
+    move = cv * (move_l / cl)[:,None]
+
+    move *= weights[:,None]
+    np.add.at(cloth.co, cloth.basic_v_fancy, move)
+
+
+def spring_basic_velocity(cloth, vel, feedback_val, grav):
+    """Velocity from this frame's move. vel_zero and feedback
+    hold the coords from before the springs ran."""
+    # extrapolate maybe? # get spring move, multiply vel by fraction, add spring move
+    spring_move = cloth.co - cloth.feedback
+    v_move = cloth.co - cloth.vel_zero
+
+    cloth.velocity += v_move
+    cloth.velocity += spring_move * feedback_val
+    cloth.velocity *= vel
+
+    cloth.velocity[:,2] += grav
+    #cloth.velocity[:,2] += (grav * (-cloth.pin + 1).ravel())
+
+
 def spring_basic(cloth):
 
     seam_wrangler = bpy.context.scene.MC_seam_wrangler
@@ -1801,32 +2736,7 @@ def spring_basic(cloth):
                 if type == 1:
                     pure_linear(cloth, data)
 
-            # (current vec, dot, length)
-            cv, cd, cl = measure_edges(cloth.co, cloth.basic_set) # from current cloth state
-            move_l = (cl - l) * stretch
-
-            # separate push springs
-            if push != 1:
-                push_springs = move_l < 0
-                move_l[push_springs] *= push
-
-            # !!! here we could square move_l to accentuate bigger stretch
-            # !!! see if it solves better.
-
-            # mean method -------------------
-            cloth.stretch_array[:] = 0.0
-
-            rock_hard_abs = np.abs(move_l)
-            np.add.at(cloth.stretch_array, cloth.basic_v_fancy, rock_hard_abs)
-            weights = rock_hard_abs / cloth.stretch_array[cloth.basic_v_fancy]
-            # mean method -------------------
-
-            # apply forces ------------------
-            #if False:
-            move = cv * (move_l / cl)[:,None]
-
-            move *= weights[:,None]
-            np.add.at(cloth.co, cloth.basic_v_fancy, np.nan_to_num(move))
+            spring_basic_stretch(cloth, l, stretch, push)
 
             if cloth.ob.MC_props.bend > 0:
                 # test ====================== bend springs
@@ -1850,16 +2760,7 @@ def spring_basic(cloth):
                 cloth.co[cloth.selected] = cloth.select_start[cloth.selected]
                 cloth.pin_arr[cloth.selected] = cloth.select_start[cloth.selected]
 
-    # extrapolate maybe? # get spring move, multiply vel by fraction, add spring move
-    spring_move = cloth.co - cloth.feedback
-    v_move = cloth.co - cloth.vel_zero
-
-    cloth.velocity += v_move
-    cloth.velocity += spring_move * feedback_val
-    cloth.velocity *= vel
-
-    cloth.velocity[:,2] += grav
-    #cloth.velocity[:,2] += (grav * (-cloth.pin + 1).ravel())
+    spring_basic_velocity(cloth, vel, feedback_val, grav)
 
     seam_wrangler = bpy.context.scene.MC_seam_wrangler
     if seam_wrangler:
@@ -2150,6 +3051,46 @@ def undo_frustration(scene):
         MC_data['iterator'] = 0
 
 
+# handler ------------------
+@persistent
+def flush_ram_caches(scene=None):
+    """Write frames still waiting in RAM caches to disk
+    before the blend file is saved, before another one
+    is loaded and when blender quits"""
+    for cloth in MC_data['cloths'].values():
+        if hasattr(cloth, 'cache_dir'):
+            try:
+                ram_cache_flush(cloth)
+            except ReferenceError:
+                # the object was freed before we got here
+                print('could not flush the RAM cache for', cloth.cache_dir)
+
+
+def flush_handler_lists():
+    """App handlers that flush the RAM caches. Stopping
+    playback ends a recording so frames don't wait in RAM
+    for the next save (older blenders don't have it)."""
+    handler_lists = [bpy.app.handlers.save_pre, bpy.app.handlers.load_pre]
+    if hasattr(bpy.app.handlers, 'animation_playback_post'):
+        handler_lists.append(bpy.app.handlers.animation_playback_post)
+    return handler_lists
+
+
+def register_exit_flush():
+    """atexit keeps the function it was given. Reloading the
+    addon makes a new flush_ram_caches so the one from before
+    the reload is kept in the driver namespace to remove it."""
+    unregister_exit_flush()
+    atexit.register(flush_ram_caches)
+    bpy.app.driver_namespace['MC_exit_flush'] = flush_ram_caches
+
+
+def unregister_exit_flush():
+    old = bpy.app.driver_namespace.pop('MC_exit_flush', None)
+    if old is not None:
+        atexit.unregister(old)
+
+
 # handler ------------------
 @persistent
 def cloth_main(scene=None):
@@ -2301,12 +3242,21 @@ def cb_seam_wrangler(self, context):
         cloth.current_iter = i
         spring_basic(cloth)
 
+    # the full shape key scrub only runs when the
+    #   cheap sum check finds NaNs or infs
+    finite = np.isfinite(np.sum(cloth.co))
+    if not finite:
+        b_log(['!!! NaNs in the seam wrangler triangles. scrubbing !!!'])
+        np.nan_to_num(cloth.co, copy=False)
+        np.nan_to_num(cloth.velocity, copy=False)
+
     #cache(cloth, keying=False)
     ob.data.shape_keys.key_blocks['MC_current'].data.foreach_set("co", cloth.co.ravel())
     #ob.data.vertices.foreach_set('co', cloth.co.ravel())
     ob.data.update()
 
-    fix_all_shape_key_nans(ob)
+    if not finite:
+        fix_all_shape_key_nans(ob)
 
     #if True: # this runs twice. Once on setup.
     if False: # this runs twice. Once on setup.
@@ -2367,20 +3317,15 @@ def check_file_path(ob):
     return valid, final_path
 
 
-def cb_cache(self, context):
-    """Manage files and paths for saving cache."""
-    if self.cache:
-        self['play_cache'] = False
-        # Might want to overwrite while playing
-        #   back with partial influence and running cloth sim
-
-    ob = self.id_data
-
-    cloth = get_cloth(ob)
+def cache_folder_path(ob):
+    """The folder frames for ob get cached in. Used by the
+    cloth cache, the bake and the cache only frame handler
+    so they all write to the same place. Creates it if needed."""
+    self = ob.MC_props
 
     # set path to blender path by default
     path = pathlib.Path(bpy.data.filepath).parent #.parent removes .blend file
-    if path == '':
+    if bpy.data.filepath == '':
         path = os.path.expanduser("~/Desktop")
         self['cache_folder'] = path
 
@@ -2406,7 +3351,11 @@ def cb_cache(self, context):
     if not mc_path.exists():
         mc_path.mkdir()
 
-    name = str(ob['MC_cloth_id'])
+    # objects without a cloth instance (like the mega_tri_mesh)
+    #   cache under their name
+    name = ob.name
+    if 'MC_cloth_id' in ob:
+        name = str(ob['MC_cloth_id'])
 
     custom_name = self.cache_name
     if custom_name != "Mr. Purrkins The Deadly Cyborg Kitten":
@@ -2421,15 +3370,54 @@ def cb_cache(self, context):
     if not final_path.exists():
         final_path.mkdir()
 
-    cloth.cache_dir = final_path
+    return final_path
+
+
+def set_cache_dir(ob):
+    """Manage files and paths for saving cache.
+    Points the cloth at its cache folder, creating it if needed."""
+    cloth = get_cloth(ob)
+
+    # finish writing to the old folder before the path changes
+    if hasattr(cloth, 'cache_dir'):
+        ram_cache_flush(cloth)
+
+    cloth.cache_dir = cache_folder_path(ob)
+
+    # start recording with a full frame
+    cloth.pc2_started = False
+    cloth.cache_key_frame = None
+    cloth.cache_key_co = None
+    cloth.cache_last_frame = None
+    cloth.cache_last_co = None
     return
 
 
+def cb_cache(self, context):
+    """Manage files and paths for saving cache."""
+    if self.cache:
+        self['play_cache'] = False
+        # Might want to overwrite while playing
+        #   back with partial influence and running cloth sim
+
+    # recording stopped. Don't leave frames only in RAM
+    ob = self.id_data
+    if not self.cache:
+        if 'MC_cloth_id' in ob:
+            cloth = get_cloth(ob)
+            if hasattr(cloth, 'cache_dir'):
+                ram_cache_flush(cloth)
+
+    set_cache_dir(ob)
+
+
 def cb_cache_playback(self, context):
     ob = self.id_data
     cloth = get_cloth(ob)
 
     self['cache'] = False
+    if hasattr(cloth, 'cache_dir'):
+        ram_cache_flush(cloth)
 
     if self.cache_only:
         if self.play_cache:
@@ -2800,6 +3788,27 @@ class McPropsObject(bpy.types.PropertyGroup):
     cache_interpolation:\
     bpy.props.BoolProperty(name="Cache Interpolate", description='Interpolate mesh shape between cached frames.', default=True, update=cb_cache)
 
+    cache_tolerance:\
+    bpy.props.FloatProperty(name="Static Tolerance", description="Frames where no vert moved further than this since the last stored frame are saved as a reference to it", default=0.00001, min=0, max=1, precision=6)
+
+    cache_binary:\
+    bpy.props.BoolProperty(name="Binary Cache", description="Save full frames as float32 .npy instead of text", default=False)
+
+    cache_sparse:\
+    bpy.props.BoolProperty(name="Sparse Cache", description="Only save the verts that moved since the last full frame", default=False)
+
+    pc2_record:\
+    bpy.props.BoolProperty(name="Record PC2", description="Stream recorded frames into a PC2 point cache next to the cache folder", default=False)
+
+    pc2_file:\
+    bpy.props.StringProperty(name="PC2 File", description="Play this PC2 point cache when Playback is on", default="", subtype='FILE_PATH')
+
+    cache_ram_mb:\
+    bpy.props.IntProperty(name="RAM Cache", description="Megabytes of recent frames to keep in memory for scrubbing. Zero reads and writes straight to disk", default=256, min=0)
+
+    checkpoint_interval:\
+    bpy.props.IntProperty(name="Checkpoint Interval", description="Save the full cloth state every this many frames so the sim can be resumed. Zero turns it off", default=25, min=0)
+
 
     # set the default path
     path = bpy.data.filepath
@@ -2868,6 +3877,15 @@ class McPropsScene(bpy.types.PropertyGroup):
 
     view_virtual:\
     bpy.props.BoolProperty(name="View Virtual Springs", description="create a mesh to show virtual springs", default=False)
+
+    bundle_name:\
+    bpy.props.StringProperty(name="Bundle Name", description="File name for the scene cache bundle", default="scene_bundle")
+
+    bundle_record:\
+    bpy.props.BoolProperty(name="Record Bundle", description="Also write recorded cache frames into the scene bundle", default=False)
+
+    bundle_playback:\
+    bpy.props.BoolProperty(name="Bundle Playback", description="Play caches from the scene bundle. One read per frame feeds every object", default=False)
     # make this one a child object that is not selectable.
 
 
@@ -3065,6 +4083,8 @@ class MCDeleteCache(bpy.types.Operator):
 
         if os.path.exists(current):
             shutil.rmtree(current, ignore_errors=True)
+            MC_data['cache_index'].pop(str(current), None)
+            cloth.ram_cache = None
             ob.MC_props['cache'] = False
             ob.MC_props['play_cache'] = False
 
@@ -3084,6 +4104,275 @@ class MCDeleteCache(bpy.types.Operator):
 
 
 
+class MCResumeFromCheckpoint(bpy.types.Operator):
+    """Restore the cloth from the last checkpoint at or before the current frame"""
+    bl_idname = "object.mc_resume_from_checkpoint"
+    bl_label = "MC Resume From Checkpoint"
+    bl_options = {'REGISTER', 'UNDO'}
+    def execute(self, context):
+        ob = MC_data['recent_object']
+        if ob is None:
+            ob = bpy.context.object
+        cloth = get_cloth(ob)
+
+        if ob.data.is_editmode:
+            msg = "Can't resume in edit mode"
+            bpy.context.window_manager.popup_menu(oops, title=msg, icon='ERROR')
+            return {'FINISHED'}
+
+        fp = check_file_path(ob)[1]
+        checkpoint = read_checkpoint(fp, bpy.context.scene.frame_current)
+        if checkpoint is None:
+            msg = "No checkpoint at or before frame " + str(bpy.context.scene.frame_current)
+            bpy.context.window_manager.popup_menu(oops, title=msg, icon='ERROR')
+            return {'FINISHED'}
+
+        f, state = checkpoint
+        if state['co'].shape != cloth.co.shape:
+            msg = "Checkpoint at frame " + str(f) + " doesn't match the vertex count"
+            bpy.context.window_manager.popup_menu(oops, title=msg, icon='ERROR')
+            return {'FINISHED'}
+
+        for name, arr in state.items():
+            setattr(cloth, name, np.array(arr, dtype=np.float32))
+
+        # the next frame we record can't reference frames from the old run
+        cloth.cache_dir = fp
+        ram_cache_flush(cloth)
+        cloth.cache_key_frame = None
+        cloth.cache_key_co = None
+        cloth.cache_last_frame = None
+        cloth.cache_last_co = None
+
+        # setting frame_current directly doesn't run the frame handler
+        ob.MC_props['play_cache'] = False
+        ob.MC_props['current_cache_frame'] = f
+        bpy.context.scene.frame_current = f
+
+        ob.data.shape_keys.key_blocks['MC_current'].data.foreach_set('co', cloth.co.ravel())
+        ob.data.update()
+        print('resumed', ob.name, 'from checkpoint at frame', f)
+
+        return {'FINISHED'}
+
+
+class MCPackCacheBundle(bpy.types.Operator):
+    """Pack the caches of every cloth and cache only object in the scene into one bundle"""
+    bl_idname = "scene.mc_pack_cache_bundle"
+    bl_label = "MC Pack Cache Bundle"
+    bl_options = {'REGISTER', 'UNDO'}
+    def execute(self, context):
+        sc = bpy.context.scene
+        obs = [ob for ob in sc.objects if ob.MC_props.cloth]
+        if len(obs) == 0:
+            msg = "No cloth or cache only objects in the scene"
+            bpy.context.window_manager.popup_menu(oops, title=msg, icon='ERROR')
+            return {'FINISHED'}
+
+        names = [ob.name for ob in obs]
+        counts = [len(ob.data.vertices) for ob in obs]
+        paths = [check_file_path(ob)[1] for ob in obs]
+
+        for ob in obs:
+            cloth = get_cloth(ob)
+            if hasattr(cloth, 'cache_dir'):
+                ram_cache_flush(cloth)
+
+        path = get_bundle_path()
+        create_cache_bundle(path, names, counts, sc.frame_start)
+        MC_data['bundle'] = None
+        header = get_bundle_header()
+        offsets = header['offsets']
+
+        # frames missing from an object's cache hold its last frame
+        frame = np.empty((offsets[-1], 3), dtype=np.float32)
+        for i, ob in enumerate(obs):
+            ob.data.vertices.foreach_get('co', frame[offsets[i]: offsets[i + 1]].ravel())
+
+        with open(path, 'ab') as file:
+            for f in range(sc.frame_start, sc.frame_end + 1):
+                for i in range(len(obs)):
+                    co = None
+                    if paths[i].exists():
+                        co = read_cache_frame(paths[i], f)
+                    if co is not None:
+                        if co.shape[0] == counts[i]:
+                            frame[offsets[i]: offsets[i + 1]] = co
+                frame.tofile(file)
+
+        # every slot holds a frame
+        frame_count = sc.frame_end + 1 - sc.frame_start
+        np.ones(frame_count * len(obs), dtype=np.uint8).tofile(header['written'])
+
+        print('packed', len(obs), 'objects into', path)
+        return {'FINISHED'}
+
+
+class MCExportPC2(bpy.types.Operator):
+    """Stream the scene frame range of the cache into a PC2 point cache"""
+    bl_idname = "object.mc_export_pc2"
+    bl_label = "MC Export PC2"
+    bl_options = {'REGISTER'}
+    def execute(self, context):
+        ob = MC_data['recent_object']
+        if ob is None:
+            ob = bpy.context.object
+        cloth = get_cloth(ob)
+
+        valid, fp = check_file_path(ob)
+        if not valid:
+            msg = "No cache folder at " + str(fp)
+            bpy.context.window_manager.popup_menu(oops, title=msg, icon='ERROR')
+            return {'FINISHED'}
+
+        cloth.cache_dir = fp
+        ram_cache_flush(cloth)
+
+        sc = bpy.context.scene
+        start = sc.frame_start
+        samples = sc.frame_end - start + 1
+        vc = len(ob.data.vertices)
+
+        # frames missing from the cache hold the last frame
+        co = np.empty((vc, 3), dtype=np.float32)
+        ob.data.vertices.foreach_get('co', co.ravel())
+
+        path = get_pc2_path(ob)
+        # every sample gets written so there's nothing to flag
+        written = pc2_written_path(path)
+        if written.exists():
+            written.unlink()
+        with open(path, 'wb') as file:
+            write_pc2_header(file, vc, start, samples)
+            for f in range(start, sc.frame_end + 1):
+                frame = read_cache_frame(fp, f)
+                if frame is not None:
+                    if frame.shape[0] == vc:
+                        co[:] = frame
+                co.astype('<f4').tofile(file)
+
+        print('exported', samples, 'frames to', path)
+        return {'FINISHED'}
+
+
+class MCCompressCachePCA(bpy.types.Operator):
+    """Compress the cache to a low-rank basis plus per-frame coefficients"""
+    bl_idname = "object.mc_compress_cache_pca"
+    bl_label = "MC Compress Cache"
+    bl_options = {'REGISTER'}
+
+    error: bpy.props.FloatProperty(name="Target Error", description="RMS vertex error allowed in the compressed cache", default=0.001, min=0, precision=5)
+    remove_raw: bpy.props.BoolProperty(name="Remove Raw Frames", description="Delete the frame files once the compressed cache is saved", default=False)
+
+    def execute(self, context):
+        ob = MC_data['recent_object']
+        if ob is None:
+            ob = bpy.context.object
+        cloth = get_cloth(ob)
+
+        valid, fp = check_file_path(ob)
+        if not valid:
+            msg = "No cache folder at " + str(fp)
+            bpy.context.window_manager.popup_menu(oops, title=msg, icon='ERROR')
+            return {'FINISHED'}
+
+        cloth.cache_dir = fp
+        ram_cache_flush(cloth)
+
+        if cache_frame_numbers(fp).shape[0] == 0:
+            msg = "No frames in " + str(fp)
+            bpy.context.window_manager.popup_menu(oops, title=msg, icon='ERROR')
+            return {'FINISHED'}
+
+        report = compress_cache_pca(fp, self.error)
+        if report is None:
+            msg = "Vertex count changes in the cache. Can't compress."
+            bpy.context.window_manager.popup_menu(oops, title=msg, icon='ERROR')
+            return {'FINISHED'}
+
+        if self.remove_raw:
+            for i in fp.iterdir():
+                if i.name.split('.')[0].isdigit():
+                    i.unlink()
+            MC_data['cache_index'].pop(str(fp), None)
+            cloth.ram_cache = None
+
+        ratio = report['pca_bytes'] / max(report['raw_bytes'], 1)
+        msg = 'Compressed ' + str(report['frames']) + ' frames to ' + str(report['components']) + ' components. '
+        msg += 'RMS error: ' + str(round(report['rms_error'], 6)) + ' Max error: ' + str(round(report['max_error'], 6)) + '. '
+        msg += 'Size: ' + str(round(ratio * 100, 2)) + '% of the raw cache'
+        print(msg)
+        bpy.context.window_manager.popup_menu(oops, title=msg, icon='INFO')
+        return {'FINISHED'}
+
+    def invoke(self, context, event):
+        return context.window_manager.invoke_props_dialog(self)
+
+
+class MCBakeCacheOnly(bpy.types.Operator):
+    """Bake every cache only object over the scene frame range without playing the timeline"""
+    bl_idname = "scene.mc_bake_cache_only"
+    bl_label = "MC Bake Cache Only"
+    bl_options = {'REGISTER'}
+    def execute(self, context):
+        sc = bpy.context.scene
+        obs = [ob for ob in sc.objects if (ob.MC_props.cache_only & ob.MC_props.cloth)]
+        if len(obs) == 0:
+            msg = "No cache only objects in the scene"
+            bpy.context.window_manager.popup_menu(oops, title=msg, icon='ERROR')
+            return {'FINISHED'}
+
+        # keep the animated handler from caching while we step frames
+        handlers = [h for h in bpy.app.handlers.frame_change_post if h.__name__ == 'cloth_main']
+        for h in handlers:
+            bpy.app.handlers.frame_change_post.remove(h)
+
+        cloths = []
+        overwrite = []
+        frame = sc.frame_current
+        wm = bpy.context.window_manager
+        start = time.time()
+        try:
+            for ob in obs:
+                cloth = get_cloth(ob)
+                set_cache_dir(ob)
+                cloth.co = np.empty((len(ob.data.vertices), 3), dtype=np.float32)
+                cloths.append(cloth)
+                overwrite.append(ob.MC_props.overwrite_cache)
+                ob.MC_props['overwrite_cache'] = True
+
+            wm.progress_begin(sc.frame_start, sc.frame_end)
+
+            # nothing redraws until execute returns so the
+            #   bake only pays for depsgraph evaluation
+            for f in range(sc.frame_start, sc.frame_end + 1):
+                sc.frame_set(f)
+                dg = bpy.context.evaluated_depsgraph_get()
+                for cloth in cloths:
+                    prox = cloth.ob.evaluated_get(dg)
+                    proxy = prox.to_mesh()
+                    proxy.vertices.foreach_get('co', cloth.co.ravel())
+                    prox.to_mesh_clear()
+                    cache(cloth)
+                wm.progress_update(f)
+
+        finally:
+            # a failed bake still gives back the handler and settings
+            for cloth, o in zip(cloths, overwrite):
+                cloth.ob.MC_props['overwrite_cache'] = o
+
+            wm.progress_end()
+            sc.frame_set(frame)
+            for h in handlers:
+                bpy.app.handlers.frame_change_post.append(h)
+            for cloth in cloths:
+                ram_cache_flush(cloth)
+
+        frames = sc.frame_end - sc.frame_start + 1
+        print('baked', len(obs), 'objects over', frames, 'frames in', round(time.time() - start, 2), 'seconds')
+        return {'FINISHED'}
+
+
 class MCCreateMeshKeyframe(bpy.types.Operator):
     """Create a linear path between cache files"""
     bl_idname = "object.mc_mesh_keyframe"
@@ -3140,22 +4429,92 @@ class MCCreateVirtualSprings(bpy.types.Operator):
 
 
 class MCApplyForExport(bpy.types.Operator):
-    # !!! Not Finished !!!!!!
-    """Apply cloth effects to mesh for export."""
-    bl_idname = "object.MC_apply_for_export"
+    """Bake the cache in the scene frame range into keyed shape keys for export"""
+    bl_idname = "object.mc_apply_for_export"
     bl_label = "MC Apply For Export"
     bl_options = {'REGISTER', 'UNDO'}
     def execute(self, context):
-        ob = get_last_object()[1]
-        v_count = len(ob.data.vertices)
-        co = np.zeros(v_count * 3, dtype=np.float32)
-        ob.data.shape_keys.key_blocks['modeling cloth key'].data.foreach_get('co', co)
-        ob.data.shape_keys.key_blocks['Basis'].data.foreach_set('co', co)
-        ob.data.shape_keys.key_blocks['Basis'].mute = True
-        ob.data.shape_keys.key_blocks['Basis'].mute = False
-        ob.data.vertices.foreach_set('co', co)
-        ob.data.update()
+        ob = MC_data['recent_object']
+        if ob is None:
+            ob = bpy.context.object
+        cloth = get_cloth(ob)
+
+        valid, fp = check_file_path(ob)
+        if not valid:
+            msg = "No cache folder at " + str(fp)
+            bpy.context.window_manager.popup_menu(oops, title=msg, icon='ERROR')
+            return {'FINISHED'}
+
+        cloth.cache_dir = fp
+        ram_cache_flush(cloth)
+
+        sc = bpy.context.scene
+        frames = cache_frame_numbers(fp)
+        pca = fp.joinpath('pca.npz')
+        if pca.exists():
+            frames = np.union1d(frames, np.load(pca)['frames'])
+        frames = frames[(frames >= sc.frame_start) & (frames <= sc.frame_end)]
+
+        if ob.data.shape_keys is None:
+            ob.shape_key_add(name='Basis')
+        keys = ob.data.shape_keys.key_blocks
+
+        # clear an earlier bake
+        for k in [k for k in keys if k.name.startswith('MC_bake_')]:
+            ob.shape_key_remove(k)
 
+        vc = len(ob.data.vertices)
+        baked = []
+        for f in frames.tolist():
+            co = read_cache_frame(fp, f)
+            if co is None:
+                continue
+            if co.shape[0] != vc:
+                continue
+            key = ob.shape_key_add(name='MC_bake_' + str(f), from_mix=False)
+            key.data.foreach_set('co', np.array(co, dtype=np.float32).ravel())
+            key.value = 0
+            baked.append(f)
+
+        if len(baked) == 0:
+            msg = "No frames in the cache for the scene frame range"
+            bpy.context.window_manager.popup_menu(oops, title=msg, icon='ERROR')
+            return {'FINISHED'}
+
+        shape_keys = ob.data.shape_keys
+        if shape_keys.animation_data is None:
+            shape_keys.animation_data_create()
+        action = shape_keys.animation_data.action
+        if action is None:
+            action = bpy.data.actions.new(ob.name + '_MC_bake')
+            shape_keys.animation_data.action = action
+
+        for fc in [fc for fc in action.fcurves if 'MC_bake_' in fc.data_path]:
+            action.fcurves.remove(fc)
+
+        # each key ramps up from the last baked frame and back
+        #   down to the next one so playback blends between frames
+        for i, f in enumerate(baked):
+            co = [f, 1.0]
+            if i > 0:
+                co = [baked[i - 1], 0.0] + co
+            if i < len(baked) - 1:
+                co = co + [baked[i + 1], 0.0]
+
+            fc = action.fcurves.new(data_path='key_blocks["MC_bake_' + str(f) + '"].value')
+            points = fc.keyframe_points
+            points.add(len(co) // 2)
+            points.foreach_set('co', co)
+            points.foreach_set('interpolation', [1] * (len(co) // 2)) # LINEAR
+            fc.update()
+
+        # baked keys hold the full shape so the sim keys would add on top
+        for name in ['MC_source', 'MC_current', 'cache_key']:
+            if name in keys:
+                keys[name].value = 0
+
+        ob.data.update()
+        print('baked', len(baked), 'frames to shape keys on', ob.name)
         return {'FINISHED'}
 
 
@@ -3236,6 +4595,7 @@ class PANEL_PT_modelingClothMain(PANEL_PT_MC_Master, bpy.types.Panel):
         col = layout.column(align=True)
         col.prop(sc.MC_props, "kill_duplicator", text="kill_duplicator", icon='DUPLICATE')
         col.prop(ob.MC_props, "cache_only", text="Cache Only", icon='RENDER_ANIMATION')
+        col.operator('scene.mc_bake_cache_only', text="Bake Cache Only", icon='RENDER_ANIMATION')
         # use current mesh or most recent cloth object if current ob isn't mesh
 
 
@@ -3298,9 +4658,14 @@ class PANEL_PT_modelingClothCache(PANEL_PT_MC_Master, bpy.types.Panel):
             bcol.prop(ob.MC_props, "cache", text="Record", icon='RENDER_ANIMATION')
             bcol.prop(ob.MC_props, "max_frames")
             bcol.prop(ob.MC_props, "overwrite_cache", text="Overwrite", icon='FILE_REFRESH')
+            bcol.prop(ob.MC_props, "cache_tolerance", text="Static Tolerance")
+            bcol.prop(ob.MC_props, "cache_sparse", text="Sparse")
+            bcol.prop(ob.MC_props, "cache_binary", text="Binary")
             bcol = box.column()
             bcol.scale_y = 1.5
             bcol.operator('object.mc_delete_cache', text="Delete Cache", icon='KEY_HLT')
+            bcol.operator('object.mc_resume_from_checkpoint', text="Resume From Frame", icon='RECOVER_LAST')
+            bcol.prop(ob.MC_props, "checkpoint_interval", text="Checkpoint Every")
             bcol = box.column()
             bcol.label(text="Cache Foder")
             bcol.prop(ob.MC_props, "cache_folder", text="")
@@ -3320,6 +4685,28 @@ class PANEL_PT_modelingClothCache(PANEL_PT_MC_Master, bpy.types.Panel):
             bcol.prop(ob.MC_props, 'cache_force', text='Influence', icon='SNAP_ON')
             bcol.prop(ob.MC_props, 'current_cache_frame', text='Frame')#, icon='SNAP_ON')
 
+            bcol = col.box().column()
+            bcol.prop(ob.MC_props, 'cache_ram_mb', text='RAM Cache MB')
+            if cloth.ram_cache is not None:
+                ram = cloth.ram_cache
+                bcol.label(text='Frames: ' + str(len(ram.lookup)) + '/' + str(ram.buffer.shape[0]))
+                bcol.label(text='Hits: ' + str(ram.hits) + '  Misses: ' + str(ram.misses))
+
+            bcol = col.box().column()
+            bcol.label(text='Scene Bundle')
+            bcol.prop(sc.MC_props, 'bundle_name', text='')
+            bcol.prop(sc.MC_props, 'bundle_record', text='Record Bundle', icon='RENDER_ANIMATION')
+            bcol.prop(sc.MC_props, 'bundle_playback', text='Bundle Playback', icon='PLAY')
+            bcol.operator('scene.mc_pack_cache_bundle', text="Pack Bundle", icon='PACKAGE')
+
+            bcol = col.box().column()
+            bcol.label(text='Point Cache')
+            bcol.prop(ob.MC_props, 'pc2_record', text='Record PC2', icon='RENDER_ANIMATION')
+            bcol.operator('object.mc_export_pc2', text="Export PC2", icon='EXPORT')
+            bcol.operator('object.mc_compress_cache_pca', text="Compress Cache", icon='MOD_DECIM')
+            bcol.operator('object.mc_apply_for_export', text="Bake To Shape Keys", icon='SHAPEKEY_DATA')
+            bcol.prop(ob.MC_props, 'pc2_file', text='')
+
 
 
             #row = bcol.row()
@@ -3349,8 +4736,7 @@ class PANEL_PT_modelingClothCache(PANEL_PT_MC_Master, bpy.types.Panel):
             if hasattr(cloth, 'cache_dir'):
                 folder = cloth.cache_dir
                 if folder.exists():
-                    f = str(folder) + str(sc.frame_current)
-                    if os.path.exists(f):
+                    if cache_frame_path(folder, sc.frame_current) is not None:
                         frame = 'Key=' + str(sc.frame_current)
 
 
@@ -3570,6 +4956,12 @@ classes = (
     MCSewToSurface,
     MCCreateVirtualSprings,
     MCDeleteCache,
+    MCResumeFromCheckpoint,
+    MCPackCacheBundle,
+    MCExportPC2,
+    MCCompressCachePCA,
+    MCBakeCacheOnly,
+    MCApplyForExport,
     MCCreateMeshKeyframe,
     MCRemoveMeshKeyframe,
     PANEL_PT_modelingClothMain,
@@ -3604,6 +4996,21 @@ def register():
     # drop in the undo handler
     bpy.app.handlers.undo_post.append(undo_frustration)
 
+    # RAM cache frames go to disk before saving, loading,
+    #   when playback stops and when blender quits
+    for handlers in flush_handler_lists():
+        # clean dead versions of the flush handler
+        handler_names = np.array([i.__name__ for i in handlers])
+        booly = [i == 'flush_ram_caches' for i in handler_names]
+        idx = np.arange(handler_names.shape[0])
+        idx_to_kill = idx[booly]
+        for i in idx_to_kill[::-1]:
+            del(handlers[i])
+
+        handlers.append(flush_ram_caches)
+
+    register_exit_flush()
+
     # register the data management timer. Updates duplicated objects and objects with modeling cloth properties
     if False:
         bpy.app.timers.register(duplication_and_load)
@@ -3630,6 +5037,19 @@ def unregister():
     for i in idx_to_kill[::-1]:
         del(bpy.app.handlers.undo_post[i])
 
+    # nothing waiting in RAM gets lost with the handlers
+    flush_ram_caches()
+    unregister_exit_flush()
+
+    # clean dead versions of the flush handler
+    for handlers in flush_handler_lists():
+        handler_names = np.array([i.__name__ for i in handlers])
+        booly = [i == 'flush_ram_caches' for i in handler_names]
+        idx = np.arange(handler_names.shape[0])
+        idx_to_kill = idx[booly]
+        for i in idx_to_kill[::-1]:
+            del(handlers[i])
+
 
 
 if __name__ == '__main__':
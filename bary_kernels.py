@@ -0,0 +1,243 @@
+"""Batched barycentric kernels.
+
+One pass over a set of triangles and a point for each gives:
+    weights  barycentric weights of the point dropped to the tri plane
+    inside   True where all three weights are above zero
+    div      distance along the non-unit cross product (in cross lengths)
+    offset   signed distance along the unit normal
+    closest  closest point on the triangle (optional)
+
+bary_linear gives the weights as a linear function of the
+point instead, for solving the same tris with many points.
+
+bary_project is float32 and runs a chunk of rows at a time so
+very large batches don't make huge temporaries. Pass the
+buffers from bary_buffers as out to skip allocating them.
+
+Benchmark against the einsum and np.linalg.solve versions:
+    python bary_kernels.py 1000000
+"""
+
+import sys
+import time
+
+import numpy as np
+
+
+# flat tris divide by this instead of making NaNs
+div_eps = 1e-12
+
+
+class Bary():
+    # results from bary_project
+    pass
+
+
+def bary_buffers(count, closest=False):
+    """Output arrays for count points.
+    Reuse them for batches of the same size."""
+    B = Bary()
+    B.weights = np.empty((count, 3), dtype=np.float32)
+    B.inside = np.empty(count, dtype=bool)
+    B.div = np.empty(count, dtype=np.float32)
+    B.offset = np.empty(count, dtype=np.float32)
+    B.closest = None
+    if closest:
+        B.closest = np.empty((count, 3), dtype=np.float32)
+    return B
+
+
+def bary_project(tris, points, out=None, chunk=65536, closest=False):
+    """tris is Nx3x3 and points is Nx3, one point per tri.
+    Returns a Bary with weights, inside, div, offset and
+    closest (None unless closest is True or out has it)."""
+    count = points.shape[0]
+    if out is None:
+        out = bary_buffers(count, closest)
+
+    for s in range(0, count, chunk):
+        e = min(s + chunk, count)
+        bary_chunk(tris[s:e], points[s:e], out, s, e)
+    return out
+
+
+def bary_chunk(tris, points, out, s, e):
+    """bary_project for rows s to e"""
+    tris = np.asarray(tris, dtype=np.float32)
+    points = np.asarray(points, dtype=np.float32)
+
+    origins = tris[:, 0]
+    v0 = tris[:, 1] - origins
+    v1 = tris[:, 2] - origins
+    v2 = points - origins
+    cross = np.cross(v0, v1)
+
+    # |v0 x v1|^2 is the d00 * d11 - d01 * d01 the
+    #   weights divide by without the cancellation
+    cc = np.einsum('ij,ij->i', cross, cross)
+    np.maximum(cc, div_eps, out=cc)
+
+    d00 = np.einsum('ij,ij->i', v0, v0)
+    d11 = np.einsum('ij,ij->i', v1, v1)
+    d01 = np.einsum('ij,ij->i', v0, v1)
+    d02 = np.einsum('ij,ij->i', v0, v2)
+    d12 = np.einsum('ij,ij->i', v1, v2)
+
+    w = out.weights[s:e]
+    u = d11 * d02
+    u -= d01 * d12
+    u /= cc
+    v = d00 * d12
+    v -= d01 * d02
+    v /= cc
+    w[:, 1] = u
+    w[:, 2] = v
+    np.subtract(1, u, out=w[:, 0])
+    w[:, 0] -= v
+
+    np.all(w > 0, axis=1, out=out.inside[s:e])
+
+    dc = np.einsum('ij,ij->i', v2, cross)
+    np.divide(dc, cc, out=out.div[s:e])
+    np.divide(dc, np.sqrt(cc), out=out.offset[s:e])
+
+    if out.closest is None:
+        return
+
+    # inside points drop straight to the plane.
+    #   the rest land on the nearest edge.
+    cp = out.closest[s:e]
+    np.subtract(points, cross * out.div[s:e, None], out=cp)
+
+    outside = np.any(w < 0, axis=1)
+    if not np.any(outside):
+        return
+
+    p = points[outside]
+    t = tris[outside]
+    best = np.full(p.shape[0], np.inf, dtype=np.float32)
+    near = np.empty_like(p)
+    for a, b in ((0, 1), (1, 2), (2, 0)):
+        ev = t[:, b] - t[:, a]
+        ee = np.maximum(np.einsum('ij,ij->i', ev, ev), div_eps)
+        d = np.einsum('ij,ij->i', p - t[:, a], ev) / ee
+        np.clip(d, 0, 1, out=d)
+        on_e = t[:, a] + ev * d[:, None]
+        vecs = p - on_e
+        dist = np.einsum('ij,ij->i', vecs, vecs)
+        closer = dist < best
+        best[closer] = dist[closer]
+        near[closer] = on_e[closer]
+    cp[outside] = near
+
+
+def bary_linear(tris):
+    """Barycentric u and v are linear in the point.
+    Returns grads (N,2,3) and offsets (N,2) so that
+    u, v = grads @ point + offsets for each tri"""
+    tris = np.asarray(tris, dtype=np.float64)
+    origins = tris[:, 0]
+    v0 = tris[:, 1] - origins
+    v1 = tris[:, 2] - origins
+
+    # same denominator as bary_chunk
+    cross = np.cross(v0, v1)
+    cc = np.maximum(np.einsum('ij,ij->i', cross, cross), div_eps)
+
+    d00 = np.einsum('ij,ij->i', v0, v0)
+    d11 = np.einsum('ij,ij->i', v1, v1)
+    d01 = np.einsum('ij,ij->i', v0, v1)
+
+    grads = np.empty((tris.shape[0], 2, 3), dtype=np.float64)
+    grads[:, 0] = (d11[:, None] * v0 - d01[:, None] * v1) / cc[:, None]
+    grads[:, 1] = (d00[:, None] * v1 - d01[:, None] * v0) / cc[:, None]
+    offsets = -np.einsum('ijk,ik->ij', grads, origins)
+    return grads, offsets
+
+
+def einsum_weights(tris, points):
+    """The per-file barycentric code this replaces.
+    Kept for bary_benchmark."""
+    origins = tris[:, 0]
+    cross_vecs = tris[:, 1:] - origins[:, None]
+    v2 = points - origins
+
+    v0 = cross_vecs[:,0]
+    v1 = cross_vecs[:,1]
+
+    d00_d11 = np.einsum('ijk,ijk->ij', cross_vecs, cross_vecs)
+    d00 = d00_d11[:,0]
+    d11 = d00_d11[:,1]
+    d01 = np.einsum('ij,ij->i', v0, v1)
+    d02 = np.einsum('ij,ij->i', v0, v2)
+    d12 = np.einsum('ij,ij->i', v1, v2)
+
+    div = 1 / (d00 * d11 - d01 * d01)
+    u = (d11 * d02 - d01 * d12) * div
+    v = (d00 * d12 - d01 * d02) * div
+
+    weights = np.array([1 - (u+v), u, v, ]).T
+
+    cross = np.cross(v0, v1)
+    d_v2_c = np.einsum('ij,ij->i', v2, cross)
+    d_v2_v2 = np.einsum('ij,ij->i', cross, cross)
+    U_cross = cross / np.sqrt(d_v2_v2)[:, None]
+    U_d = np.einsum('ij,ij->i', v2, U_cross)
+    return weights, d_v2_c / d_v2_v2, U_d
+
+
+def solve_weights(tris, points):
+    """inside_tri_wa from barycentric_stuff. Drops the
+    points to the planes and solves each tri.
+    Kept for bary_benchmark."""
+    origins = tris[:, 0]
+    cross_vecs = origins[:, None] - tris[:, 1:]
+    norms = np.cross(cross_vecs[:,0], cross_vecs[:, 1])
+    pv = points - origins
+    d = np.einsum('ij,ij->i', norms, pv) / np.einsum('ij,ij->i', norms, norms)
+    on_p = points - norms * d[:, None]
+    return np.linalg.solve(np.swapaxes(tris, 1,2), on_p[:, :, None])[:, :, 0]
+
+
+def bary_benchmark(count=1000000, seed=0):
+    """Times bary_project against einsum_weights and
+    solve_weights on random tris and checks they agree."""
+    rng = np.random.default_rng(seed)
+    tris = rng.random((count, 3, 3)).astype(np.float32)
+    points = (tris.mean(axis=1) + (rng.random((count, 3)) - 0.5) * 0.2).astype(np.float32)
+
+    start = time.time()
+    old_w, old_div, old_d = einsum_weights(tris, points)
+    old_time = time.time() - start
+
+    start = time.time()
+    solve_w = solve_weights(tris, points)
+    solve_time = time.time() - start
+
+    out = bary_buffers(count)
+    bary_project(tris, points, out=out) # warm up the buffers
+    start = time.time()
+    B = bary_project(tris, points, out=out)
+    new_time = time.time() - start
+
+    start = time.time()
+    bary_project(tris, points, closest=True)
+    closest_time = time.time() - start
+
+    # skinny tris lose precision in float32 either way
+    ok = np.all(np.isfinite(old_w), axis=1) & (np.abs(old_div) < 1e3)
+    err = np.max(np.abs(B.weights[ok] - old_w[ok]), axis=1)
+    print('tris:', count)
+    print('einsum weights:', round(old_time, 4), 's  solve weights:', round(solve_time, 4),
+          's  bary_project:', round(new_time, 4), 's  with closest point:', round(closest_time, 4), 's')
+    print('median weight difference:', float(np.median(err)),
+          ' same inside test:', round(float(np.mean((B.inside == np.all(old_w > 0, axis=1))[ok])) * 100, 4), '%',
+          ' solve agrees:', bool(np.allclose(np.median(np.abs(solve_w[ok] - old_w[ok])), 0, atol=1e-3)))
+    return old_time, solve_time, new_time
+
+
+if __name__ == '__main__':
+    count = 1000000
+    if len(sys.argv) > 1:
+        count = int(sys.argv[1])
+    bary_benchmark(count)
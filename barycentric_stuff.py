@@ -4,6 +4,11 @@ from numpy import newaxis as nax
 import bmesh
 import time
 
+try:
+    from garments_render.simulation.bary_kernels import bary_project
+except ImportError:
+    bary_project = bpy.data.texts['bary_kernels.py'].as_module().bary_project
+
 def cpoe(p, e1, e2):
     ev = e2 - e1
     pv = p - e1
@@ -15,54 +20,20 @@ def cpoe(p, e1, e2):
 def inside_tri_wa(tris, points, norms=None):
     """use weighted average to check inside tri.
     Might be able to modify to work with more than
-    three points for surface follow to more than three"""
-
-    # drop points to planes
-    origins = tris[:, 0]
-    cross_vecs = origins[:, nax] - tris[:, 1:]
-    if norms is None:    
-        norms = np.cross(cross_vecs[:,0], cross_vecs[:, 1])
-    pv = points - origins
-    d = np.einsum('ij,ij->i', norms, pv) / np.einsum('ij,ij->i', norms, norms)    
-    cpv = norms * d[:, nax]
-    on_p = points - cpv
-
-    # get weights
-    weights = np.linalg.solve(np.swapaxes(tris, 1,2), on_p)
-    inside = np.any(weights < 0, axis=1)
+    three points for surface follow to more than three.
+    bary_project drops the points to the tri planes so
+    norms isn't needed. Returns weights and inside."""
+    B = bary_project(tris, points)
+    return B.weights, B.inside
 
 
 def inside_triangles(tris, points, check=True):
-    
-    origins = tris[:, 0]
-    cross_vecs = tris[:, 1:] - origins[:, nax]    
-    v2 = points - origins
 
-    # ---------
-    v0 = cross_vecs[:,0]
-    v1 = cross_vecs[:,1]
-    
-    d00_d11 = np.einsum('ijk,ijk->ij', cross_vecs, cross_vecs)
-    d00 = d00_d11[:,0]
-    d11 = d00_d11[:,1]
-    d01 = np.einsum('ij,ij->i', v0, v1)
-    d02 = np.einsum('ij,ij->i', v0, v2)
-    d12 = np.einsum('ij,ij->i', v1, v2)
-
-    div = 1 / (d00 * d11 - d01 * d01)
-    u = (d11 * d02 - d01 * d12) * div
-    v = (d00 * d12 - d01 * d02) * div
-    
-    weights = np.array([1 - (u+v), u, v, ])
+    B = bary_project(tris, points)
     if not check:
-        return weights.T
-    
-    check = np.all(weights > 0, axis=0)
-    # check if bitwise is faster when using lots of tris
-    if False:    
-        check = (u > 0) & (v > 0) & (u + v < 1)
+        return B.weights
 
-    return weights.T, check
+    return B.weights, B.inside
 
 
 def closest_point_mesh(obm, edit_obj, target):
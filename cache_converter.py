@@ -0,0 +1,172 @@
+"""Convert Modeling Cloth text caches to binary.
+
+Runs without blender:
+    python cache_converter.py path/to/MC_cache_files --workers 8
+
+Walks every folder under the path looking for frames saved
+with np.savetxt by cache() or cache_only(). Each frame is parsed
+in a process pool, checked for NaNs and saved next to the text
+file as float32 <frame>.npy. Modeling Cloth reads .npy frames the
+same way it reads text frames. Back-references (.ref) and sparse
+frames (.npz) point at frame numbers so they keep working.
+
+Frames with NaNs or a vertex count that doesn't match the rest
+of their folder are reported and left as text. Pass --force to
+convert them anyway.
+"""
+
+import os
+import sys
+import time
+import pathlib
+import argparse
+import concurrent.futures
+
+import numpy as np
+
+
+def find_cache_folders(root):
+    """Every folder under root holding text frames.
+    Text frames are files named only by a frame number."""
+    folders = {}
+    for path, dirs, files in os.walk(root):
+        frames = sorted([int(f) for f in files if f.isdigit()])
+        if len(frames) > 0:
+            folders[pathlib.Path(path)] = frames
+    return folders
+
+
+def count_verts(txt):
+    """Vertex count of a text frame from its line count
+    without parsing it. Returns -1 if it can't be read."""
+    try:
+        with open(txt, 'rb') as file:
+            return sum(1 for line in file if line.strip() and not line.lstrip().startswith(b'#'))
+    except OSError:
+        return -1
+
+
+def convert_frame(txt, vc=None, dry_run=False, force=False):
+    """Parse one text frame and save it as float32 .npy.
+    Frames with NaNs or a vertex count other than vc
+    aren't saved unless force is True.
+    Returns vertex count, NaN count, text bytes, binary bytes
+    and an error message or None."""
+    try:
+        raw = os.path.getsize(txt)
+        co = np.loadtxt(txt, dtype=np.float32, ndmin=2)
+    except (ValueError, UnicodeDecodeError, OSError) as e:
+        return 0, 0, 0, 0, str(e)
+
+    if co.shape[1] != 3:
+        return co.shape[0], 0, raw, 0, 'expected Nx3 coords, got ' + str(co.shape)
+
+    nans = int(np.count_nonzero(np.isnan(co).any(axis=1)))
+    if dry_run:
+        return co.shape[0], nans, raw, co.nbytes + 128, None
+
+    flagged = (nans > 0) | ((vc is not None) & (co.shape[0] != vc))
+    if flagged & (not force):
+        return co.shape[0], nans, raw, 0, None
+
+    npy = str(txt) + '.npy'
+    np.save(npy, co)
+    return co.shape[0], nans, raw, os.path.getsize(npy), None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Convert Modeling Cloth text caches to binary .npy frames.')
+    parser.add_argument('path', help='MC_cache_files folder (or any folder above it)')
+    parser.add_argument('--workers', type=int, default=None, help='processes to parse with (default: cpu count)')
+    parser.add_argument('--keep', action='store_true', help='keep the text frames after converting')
+    parser.add_argument('--dry-run', action='store_true', help='only validate. Nothing is written')
+    parser.add_argument('--force', action='store_true', help='also convert frames with NaNs or a mismatched vertex count')
+    args = parser.parse_args(argv)
+
+    folders = find_cache_folders(args.path)
+    if len(folders) == 0:
+        print('no text cache frames under', args.path)
+        return 1
+
+    jobs = [(fp, f) for fp, frames in folders.items() for f in frames]
+    print('found', len(jobs), 'text frames in', len(folders), 'folders')
+
+    start = time.time()
+    results = {}
+    with concurrent.futures.ProcessPoolExecutor(max_workers=args.workers) as pool:
+        txts = [str(fp.joinpath(str(f))) for fp, f in jobs]
+        chunk = max(1, len(jobs) // (8 * (args.workers or os.cpu_count() or 1)))
+
+        # the most common vertex count in a folder is taken as the right one
+        line_counts = {}
+        for job, count in zip(jobs, pool.map(count_verts, txts, chunksize=chunk)):
+            line_counts[job] = count
+        expected = {}
+        for fp, frames in folders.items():
+            u, c = np.unique([line_counts[(fp, f)] for f in frames], return_counts=True)
+            expected[fp] = int(u[np.argmax(c)])
+
+        vcs = [expected[fp] for fp, f in jobs]
+        flags = [[args.dry_run] * len(jobs), [args.force] * len(jobs)]
+        for job, result in zip(jobs, pool.map(convert_frame, txts, vcs, *flags, chunksize=chunk)):
+            results[job] = result
+    elapsed = time.time() - start
+
+    total_raw = 0
+    total_new = 0
+    converted = 0
+    failed = 0
+    skipped = 0
+    for fp, frames in folders.items():
+        counts = np.array([results[(fp, f)][0] for f in frames])
+        errors = [(f, results[(fp, f)][4]) for f in frames if results[(fp, f)][4] is not None]
+        nan_frames = [f for f in frames if results[(fp, f)][1] > 0]
+
+        vc = expected[fp]
+        failed_frames = [f for f, e in errors]
+        mismatched = [f for f, n in zip(frames, counts) if (n != vc) & (f not in failed_frames)]
+
+        msg = str(fp) + ': ' + str(len(frames)) + ' frames, ' + str(vc) + ' verts'
+        if len(nan_frames) > 0:
+            msg += ', NaNs in frames ' + str(nan_frames)
+        if len(mismatched) > 0:
+            msg += ', vertex count mismatch in frames ' + str(mismatched)
+        print(msg)
+        for f, e in errors:
+            print('    frame', f, 'failed:', e)
+
+        flagged = set(nan_frames) | set(mismatched)
+        for f in frames:
+            vcount, nans, raw, new, error = results[(fp, f)]
+            if error is not None:
+                failed += 1
+                continue
+            if (f in flagged) & (not args.force):
+                skipped += 1
+                continue
+            converted += 1
+            total_raw += raw
+            total_new += new
+            if not (args.keep | args.dry_run):
+                fp.joinpath(str(f)).unlink()
+
+    mb = total_raw / (1024 * 1024)
+    print()
+    print('parsed', converted, 'frames in', round(elapsed, 2), 's',
+          '(' + str(round(converted / max(elapsed, 1e-9), 1)) + ' frames/s,',
+          str(round(mb / max(elapsed, 1e-9), 1)) + ' MB/s of text)')
+    if failed > 0:
+        print(failed, 'frames failed to parse and were left as text')
+    if skipped > 0:
+        print(skipped, 'frames with NaNs or a vertex count mismatch were left as text. Use --force to convert them')
+
+    saved = 0.0
+    if total_raw > 0:
+        saved = (1 - total_new / total_raw) * 100
+    verb = 'would be' if args.dry_run else 'is'
+    print('text:', round(mb, 2), 'MB. binary', verb, round(total_new / (1024 * 1024), 2), 'MB', '(saves ' + str(round(saved, 1)) + '%)')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
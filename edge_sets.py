@@ -0,0 +1,61 @@
+"""Vertex pair sets.
+
+Each pair of vertex indices packs into one int64 key so
+edge sets can go through np.unique, np.isin and the other
+set functions exactly. Unordered keys treat [1, 4] and
+[4, 1] as the same pair. Vertex indices have to fit in
+32 bits.
+"""
+
+import numpy as np
+
+
+def pair_keys(pairs, ordered=False):
+    """One int64 key for each vertex pair. [1, 4] and
+    [4, 1] get the same key unless ordered is True."""
+    pairs = np.asarray(pairs, dtype=np.int64).reshape(-1, 2)
+    if ordered:
+        return (pairs[:, 0] << 32) | pairs[:, 1]
+    lo = np.minimum(pairs[:, 0], pairs[:, 1])
+    hi = np.maximum(pairs[:, 0], pairs[:, 1])
+    return (lo << 32) | hi
+
+
+def key_pairs(keys):
+    """Nx2 pairs back from pair_keys"""
+    return np.column_stack((keys >> 32, keys & 0xffffffff))
+
+
+def unique_pairs(pairs, ordered=False):
+    """Pairs without duplicates (or mirror duplicates
+    unless ordered). Unordered pairs come back as
+    [small, big]. Sorted by the first then second vert."""
+    return key_pairs(np.unique(pair_keys(pairs, ordered)))
+
+
+def pairs_in(pairs, other, ordered=False):
+    """Bool array. True where the pair is in other"""
+    return np.isin(pair_keys(pairs, ordered), pair_keys(other, ordered))
+
+
+def pairs_difference(pairs, other, ordered=False):
+    """Unique pairs that are not in other"""
+    return key_pairs(np.setdiff1d(pair_keys(pairs, ordered), pair_keys(other, ordered)))
+
+
+def pairs_union(pairs, other, ordered=False):
+    """Unique pairs in either set"""
+    return key_pairs(np.union1d(pair_keys(pairs, ordered), pair_keys(other, ordered)))
+
+
+def face_pairs(faces):
+    """Every ordered pair of different verts that
+    share a face. faces is a list of vertex lists
+    of any length."""
+    sizes = np.array([len(f) for f in faces], dtype=np.int64)
+    pairs = [np.zeros((0, 2), dtype=np.int64)]
+    for n in np.unique(sizes):
+        f = np.array([faces[i] for i in np.arange(sizes.shape[0])[sizes == n]], dtype=np.int64)
+        ij = [[i, j] for i in range(n) for j in range(n) if i != j]
+        pairs.append(f[:, ij].reshape(-1, 2))
+    return np.concatenate(pairs)
@@ -1,15 +1,37 @@
+import time
 
-# ---------------------four functions below------------------------------- <<
+try:
+    import bpy
+    import numpy as np
+except ImportError:
+    pass
+
+try:
+    from garments_render.simulation.bary_kernels import bary_project
+except ImportError:
+    bary_project = bpy.data.texts['bary_kernels.py'].as_module().bary_project
+
+# edge set functions live in edge_sets.py
+try:
+    from garments_render.simulation.edge_sets import pair_keys, key_pairs, unique_pairs, pairs_in, pairs_difference, pairs_union, face_pairs
+except ImportError:
+    edge_sets = bpy.data.texts['edge_sets.py'].as_module()
+    pair_keys = edge_sets.pair_keys
+    key_pairs = edge_sets.key_pairs
+    unique_pairs = edge_sets.unique_pairs
+    pairs_in = edge_sets.pairs_in
+    pairs_difference = edge_sets.pairs_difference
+    pairs_union = edge_sets.pairs_union
+    face_pairs = edge_sets.face_pairs
+
+
+# -------------------find_doubles functions below------------------------- <<
 def eliminate_duplicate_pairs(ar):
     """Eliminates duplicates and mirror duplicates.
     for example, [1,4], [4,1] or duplicate occurrences of [1,4]
     Returns an Nx2 array."""
-    # no idea how this works (probably sorcery) but it's really fast
-    a = np.sort(ar, axis=1)
-    x = np.random.rand(a.shape[1])
-    y = a @ x
-    unique, index = np.unique(y, return_index=True)
-    return a[index]
+    # packed into int64 keys so it's exact
+    return unique_pairs(ar)
 
 
 def tree(co, margin=0.001, _idx=None):
@@ -19,7 +41,6 @@ def tree(co, margin=0.001, _idx=None):
     b_max = np.max(co, axis=0)
     mid = b_min + ((b_max - b_min) / 2)
 
-    bpy.data.objects['a'].location = mid
     # l = left, r = right, f = front, b = back, u = up, d = down
     idx = np.arange(co.shape[0], dtype=np.int32)
     boxes = []
@@ -104,19 +125,13 @@ def branches(co, margin):
     return boxes
     
 
-def find_doubles(ob, margin=0.001):
-    """Finds verts whose distance from each
-    other is less than the margin.
-    Returns an Nx2 numpy arry of close pairs."""
-    
-    vc = len(ob.data.vertices)
-    co = np.empty((vc, 3), dtype=np.float32)
-    ob.data.vertices.foreach_get('co', co.ravel())
-
+def box_doubles(co, margin=0.001):
+    """The original find_doubles search. All pairs
+    in each box from branches. Kept for doubles_benchmark"""
     boxes = branches(co, margin)
     dubs = []
     m = margin ** 2
-    
+
     for bz in boxes:
         if bz.shape[0] > 0:
             c = co[bz]
@@ -125,12 +140,142 @@ def find_doubles(ob, margin=0.001):
             agw = np.argwhere(d <= m)
             cull = agw[:, 0] == agw[:, 1]
             agwc = agw[~cull]
-            if agwc.shape[0] > 0:    
-                
+            if agwc.shape[0] > 0:
+
                 dubs += bz[agwc].tolist()
-        
+
+    if len(dubs) == 0:
+        return np.zeros((0, 2), dtype=np.int64)
     return eliminate_duplicate_pairs(np.array(dubs))
-# ------------------------four functions above---------------------------- >>
+
+
+def hash_doubles(co, margin=0.001, chunk=4000000):
+    """Finds points whose distance from each
+    other is less than the margin.
+    Points get sorted into cells the size of the
+    margin so a point can only be close to points
+    in its own cell or the 26 around it. Each pair
+    of cells is checked once (the cell itself and 13
+    neighbors) and chunk limits how many candidate
+    pairs are measured at a time.
+    Returns an Nx2 array of sorted pairs in order."""
+    co = np.asarray(co)
+    if co.shape[0] < 2:
+        return np.zeros((0, 2), dtype=np.int64)
+
+    # cells grow past the margin if the grid would be
+    #   too big for int64 keys. Still right, just slower.
+    c64 = co.astype(np.float64)
+    b_min = np.min(c64, axis=0)
+    size = max(margin, np.max(np.max(c64, axis=0) - b_min) / 2 ** 20)
+    if size == 0:
+        size = 1.0
+
+    # one key per cell with a border so neighbors of
+    #   the edge cells don't wrap around
+    cells = np.floor((c64 - b_min) / size).astype(np.int64) + 1
+    dims = np.max(cells, axis=0) + 2
+    keys = (cells[:, 0] * dims[1] + cells[:, 1]) * dims[2] + cells[:, 2]
+
+    order = np.argsort(keys, kind='stable')
+    cell_keys, start, count = np.unique(keys[order], return_index=True, return_counts=True)
+    point_cell = np.repeat(np.arange(cell_keys.shape[0]), count)
+
+    offsets = [(x, y, z) for x in (-1, 0, 1) for y in (-1, 0, 1) for z in (-1, 0, 1)]
+    offsets = [o for o in offsets if o > (0, 0, 0)]
+
+    m = margin ** 2
+    pairs = []
+
+    # same cell. every point with the points after it
+    after = start[point_cell] + count[point_cell] - np.arange(order.shape[0]) - 1
+    pairs += close_pairs(co, order, np.arange(order.shape[0]) + 1, after, m, chunk)
+
+    # neighbor cells. every point with every point in the cell
+    for x, y, z in offsets:
+        n_keys = cell_keys + (x * dims[1] + y) * dims[2] + z
+        n_cell = np.searchsorted(cell_keys, n_keys)
+        n_cell[n_cell == cell_keys.shape[0]] = 0
+        found = cell_keys[n_cell] == n_keys
+        n_start = np.where(found, start[n_cell], 0)
+        n_count = np.where(found, count[n_cell], 0)
+        pairs += close_pairs(co, order, n_start[point_cell], n_count[point_cell], m, chunk)
+
+    if len(pairs) == 0:
+        return np.zeros((0, 2), dtype=np.int64)
+    pairs = np.concatenate(pairs)
+    pairs.sort(axis=1)
+    return pairs[np.lexsort((pairs[:, 1], pairs[:, 0]))]
+
+
+def close_pairs(co, order, n_start, n_count, m, chunk):
+    """Measures each sorted point against n_count
+    sorted points from n_start. Returns a list of
+    pair arrays closer than sqrt(m)."""
+    pairs = []
+    ends = np.cumsum(n_count)
+    first = 0
+    while first < order.shape[0]:
+        # as many points as fit in the chunk (at least one)
+        base = 0 if first == 0 else ends[first - 1]
+        last = max(np.searchsorted(ends, base + chunk, side='right'), first + 1)
+        last = min(last, order.shape[0])
+
+        nc = n_count[first:last]
+        total = ends[last - 1] - base
+        if total > 0:
+            l = np.repeat(np.arange(first, last), nc)
+            step = np.arange(total) - np.repeat(ends[first:last] - nc - base, nc)
+            r = np.repeat(n_start[first:last], nc) + step
+
+            l = order[l]
+            r = order[r]
+            vecs = co[l] - co[r]
+            close = np.einsum('ij,ij->i', vecs, vecs) <= m
+            if np.any(close):
+                pairs.append(np.column_stack((l[close], r[close])))
+        first = last
+
+    return pairs
+
+
+def find_doubles(ob, margin=0.001):
+    """Finds verts whose distance from each
+    other is less than the margin.
+    Returns an Nx2 numpy arry of close pairs."""
+
+    vc = len(ob.data.vertices)
+    co = np.empty((vc, 3), dtype=np.float32)
+    ob.data.vertices.foreach_get('co', co.ravel())
+
+    return hash_doubles(co, margin)
+
+
+def doubles_benchmark(count=20000, margin=0.001, doubles=0.1, seed=0):
+    """Times box_doubles against hash_doubles on random
+    points in a unit cube with some points moved
+    to within the margin of another point."""
+    rng = np.random.default_rng(seed)
+    co = rng.random((count, 3)).astype(np.float32)
+    d = int(count * doubles)
+    co[:d] = co[d: d * 2] + (rng.random((d, 3)) - 0.5).astype(np.float32) * margin
+
+    start = time.time()
+    old = box_doubles(co, margin)
+    old_time = time.time() - start
+
+    start = time.time()
+    new = hash_doubles(co, margin)
+    new_time = time.time() - start
+
+    old = old[np.lexsort((old[:, 1], old[:, 0]))]
+    same = (old.shape == new.shape) and np.all(old == new)
+    print('points:', count, 'pairs:', new.shape[0], 'same pairs:', same)
+    print('box_doubles:', round(old_time, 4), 'hash_doubles:', round(new_time, 4))
+    return old_time, new_time
+
+
+# --------------------find_doubles functions above------------------------ >>
 
 
 def merge_verts(ob, margin=0.001, obm=None):
@@ -183,19 +328,8 @@ def distance_along_normal(tris, points):
     """Return the distance along the cross
     product and the distance along normalized
     cross product"""
-    origins = tris[:, 0]
-    cross_vecs = tris[:, 1:] - origins[:, nax]    
-    v2 = points - origins
-    
-    cross = np.cross(cross_vecs[:,0], cross_vecs[:,1])
-    d_v2_c = np.einsum('ij,ij->i', v2, cross)
-    d_v2_v2 = np.einsum('ij,ij->i', cross, cross) 
-    div = d_v2_c / d_v2_v2        
-
-    U_cross = cross / np.sqrt(d_v2_v2)[:, None]
-    U_d = np.einsum('ij,ij->i', v2, U_cross)
-        
-    return div, U_d# for normalized
+    B = bary_project(tris, points)
+    return B.div, B.offset # for normalized
 
 
 def connect_panels(self, s_norm_val=1.0, offset_steps=0, correct_rotation=True, reverse=False):
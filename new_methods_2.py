@@ -2,6 +2,11 @@ import bpy
 import numpy as np
 from numpy import newaxis as nax
 
+try:
+    from scipy.spatial import cKDTree
+except ImportError:
+    cKDTree = None
+
 
 def get_uv_index_from_3d(ob):
     """Creates a two dimensional including where each vert
@@ -35,64 +40,117 @@ def get_uv_index_from_3d(ob):
     return v_sets
     
 
+class Voxels():
+    # cell of every vert from voxel_grid
+    pass
+
+
+def voxel_grid(co, box_count=10, size=None, csr=False):
+    """Every vert gets the int64 key of the cell it's in.
+    The largest dimension gets box_count cells and the
+    other axes get as many whole cells as fit, stretched
+    to fill (like grid_sample always did). size gives every
+    axis cells of that size instead (collision broad-phase).
+    csr also sorts the verts by cell (see voxel_csr)."""
+    vox = Voxels()
+    # one column at a time is much faster than axis=0 on Nx3
+    b_min = np.array([np.min(co[:, i]) for i in range(3)], dtype=co.dtype)
+    dimensions = np.array([np.max(co[:, i]) for i in range(3)], dtype=co.dtype) - b_min
+
+    if size is None:
+        box_size = np.max(dimensions) / box_count
+        counts = np.ones(3, dtype=np.int64)
+        if box_size > 0:
+            counts = np.maximum(dimensions // box_size, 1).astype(np.int64)
+        cell = np.where(dimensions > 0, dimensions / counts, 1.0).astype(co.dtype)
+    else:
+        cell = np.full(3, size, dtype=co.dtype)
+        counts = np.maximum(np.ceil(dimensions / cell), 1).astype(np.int64)
+
+    # the max corner lands in the last cell instead of a new one
+    ijk = ((co - b_min) / cell).astype(np.int64)
+    np.minimum(ijk, counts - 1, out=ijk)
+    vox.keys = (ijk[:, 0] * counts[1] + ijk[:, 1]) * counts[2] + ijk[:, 2]
+    vox.ijk = ijk
+    vox.min = b_min
+    vox.cell = cell
+    vox.counts = counts
+
+    vox.cell_keys = None
+    vox.indptr = None
+    vox.indices = None
+    if csr:
+        voxel_csr(vox)
+    return vox
+
+
+def voxel_csr(vox):
+    """Verts grouped by cell. The verts in cell_keys[i]
+    are indices[indptr[i]: indptr[i + 1]] in index order.
+    Only cells with verts are listed."""
+    keys = vox.keys
+    if np.prod(vox.counts) <= 65536:
+        keys = keys.astype(np.uint16) # stable sorts of 16 bit ints are radix sorts
+    indices = np.argsort(keys, kind='stable')
+    sk = vox.keys[indices]
+    new_cell = np.ones(sk.shape[0], dtype=np.bool)
+    new_cell[1:] = sk[1:] != sk[:-1]
+    start = np.arange(sk.shape[0])[new_cell]
+
+    vox.cell_keys = sk[start]
+    vox.indptr = np.append(start, sk.shape[0])
+    vox.indices = indices
+    return vox
+
+
+def voxel_sample(vox, co, pick='first'):
+    """One sample for each cell with verts in it.
+    pick 'first' gives the lowest vert index in the cell,
+    'center' the vert nearest the middle of the cell
+    (lowest index on ties) and 'mean' the mean coords
+    of the verts in the cell. Samples are in cell_keys order."""
+    if pick == 'first':
+        if vox.indices is None:
+            # small grids skip the sort
+            cells = np.prod(vox.counts)
+            if cells <= co.shape[0] * 4:
+                first = np.full(cells, co.shape[0], dtype=np.int64)
+                np.minimum.at(first, vox.keys, np.arange(co.shape[0]))
+                return first[first != co.shape[0]]
+            voxel_csr(vox)
+        return vox.indices[vox.indptr[:-1]]
+
+    if vox.indices is None:
+        voxel_csr(vox)
+    start = vox.indptr[:-1]
+    count = np.diff(vox.indptr)
+    sorted_co = co[vox.indices]
+
+    if pick == 'mean':
+        return np.add.reduceat(sorted_co.astype(np.float64), start, axis=0) / count[:, None]
+
+    if pick == 'center':
+        center = vox.min + (vox.ijk[vox.indices] + 0.5) * vox.cell
+        vecs = sorted_co - center
+        d = np.einsum('ij,ij->i', vecs, vecs)
+        closest = d == np.repeat(np.minimum.reduceat(d, start), count)
+        pos = np.arange(d.shape[0])[closest]
+        cell_id = np.repeat(np.arange(start.shape[0]), count)[pos]
+        first = np.ones(pos.shape[0], dtype=np.bool)
+        first[1:] = cell_id[1:] != cell_id[:-1]
+        return vox.indices[pos[first]]
+
+    raise ValueError("pick must be 'first', 'center' or 'mean'")
+
+
 def grid_sample(ob, box_count=10, offset=0.00001):
     """divide mesh into grid and sample from each segment.
-    offset prevents boxes from excluding any verts"""
+    Every vert is in exactly one cell now so offset
+    isn't needed. Kept so old calls still work.
+    For collisions use voxel_grid with csr=True."""
     co = get_co(ob)
-    
-    # get bounding box corners
-    min = np.min(co, axis=0)
-    max = np.max(co, axis=0)
-    
-    # box count is based on largest dimension
-    dimensions = max - min
-    largest_dimension = np.max(dimensions)
-    box_size = largest_dimension / box_count
-    
-    # get box count for each axis
-    xyz_count = dimensions // box_size # number of boxes on each axis
-    
-    # number of boxes on each axis:
-    box_dimensions = dimensions / xyz_count # each box is this size
-    
-    line_end = max - box_dimensions # we back up one from the last value
-    
-    x_line = np.linspace(min[0], line_end[0], num=xyz_count[0], dtype=np.float32)
-    y_line = np.linspace(min[1], line_end[1], num=xyz_count[1], dtype=np.float32)
-    z_line = np.linspace(min[2], line_end[2], num=xyz_count[2], dtype=np.float32)
-    
-    idxer = np.arange(co.shape[0])
-    
-    # get x bools
-    x_grid = co[:, 0] - x_line[:,nax]
-    x_bools = (x_grid + offset > 0) & (x_grid - offset < box_dimensions[0])
-    cull_x_bools = x_bools[np.any(x_bools, axis=1)] # eliminate grid sections with nothing
-    xb = cull_x_bools
-
-    x_idx = np.tile(idxer, (xyz_count[0], 1))
-    
-    samples = []
-    
-    for boo in xb:
-        xidx = idxer[boo]
-        y_grid = co[boo][:, 1] - y_line[:,nax]
-        y_bools = (y_grid + offset > 0) & (y_grid - offset < box_dimensions[1])
-        cull_y_bools = y_bools[np.any(y_bools, axis=1)] # eliminate grid sections with nothing
-        yb = cull_y_bools
-        for yboo in yb:
-            yidx = xidx[yboo]
-            z_grid = co[yidx][:, 2] - z_line[:,nax]
-            z_bools = (z_grid + offset > 0) & (z_grid - offset < box_dimensions[2])
-            cull_z_bools = z_bools[np.any(z_bools, axis=1)] # eliminate grid sections with nothing
-            zb = cull_z_bools        
-            for zboo in zb:
-                samples.append(yidx[zboo][0])
-            
-                # !!! to use this for collisions !!!:
-                if False:    
-                    samples.extend(yidx[zboo])
-    
-    return np.unique(samples) # if offset is zero we don't need unique... return samples
+    vox = voxel_grid(co, box_count)
+    return np.sort(voxel_sample(vox, co))
 
 
 def edge_to_edge(e1, e2, e3, e4 ):
@@ -217,13 +275,197 @@ def hide_all(ob, hide=False):
         att.foreach_set('hide', arr)
 
 
+class KDTree():
+    # point tree for kd_radius and kd_nearest
+    pass
+
+
+def kd_tree(co, leaf_size=16):
+    """Build a tree on Nx3 coords. Uses scipy's cKDTree
+    when it's installed, otherwise nodes are split at the
+    median of their widest axis until they fit in a leaf.
+    The coords are kept as they are so distances come
+    out the same as measuring them directly."""
+    tree = KDTree()
+    tree.co = co
+    tree.ck = None
+    if cKDTree is not None:
+        tree.ck = cKDTree(co)
+        return tree
+
+    perm = np.arange(co.shape[0])
+    start = [0]
+    end = [co.shape[0]]
+    axis = [0]
+    split = [0.0]
+    left = [-1]
+    right = [-1]
+
+    stack = [0]
+    while len(stack) > 0:
+        n = stack.pop()
+        s, e = start[n], end[n]
+        if e - s <= leaf_size:
+            continue
+        c = co[perm[s:e]]
+        ax = np.argmax(np.max(c, axis=0) - np.min(c, axis=0))
+        mid = (e - s) // 2
+        part = np.argpartition(c[:, ax], mid)
+        perm[s:e] = perm[s:e][part]
+
+        # left is <= split and right is >= split
+        axis[n] = ax
+        split[n] = co[perm[s + mid], ax]
+        left[n] = len(start)
+        right[n] = len(start) + 1
+        start += [s, s + mid]
+        end += [s + mid, e]
+        axis += [0, 0]
+        split += [0.0, 0.0]
+        left += [-1, -1]
+        right += [-1, -1]
+        stack += [left[n], right[n]]
+
+    tree.perm = perm
+    tree.axis = np.array(axis, dtype=np.int64)
+    tree.split = np.array(split, dtype=np.float64)
+    tree.left = np.array(left, dtype=np.int64)
+    tree.right = np.array(right, dtype=np.int64)
+
+    # leaves padded to the same size with -1
+    start = np.array(start)
+    count = np.array(end) - start
+    tree.leaf_idx = np.full((len(start), max(leaf_size, 1)), -1, dtype=np.int64)
+    leaves = np.arange(len(start))[tree.left == -1]
+    for n in leaves:
+        tree.leaf_idx[n, :count[n]] = perm[start[n]: start[n] + count[n]]
+    return tree
+
+
+def kd_leaves(tree, points, r):
+    """Every leaf each point needs to check to
+    find tree points within r of it (r is per point).
+    Returns point and leaf index arrays."""
+    q = np.arange(points.shape[0])
+    n = np.zeros(points.shape[0], dtype=np.int64)
+    leaf_q = []
+    leaf_n = []
+    while q.shape[0] > 0:
+        leaf = tree.left[n] == -1
+        leaf_q.append(q[leaf])
+        leaf_n.append(n[leaf])
+        q = q[~leaf]
+        n = n[~leaf]
+
+        diff = points[q, tree.axis[n]] - tree.split[n]
+        first = diff <= 0
+        near = np.where(first, tree.left[n], tree.right[n])
+        far = np.where(first, tree.right[n], tree.left[n])
+        cross = np.abs(diff) <= r[q]
+        q = np.concatenate((q, q[cross]))
+        n = np.concatenate((near, far[cross]))
+
+    return np.concatenate(leaf_q), np.concatenate(leaf_n)
+
+
+def kd_radius(tree, points, r, chunk=65536, sq_dist=False):
+    """Pairs of (point index, tree index) where the tree
+    point is within r of the point (inclusive). r can be
+    one value or one per point. Points are queried chunk
+    at a time. sq_dist also returns the squared distance
+    measured the way the coords are stored."""
+    points = np.asarray(points)
+    r = np.broadcast_to(np.asarray(r, dtype=np.float64), (points.shape[0],))
+    pi = []
+    ti = []
+    for c in range(0, points.shape[0], chunk):
+        pts = points[c: c + chunk]
+        rc = r[c: c + chunk]
+        if tree.ck is not None:
+            found = tree.ck.query_ball_point(pts, rc, return_sorted=False)
+            counts = np.array([len(f) for f in found], dtype=np.int64)
+            q = np.repeat(np.arange(pts.shape[0]), counts)
+            t = np.array([i for f in found for i in f], dtype=np.int64)
+        else:
+            q, n = kd_leaves(tree, pts, rc)
+            cand = tree.leaf_idx[n]
+            q = np.repeat(q, cand.shape[1])
+            t = cand.ravel()
+            valid = t != -1
+            q = q[valid]
+            t = t[valid]
+        vecs = tree.co[t] - pts[q]
+        d = np.einsum('ij,ij->i', vecs, vecs)
+        if tree.ck is None:
+            keep = d <= rc[q] ** 2
+            q = q[keep]
+            t = t[keep]
+        pi.append(q + c)
+        ti.append(t)
+
+    if len(pi) == 0:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+    return np.concatenate(pi), np.concatenate(ti)
+
+
+def kd_nearest(tree, points, chunk=65536):
+    """Nearest tree point to each point.
+    Returns the squared distances and tree indices."""
+    points = np.asarray(points)
+    if tree.ck is not None:
+        idx = np.empty(points.shape[0], dtype=np.int64)
+        for c in range(0, points.shape[0], chunk):
+            idx[c: c + chunk] = tree.ck.query(points[c: c + chunk])[1]
+        vecs = tree.co[idx] - points
+        return np.einsum('ij,ij->i', vecs, vecs), idx
+
+    # the leaf each point lands in gives a radius that
+    #   must hold the nearest point. Then search that radius.
+    q = np.arange(points.shape[0])
+    n = np.zeros(points.shape[0], dtype=np.int64)
+    while True:
+        inner = tree.left[n] != -1
+        if not np.any(inner):
+            break
+        first = points[q[inner], tree.axis[n[inner]]] <= tree.split[n[inner]]
+        n[inner] = np.where(first, tree.left[n[inner]], tree.right[n[inner]])
+
+    cand = tree.leaf_idx[n]
+    vecs = tree.co[np.maximum(cand, 0)] - points[:, None]
+    d = np.einsum('ijk,ijk->ij', vecs, vecs).astype(np.float64)
+    d[cand == -1] = np.inf
+    r = np.sqrt(np.min(d, axis=1)) * (1 + 1e-6)
+
+    best = np.full(points.shape[0], np.inf)
+    idx = np.full(points.shape[0], -1, dtype=np.int64)
+    pi, ti = kd_radius(tree, points, r, chunk)
+    vecs = tree.co[ti] - points[pi]
+    d = np.einsum('ij,ij->i', vecs, vecs)
+
+    # smallest distance for each point (lowest index on ties)
+    order = np.lexsort((ti, d, pi))
+    pi = pi[order]
+    first = np.ones(pi.shape[0], dtype=np.bool)
+    first[1:] = pi[1:] != pi[:-1]
+    idx[pi[first]] = ti[order][first]
+    best[pi[first]] = d[order][first]
+    return best.astype(d.dtype), idx
+
+
 def coincident_points(group_a, group_b, threshold=.0001, inverse=True):
     """finds the index of points in group a that match the location of at
     least one point in group b. Returns the inverse by default: points that have no match
     returns a bool array matching the first dimension of group_a"""
-    x = group_b - group_a[:, nax]
-    dist = np.einsum('ijk, ijk->ij', x, x)
-    min_dist = np.min(dist, axis=1)
+    # threshold is a squared distance. Only points of b that
+    #   could be under it get measured (a little extra for rounding).
+    tree = kd_tree(group_b)
+    r = np.sqrt(max(threshold, 0)) * (1 + 1e-6)
+    pi, ti = kd_radius(tree, group_a, r)
+
+    x = group_b[ti] - group_a[pi]
+    dist = np.einsum('ij, ij->i', x, x)
+    min_dist = np.full(group_a.shape[0], np.inf, dtype=dist.dtype)
+    np.minimum.at(min_dist, pi, dist)
     if inverse:
         return min_dist > threshold
     return min_dist < threshold
@@ -232,15 +474,19 @@ def coincident_points(group_a, group_b, threshold=.0001, inverse=True):
 def remove_doubles(group, threshold=.0001):
     """finds coincident points and returns a bool array eliminating all but the first
     occurance of the coincident points"""
-    x = group - group[:, nax]
-    dist = np.einsum('ijk, ijk->ij', x, x)
-    pairs = dist < threshold
-    doubles = np.sum(pairs, axis=0) > 1
-    idx = np.arange(len(group))[doubles]
     all_true = np.ones(len(group), dtype=np.bool)
-    for i in idx:
-        this = np.all((group[i] - group[idx]) == 0, axis=1)
-        all_true[idx[this][1:]] = False
+    if not threshold > 0:
+        return all_true
+
+    # doubles are points at exactly the same spot
+    #   so only distance zero needs searching
+    tree = kd_tree(group)
+    pi, ti = kd_radius(tree, group, 0.0)
+    later = ti > pi
+    pi = pi[later]
+    ti = ti[later]
+    same = np.all((group[pi] - group[ti]) == 0, axis=1)
+    all_true[ti[same]] = False
     return all_true
 
 
@@ -7,6 +7,11 @@ try:
     import bpy
     import numpy as np
     import json
+    import os
+    import io
+    import base64
+    import hashlib
+    import concurrent.futures
     actual_frames = [0]
     test_cache = False
     #test_cache = True
@@ -18,6 +23,7 @@ try:
     from garments_blender.utils.rich_blender_utils import fix_all_shape_key_nans
     from garments_blender.utils.rich_blender_utils import B_log
     from garments_render.simulation.MC_tools import read_python_script
+    from garments_render.simulation import MC_tools as mct
     internal_log = B_log()
     internal_log.module = 'seam wrangler'
     internal_log.active = True
@@ -37,7 +43,16 @@ except:
     fix_all_shape_key_nans = rbu.fix_all_shape_key_nans
     mct = bpy.data.texts['MC_tools.py'].as_module()
     read_python_script = mct.read_python_script
-    
+
+
+# div_eps is the floor for divisions in the solvers
+try:
+    from garments_render.simulation.bary_kernels import bary_project, div_eps
+except ImportError:
+    bary_kernels = bpy.data.texts['bary_kernels.py'].as_module()
+    bary_project = bary_kernels.bary_project
+    div_eps = bary_kernels.div_eps
+
 
 def setup_pin_group(ob, vidx):
     # setup vertex pin group. (matches points manipulated by seam manager)
@@ -119,40 +134,44 @@ def link_mesh(verts, edges=[], faces=[], name='name'):
     return mesh_ob
 
 
+def link_mesh_arrays(verts, edges, faces, name='name'):
+    """Generate and link a new object from arrays.
+    Faces is Nxk (every face has k sides).
+    Sets everything with foreach_set so big meshes
+    skip python lists."""
+    mesh = bpy.data.meshes.new(name)
+    mesh.vertices.add(verts.shape[0])
+    mesh.vertices.foreach_set('co', np.array(verts, dtype=np.float32).ravel())
+    mesh.edges.add(edges.shape[0])
+    mesh.edges.foreach_set('vertices', np.array(edges, dtype=np.int32).ravel())
+
+    fc, sides = faces.shape
+    mesh.loops.add(fc * sides)
+    mesh.loops.foreach_set('vertex_index', np.array(faces, dtype=np.int32).ravel())
+    mesh.polygons.add(fc)
+    mesh.polygons.foreach_set('loop_start', np.arange(0, fc * sides, sides, dtype=np.int32))
+    if bpy.app.version < (4, 0, 0): # read only after 4.0
+        mesh.polygons.foreach_set('loop_total', np.full(fc, sides, dtype=np.int32))
+
+    mesh.update(calc_edges=True)
+    mesh_ob = bpy.data.objects.new(name, mesh)
+    bpy.context.collection.objects.link(mesh_ob)
+    return mesh_ob
+
+
 def get_weights(tris, points):
     """Find barycentric weights for triangles.
     Tris is a Nx3x3 set of triangle coords.
     points is the same N in Nx3 coords"""
-    origins = tris[:, 0]
-    cross_vecs = tris[:, 1:] - origins[:, None]
-    v2 = points - origins
-
-    # ---------
-    v0 = cross_vecs[:,0]
-    v1 = cross_vecs[:,1]
+    return bary_project(tris, points).weights
 
-    d00_d11 = np.einsum('ijk,ijk->ij', cross_vecs, cross_vecs)
-    d00 = d00_d11[:,0]
-    d11 = d00_d11[:,1]
-    d01 = np.einsum('ij,ij->i', v0, v1)
-    d02 = np.einsum('ij,ij->i', v0, v2)
-    d12 = np.einsum('ij,ij->i', v1, v2)
 
-    div = 1 / (d00 * d11 - d01 * d01)
-    u = (d11 * d02 - d01 * d12) * div
-    v = (d00 * d12 - d01 * d02) * div
-
-    weights = np.array([1 - (u+v), u, v, ]).T
-    return weights
-
-
-def create_triangles(Slice, s_count, x_off=None):
+def create_triangles(s, x_off=None):
     """Creates equalateral triangles whose edge length
     is similar to the distance between slices so that
     the bend stifness is more stable.
     x_off is for debug moving the next slice over"""
 
-    s = Slice.seam_sets[s_count]
     means = s['tri_means']
     dist = np.copy(s['dst'])
     dist[0] = s['avd']
@@ -184,11 +203,10 @@ def create_triangles(Slice, s_count, x_off=None):
     return tri
 
 
-def create_mesh_data(Slice, s_count):
+def create_mesh_data(s):
     """Build edge and face data for
     the tubes of triangles"""
 
-    s = Slice.seam_sets[s_count]
     tri = s['tris']
     count = tri.shape[0]
 
@@ -209,13 +227,246 @@ def create_mesh_data(Slice, s_count):
     return ed, fa
 
 
-def slice_setup(Slice, cloth_key=None): # !!! set testing to False !!!
-    testing = False
-    #print("seam wrangler is reminding you to set slice_setup testing to False")
-    file = bpy.data.texts['slice_targets.json']
-    slices = json.loads(file.as_string())
-    Slice.count = len(slices)
+def slice_arrays(s):
+    """Convert one seam from the slice targets to
+    dense arrays. Vertex pointers are slices by
+    target points with -1 where the json has None."""
+    vp = np.array(s['vert_ptrs'], dtype=object).T
+    valid = vp != None
+    vp = np.where(valid, vp, -1).astype(np.int32)
+    xy = np.array(s['target_xys'], dtype=np.float32)
+    return vp, np.array(valid, dtype=np.bool), xy
+
+
+slice_target_cache = {'key': None, 'seams': None}
+
+
+def slice_targets_to_arrays(slices):
+    """Pack parsed json slice targets into flat arrays.
+    vert_ptrs is every seam's slices by target points
+    raveled with -1 where the json has None.
+    seam_offsets index target_xys for each seam."""
+    seams = [slice_arrays(s) for s in slices]
+    k_counts = np.array([xy.shape[0] for vp, valid, xy in seams], dtype=np.int64)
+    offsets = np.zeros(len(seams) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum(k_counts)
+    return {'vert_ptrs': np.hstack([np.empty(0, dtype=np.int32)] + [vp.ravel() for vp, valid, xy in seams]),
+            'target_xys': np.vstack([np.empty((0, 2), dtype=np.float32)] + [xy for vp, valid, xy in seams]),
+            'seam_offsets': offsets,
+            'slice_counts': np.array([vp.shape[0] for vp, valid, xy in seams], dtype=np.int32),
+            }
+
+
+def arrays_to_seams(arrays):
+    """Split the flat slice target arrays
+    into (vp, valid, xy) for each seam"""
+    offsets = arrays['seam_offsets']
+    s_counts = arrays['slice_counts']
+    k_counts = np.diff(offsets)
+    vp_offsets = np.zeros(len(s_counts) + 1, dtype=np.int64)
+    vp_offsets[1:] = np.cumsum(s_counts * k_counts)
+
+    seams = []
+    for i in range(len(s_counts)):
+        vp = arrays['vert_ptrs'][vp_offsets[i]: vp_offsets[i + 1]]
+        vp = vp.reshape(s_counts[i], k_counts[i])
+        xy = arrays['target_xys'][offsets[i]: offsets[i + 1]]
+        seams += [(vp, vp != -1, xy)]
+    return seams
+
+
+def slice_targets_hash(text):
+    """Fingerprint of the json text the binary
+    slice targets were written from"""
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+
+def slice_targets_current(arrays, json_hash):
+    """False if the binary slice targets weren't written
+    from the json text with this hash. Binaries from before
+    the hash was stored can't be checked so they lose
+    to the json when there is one."""
+    if json_hash is None:
+        return True
+    if 'json_hash' not in arrays:
+        return False
+    return str(arrays['json_hash']) == json_hash
+
+
+def write_slice_targets(slices=None, path=None, pack=False):
+    """Convert json slice targets to the binary format.
+    slices is the parsed json, the path to a json file or
+    None for the 'slice_targets.json' text block. Saves
+    slice_targets.npz next to the blend file unless a path
+    is given. pack stores it in the blend as the
+    'slice_targets.npz' text block instead.
+    The hash of the json text goes in with the arrays so
+    load_slice_targets can tell when the json was edited."""
+    json_hash = ''
+    if slices is None:
+        text = bpy.data.texts['slice_targets.json'].as_string()
+        json_hash = slice_targets_hash(text)
+        slices = json.loads(text)
+    elif isinstance(slices, str):
+        with open(slices) as file:
+            text = file.read()
+        json_hash = slice_targets_hash(text)
+        slices = json.loads(text)
+
+    arrays = slice_targets_to_arrays(slices)
+    arrays['json_hash'] = np.array(json_hash)
+
+    if pack:
+        buf = io.BytesIO()
+        np.savez_compressed(buf, **arrays)
+        if 'slice_targets.npz' not in bpy.data.texts:
+            bpy.data.texts.new('slice_targets.npz')
+        text = bpy.data.texts['slice_targets.npz']
+        text.from_string(base64.b64encode(buf.getvalue()).decode('ascii'))
+        return text
+
+    if path is None:
+        path = bpy.path.abspath('//slice_targets.npz')
+    np.savez_compressed(path, **arrays)
+    return path
+
+
+def load_slice_targets():
+    """Slice targets as (vp, valid, xy) for each seam.
+    Reads slice_targets.npz next to the blend file, then
+    the packed 'slice_targets.npz' text, then falls back
+    to parsing 'slice_targets.json'. A binary written from
+    a different version of the json text is skipped for the
+    json. Keeps the result until the sources change."""
+    json_hash = None
+    if 'slice_targets.json' in bpy.data.texts:
+        json_hash = slice_targets_hash(bpy.data.texts['slice_targets.json'].as_string())
+
+    path = None
+    if bpy.data.filepath != '':
+        path = bpy.path.abspath('//slice_targets.npz')
+
+    if (path is not None) and os.path.exists(path):
+        key = (path, os.path.getmtime(path), json_hash)
+    elif 'slice_targets.npz' in bpy.data.texts:
+        text = bpy.data.texts['slice_targets.npz'].as_string()
+        key = ('packed', hash(text), json_hash)
+    else:
+        key = ('json', json_hash)
+
+    if slice_target_cache['key'] == key:
+        return slice_target_cache['seams']
+
+    seams = None
+    if key[0] != 'json':
+        if key[0] == 'packed':
+            with np.load(io.BytesIO(base64.b64decode(text))) as arrays:
+                arrays = dict(arrays)
+        else:
+            with np.load(path) as arrays:
+                arrays = dict(arrays)
 
+        if slice_targets_current(arrays, json_hash):
+            seams = arrays_to_seams(arrays)
+        else:
+            b_log(['binary slice targets are out of date with slice_targets.json. Parsing the json. Run write_slice_targets to update them'])
+
+    if seams is None:
+        text = bpy.data.texts['slice_targets.json'].as_string()
+        seams = [slice_arrays(s) for s in json.loads(text)]
+
+    slice_target_cache['key'] = key
+    slice_target_cache['seams'] = seams
+    return seams
+
+
+def seam_set(vp, valid, xy, flat_co):
+    """Build the data for one seam from dense
+    vertex pointers (-1 where missing), the
+    validity mask and the target xys."""
+
+    tri_tick, t_count = vp.shape # tri_tick is for offsetting the tri tiler when merging
+    counts = np.count_nonzero(valid, axis=1)
+    good_bool = counts > 0   # True where there is at least one vp
+    complete = counts == t_count # areas with no Nones. Used for placing tris
+    ara = np.arange(t_count, dtype=np.int32)
+
+    xys = [xy[v] for v in valid] # xy map
+    vps = [p[v] for p, v in zip(vp, valid)] # vertex pointers
+    idxs = [ara[v] for v in valid] # aranged indexer for each slice
+
+    # tiled fancy index for getting weights
+    tri_tiler = np.repeat(np.arange(tri_tick, dtype=np.int32), counts)
+    good_xys = np.broadcast_to(xy, (tri_tick, t_count, 2))[valid] # xys where there is at least one vp
+
+    # center of built triangles
+    slice_means = np.array((valid[:, :, None] * xy).sum(axis=1) / np.maximum(counts, 1)[:, None], dtype=np.float32)
+    tri_means = np.where(complete[:, None], slice_means, np.nan).astype(np.float32) # NaN where incomplete
+
+    # average center for each seam
+    #   in case there are no complete sets of points in a slice
+    #   use the slices with at least one point
+    if np.any(complete):
+        avtm = np.mean(slice_means[complete], axis=0)
+    else:
+        avtm = np.mean(slice_means[good_bool], axis=0)
+
+    # distance between slices where both have points at the same targets
+    shared = valid[1:] & valid[:-1]
+    vecs = flat_co[vp[1:]] - flat_co[vp[:-1]]
+    lens = np.sqrt(np.einsum('ijk,ijk->ij', vecs, vecs))
+    s_counts = np.count_nonzero(shared, axis=1)
+    has_dist = np.zeros(tri_tick, dtype=np.bool)
+    has_dist[1:] = s_counts > 0
+    dist = np.zeros(tri_tick, dtype=np.float32)
+    dist[1:] = np.sum(lens * shared, axis=1) / np.maximum(s_counts, 1)
+    dst = np.where(has_dist, dist, np.nan).astype(np.float32) # NaN where there is no distance
+
+    # average distance only from slices that stepped once
+    single = np.copy(has_dist)
+    single[2:] &= has_dist[1:-1]
+    avd = np.mean(dist[single])
+
+    return {'tri_tick': tri_tick,
+            'xys': xys,
+            'vps': vps,
+            'vpsN': vp, # with -1 where there were Nones
+            'dst': dst,
+            'tri_means': tri_means,
+            'av_tri_mean': avtm,
+            'tri_tiler': tri_tiler,
+            'good_xys': good_xys,
+            'good_bool': good_bool,
+            'avd': avd,
+            'idx': idxs,
+            'complete': complete,
+            }
+
+
+# threads for building seams. None uses the cpu count
+seam_workers = None
+
+
+def seam_map(func, seams, *args):
+    """Run func on each seam in a thread pool.
+    seams can be tuples that get unpacked into the args.
+    Results come back in seam order so merging
+    them afterwards is deterministic."""
+    def run(seam):
+        if isinstance(seam, tuple):
+            return func(*seam, *args)
+        return func(seam, *args)
+
+    if (len(seams) < 2) | (seam_workers == 1):
+        return [run(seam) for seam in seams]
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=seam_workers) as pool:
+        return list(pool.map(run, seams))
+
+
+def slice_state(Slice, cloth_key=None):
+    """Get the cloth state shape key name,
+    the flat coords and the cloth coords"""
     ob = Slice.ob
 
     Slice.cloth_key = None
@@ -253,145 +504,26 @@ def slice_setup(Slice, cloth_key=None): # !!! set testing to False !!!
     cloth_co = get_proxy_co(ob)
     Slice.cloth_co = cloth_co
 
+
+def slice_setup(Slice): # !!! set testing to False !!!
+    testing = False
+    #print("seam wrangler is reminding you to set slice_setup testing to False")
+    seams = load_slice_targets()
+    Slice.count = len(seams)
+    flat_co = Slice.flat_co
+
+    # for testing !!! Disable !!! (already getting scaled in sims)
+    if testing:
+        seams = [(vp, valid, xy * np.array([0.1, 0.05], dtype=np.float32)) for vp, valid, xy in seams]
+    # for testing !!! Disable !!!
+
     # ------------
     seam_sets = {}
     seam_sets['unresolved gaps'] = []
-    name = 0
-
-    for s in slices:
-        vp_with_nones = np.array(s['vert_ptrs']).T
-
-        tri_tick = vp_with_nones.shape[0] # For offsetting the tri tiler when merging
-        xys = []  # xy map
-        vps = []  # vertex pointers
-        vpsN = [] # with Nones
-        dst = []  # distance between slices
-        avds = [] # average distance for each seam
-        idxs = [] # aranged indexer for each slice
-        tri_means = []    # center of built triangles
-        av_tri_mean = []  # average center for each seam
-        tri_tiler = []    # tiled fancy index for getting weights
-        good_xys = []     # xys where there is at least one vp
-        good_bool = []    # True where there is at least one vp
-        complete = []     # areas with no Nones. Used for placing tris
-
-        last_idx = None
-        last_j = None
-
-        ticker = 0
-        last_tick = 0
-
-        for j in vp_with_nones:
-
-            xy_with_nones = np.array(s['target_xys'], dtype=np.float32)
-            flying_Nones = j != None
-
-            vp = j[flying_Nones]
-            xy = xy_with_nones[flying_Nones]
-
-            # for testing !!! Disable !!! (already getting scaled in sims)
-            if testing:
-                xy *= np.array([0.1, 0.05], dtype=np.float32)
-            # for testing !!! Disable !!!
-
-            good = False
-            gvpc = vp.shape[0] # at least one vp in the set
-            if gvpc > 0:
-                tri_tiler  += ([ticker] * gvpc)
-                good_xys += xy.tolist()
-                good = True
-            good_bool += [good]
-
-            # get some triangle means (check later to make sure there is at least one)
-            tri_mean = None
-            comp = False
-            if np.all(flying_Nones):
-                comp = True
-                tri_mean = np.mean(xy, axis=0)
-                av_tri_mean += [tri_mean]
-            complete += [comp]
-
-            # get distances -------------
-            vpc = len(j)
-            dist = None
-
-            if vpc > 0:
-                idx = np.arange(vpc, dtype=np.int32)[flying_Nones]
-                idxs += [idx]
-
-            if last_idx is not None:
-                in1d = np.in1d(idx, last_idx)
-
-                if np.any(in1d):
-                    good = np.array(j[idx[in1d]], dtype=np.int32)
-                    last_good = np.array(last_j[idx[in1d]], dtype=np.int32)
-
-                    vecs = flat_co[good] - flat_co[last_good]
-                    dists = np.sqrt(np.einsum('ij,ij->i', vecs, vecs))
-                    dist = np.mean(dists)
-
-                    # check if we stepped only once (for average distance)
-                    if ticker - last_tick == 1:
-                        avds += [dist]
-                    last_tick = ticker
-
-            xys += [xy]
-            vps += [vp]
-            vpsN += [j] # with Nones
-            dst += [dist]
-            tri_means += [tri_mean]
-
-            # -----------------
-            last_idx = idx
-            last_j = j
-
-            # for getting average distance from single steps
-            ticker += 1
-
-        avtm = np.mean(av_tri_mean, axis=0)
-        # in case there are no complete sets of points in a slice
-        if np.any(np.isnan(avtm)):
-            av_tri_means = []
-
-            for j in vp_with_nones:
-
-                xy_with_nones = np.array(s['target_xys'], dtype=np.float32)
-                flying_Nones = j != None
-
-                vp = j[flying_Nones]
-
-                xy = xy_with_nones[flying_Nones]
-
-                # for testing !!! Disable !!! (already getting scaled in sims)
-                if testing:
-                    xy *= np.array([0.1, 0.05], dtype=np.float32)
-                # for testing !!! Disable !!!
-
-                # get some triangle means (check later to make sure there is at least one)
-                tri_mean = None
-                if np.any(flying_Nones):
-                    tri_mean = np.mean(xy, axis=0)
-                    av_tri_mean += [tri_mean]
-
-            avtm = np.mean(av_tri_mean, axis=0)
-
-        avd = np.mean(avds)
-        seam_sets[name] = {'tri_tick': tri_tick,
-                           'xys': xys,
-                           'vps': vps,
-                           'vpsN': vpsN,
-                           'dst': dst,
-                           'tri_means': tri_means,
-                           'av_tri_mean': avtm,
-                           'tri_tiler': tri_tiler,
-                           'good_xys': np.array(good_xys, dtype=np.float32),
-                           'good_bool': np.array(good_bool, dtype=np.bool),
-                           'avd': avd,
-                           'idx': idxs,
-                           'complete': np.array(complete, dtype=np.bool),
-                           }
-
-        name += 1
+
+    for name, s in enumerate(seam_map(seam_set, seams, flat_co)):
+        seam_sets[name] = s
+
     Slice.seam_sets = seam_sets
 
 
@@ -404,346 +536,296 @@ def missing_distance(Slice, test_val):
     #   Could resolve more gaps if we measured between the first vp and
     #   the next good vp.
 
-    # Need a distance between each triangle (Some are None [wierd that that's a true statement])
-    ob = Slice.ob
-    flat_co = Slice.flat_co
-    Slice.seam_sets['tri_means'] = np.empty((0,3), dtype=np.float32)
-    # -------------------------
-    s_count = 0
-    for i in range(Slice.count):
-        s = Slice.seam_sets[i]
-        count = 0
+    # Need a distance between each triangle (NaN where there is none)
+    seams = [(Slice.seam_sets[i], i) for i in range(Slice.count)]
+    unresolved = seam_map(resolve_gaps, seams, Slice.flat_co)
 
-        # Create a state that checks for Nones between non-None distances
-        # This way if there is a gap we get the right distance between the sections where there is a gap
+    for s_count in range(Slice.count):
+        Slice.seam_sets['unresolved gaps'] += [s_count] * unresolved[s_count]
 
-        switch1 = False
-        switch2 = False
-        None_state = False
-        last_vpN = None
-        lidx = None
+    if test_val is None:
+        tri_means = [Slice.seam_sets[i]['tri_means'] for i in range(Slice.count)]
+        Slice.seam_sets['tri_means'] = np.concatenate([np.empty((0,3), dtype=np.float32)] + tri_means)
+
+
+def resolve_gaps(s, s_count, flat_co):
+    """Fill the NaN distances of one seam and
+    add z to the tri means. Returns the number
+    of gaps that could not be measured."""
+    unresolved = 0
+    dst = s['dst']
+    vpN = s['vpsN']
+    d_count = dst.shape[0]
+
+    # runs of NaN with a good distance on both sides.
+    #   measure from the slice before the gap to the last
+    #   slice in the gap and divide it evenly over the gap
+    ara = np.arange(d_count)
+    known = ~np.isnan(dst)
+    prev = np.maximum.accumulate(np.where(known, ara, -1))
+    nxt = np.minimum.accumulate(np.where(known, ara, d_count)[::-1])[::-1]
+    gap = ~known & (prev > -1) & (nxt < d_count)
+
+    starts = ara[gap & ~np.roll(gap, 1)]
+    if starts.shape[0] > 0:
+        first = prev[starts]    # slice before the gap
+        last = nxt[starts] - 1  # last slice in the gap
+
+        shared = (vpN[first] != -1) & (vpN[last] != -1)
+        vecs = flat_co[vpN[last]] - flat_co[vpN[first]]
+        lens = np.sqrt(np.einsum('ijk,ijk->ij', vecs, vecs))
+        s_counts = np.count_nonzero(shared, axis=1)
+        resolved = s_counts > 0
+        dist = np.sum(lens * shared, axis=1) / np.maximum(s_counts, 1)
+        div = last - first
+
+        run = np.cumsum(gap & ~np.roll(gap, 1))[gap] - 1
+        fill = ara[gap][resolved[run]]
+        dst[fill] = (dist / div)[run[resolved[run]]]
+
+        if np.any(resolved):
+            print('Seam wrangler resolved', np.count_nonzero(resolved), 'gaps in seam', s_count)
+
+        if not np.all(resolved):
+            unresolved = int(np.count_nonzero(~resolved))
+            print("Unresolved gaps in seam_wrangler")
+            print("Might distort some seams (but probably not)")
+
+    # overwrite remaining NaNs with avd
+    dst[0] = 0.0
+    dst[np.isnan(dst)] = s['avd']
+
+    cum_dst = np.cumsum(dst)
+    s['cum_dst'] = cum_dst
+
+    # overwrite tri mean NaNs
+    means = s['tri_means']
+    means[np.isnan(means[:, 0])] = s['av_tri_mean']
 
-        for i in range(len(s['dst'])):
+    add_z = np.zeros(cum_dst.shape[0] * 3, dtype=np.float32)
+    add_z.shape = (cum_dst.shape[0], 3)
+    add_z[:, :2] = means
+    add_z[:, 2] = cum_dst
+    s['tri_means'] = add_z
 
-            d = s['dst'][i]
+    return unresolved
 
-            if not switch1:
-                if d is not None:
-                    switch1 = True
 
-            if switch1:
-                if d is None:
-                    switch2 = True
+def build_data(Slice, test_val):
+    """Generate meshes and such"""
 
-            if switch2:
-                if d is not None:
-                    switch1 = False
-                    switch2 = False
-                    None_state = True
+    ob = Slice.ob
+    flat_co = Slice.flat_co
+    cloth_co = Slice.cloth_co
 
-            if d is not None:
-                if None_state:
-                    cvpN = s['vpsN'][i-1]
-                    idx = s['idx'][i-1]
+    test1 = True
+    if test_val is None:
+        test1 = False
 
-                    in1d = np.in1d(idx, lidx)
-                    if np.any(in1d):
-                        good = np.array(cvpN[idx[in1d]], dtype=np.int32)
-                        last_good = np.array(last_vpN[idx[in1d]], dtype=np.int32)
+    if not test1:
+        # first pass: size everything from the seam counts
+        data = Slice.seam_sets
+        t_counts = np.array([data[i]['tri_tick'] for i in range(Slice.count)], dtype=np.int64)
+        g_counts = np.array([len(data[i]['tri_tiler']) for i in range(Slice.count)], dtype=np.int64)
+        f_counts = np.maximum(t_counts - 1, 0)
+
+        t_offs = np.zeros(Slice.count + 1, dtype=np.int64) # tris (slices)
+        g_offs = np.zeros(Slice.count + 1, dtype=np.int64) # good vps
+        f_offs = np.zeros(Slice.count + 1, dtype=np.int64) # tube segments
+        t_offs[1:] = np.cumsum(t_counts)
+        g_offs[1:] = np.cumsum(g_counts)
+        f_offs[1:] = np.cumsum(f_counts)
+        tc = t_offs[-1]
+        gc = g_offs[-1]
+
+        data['mega_tri_mesh'] = {'verts': np.empty((tc * 3, 3), dtype=np.float32),
+                                 'edges': np.empty((tc * 3, 2), dtype=np.int32),
+                                 'faces': np.empty((f_offs[-1] * 3, 4), dtype=np.int32)}
+        data['cloth_key'] = Slice.cloth_key
+        data['ob'] = Slice.ob
+        data['springs'] = np.empty((gc * 3, 2), dtype=np.int32)
+        data['dists'] = np.empty(gc * 3, dtype=np.float32)
+        data['vp_means'] = np.empty((tc, 3), dtype=np.float32)
+        data['with_z'] = np.empty((gc, 3), dtype=np.float32)
+        data['complete_ravel'] = np.empty(tc * 9, dtype=np.bool)
+        data['good_ravel'] = np.empty(tc * 9, dtype=np.bool)
+        data['weights'] = np.empty((gc, 3), dtype=np.float32)
+        data['tris'] = np.empty((tc, 3, 3), dtype=np.float32)
+        data['cloth_co'] = Slice.cloth_co
+        data['tri_tiler'] = np.empty(gc, dtype=np.int32)
+        data['vps'] = np.empty(gc, dtype=np.int32)
+        data['slice_seam'] = np.repeat(np.arange(Slice.count, dtype=np.int32), t_counts) # seam of each slice
 
-                        vecs = flat_co[good] - flat_co[last_good]
-                        dists = np.sqrt(np.einsum('ij,ij->i', vecs, vecs))
-                        dist = np.mean(dists)
+    if test1:
+        s_count = test_val
+        s = Slice.seam_sets[s_count]
+        ed, fa = seam_geometry(s, cloth_co)
+        s['cloth_key'] = Slice.cloth_key
 
-                        # count backwards to last good distance
-                        div = 1
-                        bc = i - 2
-                        while s['dst'][bc] is None:
-                            div += 1
-                            bc -= 1
+        if "sw_tris_" + str(s_count) not in bpy.data.objects:
+            tri_mesh = link_mesh_arrays(s['tris'].reshape(-1, 3), ed, fa, "sw_tris_" + str(s_count))
+            reset_shapes(tri_mesh)
+            tri_mesh.hide_render = True
+        tri_mesh = bpy.data.objects["sw_tris_" + str(s_count)]
 
-                        # fast forward where we just rewound
-                        for r in range(div):
-                            s['dst'][i-div + r] = dist/div
+        tri_co_start = get_co_shape(tri_mesh, 'MC_source')
+        t_shape = tri_co_start.shape
+        tri_co_start.shape = (t_shape[0]//3, 3, 3)
+        s['tri_co_start'] = tri_co_start
 
-                        print('Seam wrangler resolved gap in seam', s_count)
+        s['tri_mesh_ob'] = bpy.data.objects["sw_tris_" + str(s_count)]
+        s['ob'] = Slice.ob
+        s['mega_tri_mesh'] = {'verts': s['tris'].reshape(-1, 3), 'edges': ed, 'faces': fa} # for the headless solver
 
-                    else:
-                        Slice.seam_sets['unresolved gaps'] += [s_count]
-                        print("Unresolved gaps in seam_wrangler")
-                        print("Might distort some seams (but probably not)")
+        # test plot
+        if False:
+            weight_plot(s)
 
-                    None_state = False
-                    #for v in s['vps'][i]:
-                        #ob.data.vertices[v].select = True
+        move = False
+        if move:
+            move_tris(s)
 
-                last_vpN = s['vpsN'][i]
-                lidx = s['idx'][i]
+        return Slice.seam_sets, test_val
 
-            count += 1
+    # second pass: build seams at the same time then
+    #   fill each seam's slices in place in seam order
+    seams = [Slice.seam_sets[i] for i in range(Slice.count)]
+    mesh_data = seam_map(seam_geometry, seams, cloth_co)
 
-        # overwrite remaining Nones with avd
-        s['dst'][0] = 0.0
+    M = data['mega_tri_mesh']
+    for s_count, (ed, fa) in enumerate(mesh_data):
+        s = seams[s_count]
+        s['cloth_key'] = Slice.cloth_key
 
-        for i in range(len(s['dst'])):
-            d = s['dst'][i]
-            if d is None:
-                s['dst'][i] = s['avd']
+        t0, t1 = t_offs[s_count], t_offs[s_count + 1]
+        g0, g1 = g_offs[s_count], g_offs[s_count + 1]
+        f0, f1 = f_offs[s_count], f_offs[s_count + 1]
 
-        cum_dst = np.cumsum(s['dst'])
-        s['cum_dst'] = cum_dst
+        M['verts'][t0 * 3: t1 * 3] = s['tris'].reshape(-1, 3)
+        M['edges'][t0 * 3: t1 * 3] = ed + t0 * 3
+        M['faces'][f0 * 3: f1 * 3] = fa + t0 * 3
 
-        # overwrite tri mean Nones
-        for i in range(len(s['tri_means'])):
-            if s['tri_means'][i] is None:
-                s['tri_means'][i] = s['av_tri_mean']
+        data['tri_tiler'][g0: g1] = s['tri_tiler'] + t0
+        if g1 > g0:
+            data['vps'][g0: g1] = np.concatenate(s['vps'])
 
-        add_z = np.zeros(cum_dst.shape[0] * 3, dtype=np.float32)
-        add_z.shape = (cum_dst.shape[0], 3)
-        add_z[:, :2] = s['tri_means']
-        add_z[:, 2] = cum_dst
-        s['tri_means'] = add_z
+        data['complete_ravel'][t0 * 9: t1 * 9] = s['complete_ravel']
+        data['good_ravel'][t0 * 9: t1 * 9] = s['good_ravel']
+        data['vp_means'][t0: t1] = s['vp_means']
 
-        if test_val is None:
-            Slice.seam_sets['tri_means'] = np.append(Slice.seam_sets['tri_means'], s['tri_means'], axis=0)
-        # iterate tick -----------
-        s_count += 1
+        data['springs'][g0 * 3: g1 * 3] = s['springs']
+        data['springs'][g0 * 3: g1 * 3, 0] += t0 * 3 # offset the triangle spring index
+        data['dists'][g0 * 3: g1 * 3] = s['dists']
 
+        data['weights'][g0: g1] = s['weights']
+        data['with_z'][g0: g1] = s['with_z']
+        data['tris'][t0: t1] = s['tris']
 
+    return Slice.seam_sets, test_val
 
-def build_data(Slice, test_val):
-    """Generate meshes and such"""
 
-    ob = Slice.ob
-    flat_co = Slice.flat_co
-    cloth_co = Slice.cloth_co
+def seam_geometry(s, cloth_co):
+    """Triangles, mesh data, vp means, springs
+    and weights for one seam. Only touches this
+    seam so seams can be built at the same time."""
 
-    # -------------------------
-    s_count = 0
+    # build triangles for the mesh
+    s['tris'] = create_triangles(s)
 
-    test1 = True
-    if test_val is None:
-        test1 = False
+    ed, fa = create_mesh_data(s)
+    ed.shape = (ed.shape[0] * 3, 2)
+    fa.shape = (fa.shape[0] * 3, 4)
 
-    if not test1:
-        Slice.seam_sets['mega_tri_mesh'] = {'verts': [], 'edges':[], 'faces': []}
-        Slice.seam_sets['ed_offset'] = 0
-        Slice.seam_sets['fa_offset'] = 0
-        Slice.seam_sets['cloth_key'] = Slice.cloth_key
-        Slice.seam_sets['ob'] = Slice.ob
-        Slice.seam_sets['springs'] = np.empty((0,2), dtype=np.int32)
-        Slice.seam_sets['sp_offset'] = 0
-        Slice.seam_sets['dists'] = np.array([], dtype=np.float32)
-        Slice.seam_sets['vp_means'] = np.empty((0,3), dtype=np.float32)
-        Slice.seam_sets['with_z'] = np.empty((0,3), dtype=np.float32)
-        Slice.seam_sets['complete_ravel'] = np.array([], dtype=np.bool)
-        Slice.seam_sets['good_ravel'] = np.array([], dtype=np.bool)
-        Slice.seam_sets['weights'] = np.empty((0,3), dtype=np.float32)
-        Slice.seam_sets['tris'] = np.empty((0,3,3), dtype=np.float32)
-        Slice.seam_sets['cloth_co'] = Slice.cloth_co
-        Slice.seam_sets['tri_tiler'] = []
-        Slice.seam_sets['tri_tiler_tick'] = 0
-        Slice.seam_sets['vps'] = []
-
-
-    for i in range(Slice.count):
-        s = Slice.seam_sets[i]
-
-        # build triangles for the mesh
-        s['tris'] = create_triangles(Slice, s_count)
-        # add z values to xys
-
-        ed, fa = create_mesh_data(Slice, s_count)
-        es = ed.shape
-        ed.shape = (es[0] * 3, 2)
-
-        fs = fa.shape
-        fa.shape = (fs[0] * 3, 4)
-
-        # only run on test num if using a number
-        test_num = s_count
-        if test1:
-            test_num = test_val
-
-        if s_count == test_num:
-
-            # create the mesh or merge lists to make one mesh
-            ts = s['tris'].shape
-            s['tris'].shape = (ts[0] * 3, 3)
-
-            if test1:
-                if "sw_tris_" + str(s_count) not in bpy.data.objects:
-                    tri_mesh = link_mesh(s['tris'].tolist(), ed.tolist(), fa.tolist(), "sw_tris_" + str(s_count))
-                    reset_shapes(tri_mesh)
-                    tri_mesh.hide_render = True
-                tri_mesh = bpy.data.objects["sw_tris_" + str(s_count)]
-
-                tri_co_start = get_co_shape(tri_mesh, 'MC_source')
-                t_shape = tri_co_start.shape
-                tri_co_start.shape = (t_shape[0]//3, 3, 3)
-                s['tri_co_start'] = tri_co_start
-
-                s['tri_mesh_ob'] = bpy.data.objects["sw_tris_" + str(s_count)]
-                s['ob'] = Slice.ob
-
-            else:
-                # join into one mesh
-                Slice.seam_sets['mega_tri_mesh']['verts'] += s['tris'].tolist()
-
-                ed_tick = ed[-1][0] + 1
-                ed += Slice.seam_sets['ed_offset']
-                Slice.seam_sets['mega_tri_mesh']['edges'] += ed.tolist()
-                Slice.seam_sets['ed_offset'] += ed_tick
-
-                fa_tick = fa[-1][-1] +1
-                fa += Slice.seam_sets['fa_offset']
-                Slice.seam_sets['mega_tri_mesh']['faces'] += fa.tolist()
-                Slice.seam_sets['fa_offset'] += fa_tick
-
-                tick_tiler = np.array(s['tri_tiler'], dtype=np.int32) + Slice.seam_sets['tri_tiler_tick']
-                Slice.seam_sets['tri_tiler'] += tick_tiler.tolist()
-
-                Slice.seam_sets['tri_tiler_tick'] += s['tri_tick']
-                # worst but ever! Four days to find !!! Slice.seam_sets['tri_tiler_tick'] = tick_tiler[-1] + 1
-
-                # join vps
-                Slice.seam_sets['vps'] += s['vps']
-
-            # iterators ----------------------------------
-            tridex = np.array([0, 1, 2], dtype=np.int32)
-            void_tris = []
-            vpm = []
-
-            a = 0
-            for v in s['vps']:
-                idx = np.array(v, dtype=np.int32)
-
-                if v.shape[0] == 0:
-                    m = np.array([0.0, 0.0, 0.0], dtype=np.float32)
-                    void_tris += [tridex]
-
-                else:
-                    m = np.mean(cloth_co[idx], axis=0)
-
-                vpm += [m]
-
-                a += 3
-                tridex = [a, a+1, a+2]
-
-            s['vp_means'] = np.array(vpm, dtype=np.float32)
-            s['void_tris'] = np.array(void_tris, dtype=np.float32)
-            s['dummies'] = s['void_tris'].shape[0] > 0
-
-            # get nearby means for dummies
-            # dummies only get moved to near means once.
-            if s['dummies']:
-                overwrite = []
-                m_count = s['vp_means'].shape[0]
-                for m in range(s['vp_means'].shape[0]):
-                    mean = s['vp_means'][m]
-                    bool = s['complete'][m]
-                    if bool:
-                        good = mean
-                    if not bool:
-                        overwrite.append(m)
-                    if bool:
-                        if len(overwrite) > 0:
-                            for ov in overwrite:
-                                if np.sum(s['vp_means'][ov]) == 0:
-                                    s['vp_means'][ov] = good
-
-                            overwrite = []
-                    if m +1 == m_count:
-                        for ov in overwrite:
-                            if np.sum(s['vp_means'][ov]) == 0:
-                                s['vp_means'][ov] = good
-
-            s['complete_ravel'] = np.repeat(s['complete'], 9) # for indexing at cloth.co
-            s['good_ravel'] = np.repeat(s['good_bool'], 9) # for indexing at cloth.co
-            s['cloth_key'] = Slice.cloth_key
-            s['cloth_co'] = Slice.cloth_co
-
-            if not test1:
-                Slice.seam_sets['complete_ravel'] = np.append(Slice.seam_sets['complete_ravel'], s['complete_ravel'])
-                Slice.seam_sets['good_ravel'] = np.append(Slice.seam_sets['good_ravel'], s['good_ravel'])
-                Slice.seam_sets['vp_means'] = np.append(Slice.seam_sets['vp_means'], s['vp_means'], axis=0)
-
-            # other data functions ----------------
-            start_a = 0 # offset the triangle spring index
-            if not test1:
-                start_a = Slice.seam_sets['sp_offset']
-            sp, di = generate_external_springs(s)
-
-            if not test1:
-                sp[:,0] += Slice.seam_sets['sp_offset']
-                sp_tick = Slice.seam_sets['mega_tri_mesh']['edges'][-1][0] + 1
-                Slice.seam_sets['sp_offset'] = sp_tick
-                Slice.seam_sets['springs'] = np.append(Slice.seam_sets['springs'], sp, axis=0)
-                Slice.seam_sets['dists'] = np.append(Slice.seam_sets['dists'], di)
-
-            w = barycentric_weights(s)
-            if not test1:
-                Slice.seam_sets['weights'] = np.append(Slice.seam_sets['weights'], w, axis=0)
-                Slice.seam_sets['with_z'] = np.append(Slice.seam_sets['with_z'], s['with_z'], axis=0)
-
-            # test plot
-            if False:
-                weight_plot(s)
-
-            move = False
-            if move:
-                move_tris(s)
+    ts = s['tris'].shape
+    s['tris'].shape = (ts[0] * 3, 3)
 
-        if not test1:
-            Slice.seam_sets['tris'] = np.append(Slice.seam_sets['tris'], s['tris'], axis=0)
+    seam_vp_means(s, cloth_co)
 
-        # iterate tick -----------
-        s_count += 1
+    s['complete_ravel'] = np.repeat(s['complete'], 9) # for indexing at cloth.co
+    s['good_ravel'] = np.repeat(s['good_bool'], 9) # for indexing at cloth.co
+    s['cloth_co'] = cloth_co
 
-    if not test1:
-        if 'mega_tri_mesh' not in bpy.data.objects:
-            M = Slice.seam_sets['mega_tri_mesh']
-            v = np.array(M['verts'])
-            any_nan = np.any(np.isnan(v))
-            any_inf = np.any(np.isinf(v))
-            b_log(['nans or infs when tri mesh is created', any_nan, any_inf])
-
-            tri_mesh = link_mesh(v.tolist(), M['edges'], M['faces'], 'mega_tri_mesh')
-            reset_shapes(tri_mesh)
+    # other data functions ----------------
+    generate_external_springs(s)
+    barycentric_weights(s) # shapes tris back to N,3,3
 
-            tri_mesh.hide_render = True
-        tri_mesh = bpy.data.objects['mega_tri_mesh']
-        Slice.seam_sets['tri_mesh_ob'] = bpy.data.objects['mega_tri_mesh']
+    return ed, fa
 
-        tri_co = get_co_shape(tri_mesh, 'MC_source')
-        t_shape = tri_co.shape
-        tri_co.shape = (t_shape[0]//3, 3, 3)
-        Slice.seam_sets['tri_co_start'] = tri_co
-        Slice.seam_sets['vps'] = np.array(np.hstack(Slice.seam_sets['vps']), dtype=np.int32)
 
-    return Slice.seam_sets, test_val
+def mega_tri_mesh(seam_sets, headless=False):
+    """Create the joined triangle mesh for
+    all seams if needed and get its start coords.
+    headless skips the blender object and takes
+    the start coords from the mesh data."""
+    if headless:
+        seam_sets['tri_mesh_ob'] = None
+        seam_sets['tri_co_start'] = np.array(seam_sets['mega_tri_mesh']['verts'], dtype=np.float32).reshape(-1, 3, 3)
+        return
+
+    if 'mega_tri_mesh' not in bpy.data.objects:
+        M = seam_sets['mega_tri_mesh']
+        v = M['verts']
+        any_nan = np.any(np.isnan(v))
+        any_inf = np.any(np.isinf(v))
+        b_log(['nans or infs when tri mesh is created', any_nan, any_inf])
+
+        tri_mesh = link_mesh_arrays(v, M['edges'], M['faces'], 'mega_tri_mesh')
+        reset_shapes(tri_mesh)
+
+        tri_mesh.hide_render = True
+    tri_mesh = bpy.data.objects['mega_tri_mesh']
+    seam_sets['tri_mesh_ob'] = tri_mesh
+
+    tri_co = get_co_shape(tri_mesh, 'MC_source')
+    t_shape = tri_co.shape
+    tri_co.shape = (t_shape[0]//3, 3, 3)
+    seam_sets['tri_co_start'] = tri_co
+
+
+def seam_vp_means(s, cloth_co):
+    """Mean of the cloth coords at each slice.
+    Slices with no vps (dummies) get the mean
+    of a nearby complete slice."""
+    counts = np.array([v.shape[0] for v in s['vps']], dtype=np.int64)
+    s_count = counts.shape[0]
+    tiler = np.repeat(np.arange(s_count), counts)
+    idx = np.concatenate([np.empty(0, dtype=np.int32)] + list(s['vps'])).astype(np.int32)
+
+    sums = np.zeros((s_count, 3), dtype=np.float64)
+    for i in range(3):
+        sums[:, i] = np.bincount(tiler, weights=cloth_co[idx, i], minlength=s_count)
+    vp_means = np.array(sums / np.maximum(counts, 1)[:, None], dtype=np.float32)
+
+    void = counts == 0
+    s['void_tris'] = np.array(np.arange(s_count)[void][:, None] * 3 + np.arange(3), dtype=np.float32)
+    s['dummies'] = np.any(void)
+
+    # get nearby means for dummies
+    # dummies only get moved to near means once.
+    #   each one takes the next complete slice or
+    #   the last complete slice when none follow
+    complete = s['complete']
+    if s['dummies'] & np.any(complete):
+        ara = np.arange(s_count)
+        nxt = np.minimum.accumulate(np.where(complete, ara, s_count)[::-1])[::-1]
+        nxt[nxt == s_count] = ara[complete][-1]
+        fill = ~complete & (np.sum(vp_means, axis=1) == 0)
+        vp_means[fill] = vp_means[nxt[fill]]
+
+    s['vp_means'] = vp_means
+    return vp_means
 
 
 def generate_external_springs(s):
-    # index arrays...
-    sp = []
-    xys = []
-
-    a = 0
-    for i in range(len(s['vps'])):
-        tridex = [a, a + 1, a + 2]
-        if len(s['vps'][i]) > 0:
-            for j in range(len(s['vps'][i])):
-                v = s['vps'][i][j]
-                xy = s['xys'][i][j]
-                for t in tridex:
-                    sp.append([t, v])
-                    xys.append(xy)
-        # ticker --------------------
-        a += 3
-
-    xy_co = np.array(xys, dtype=np.float32)
-    springs = np.array(sp, dtype=np.int32)
+    """Springs from the three corners of each
+    slice triangle to every vp in the slice"""
+    g_count = s['tri_tiler'].shape[0]
+    vps = np.concatenate([np.empty(0, dtype=np.int32)] + list(s['vps']))
+
+    springs = np.empty((g_count * 3, 2), dtype=np.int32)
+    springs[:, 0] = np.repeat(s['tri_tiler'] * 3, 3) + np.tile(np.arange(3), g_count)
+    springs[:, 1] = np.repeat(vps, 3)
+    xy_co = np.repeat(s['good_xys'], 3, axis=0)
 
     ls = springs[:, 0]
     vecs = xy_co - s['tris'][ls][:,:2]
@@ -804,10 +886,298 @@ def move_tris(s):
     tri_mesh.data.update()
 
 
+def seam_convergence(data, tri_co):
+    """Residual for each seam from the seam spring
+    lengths vs their dists (mean error over mean dist).
+    Seams under converge_tol get masked out of
+    pure_linear and seam_updater until they drift.
+    Returns True when every seam has converged."""
+    sp = data['springs']
+    cv = data['cloth_co'][sp[:, 1]] - tri_co[sp[:, 0]]
+    cl = np.sqrt(np.einsum('ij,ij->i', cv, cv))
+
+    n = data['seam_count']
+    seam = data['spring_seam']
+    err = np.bincount(seam, weights=np.abs(cl - data['dists']), minlength=n)
+    rest = np.bincount(seam, weights=data['dists'], minlength=n)
+    residuals = err / np.maximum(rest, 1e-9)
+    converged = residuals < data['converge_tol']
+
+    data['seam_residuals'] = residuals
+    if np.any(converged != data['seam_converged']):
+        data['seam_converged'] = converged
+        active = ~converged[seam]
+        data['active_springs'] = sp[active]
+        data['active_dists'] = data['dists'][active]
+        data['active_vp'] = np.arange(data['vps'].shape[0])[~converged[data['vp_seam']] & data['plot_ok']]
+
+    b_log(['seam residuals', np.round(residuals, 5).tolist(),
+           'converged seams', np.arange(n)[converged].tolist()])
+    return np.all(converged)
+
+
+def plot_ok(data):
+    """vps that can be plotted from their tri.
+    Flat tris have no bary weights so their vps
+    never get moved instead of getting NaNs."""
+    tiled = data['tri_co_start'][data['tri_tiler']]
+    v0 = tiled[:, 1] - tiled[:, 0]
+    v1 = tiled[:, 2] - tiled[:, 0]
+    cross = np.cross(v0, v1)
+    area = np.einsum('ij,ij->i', cross, cross)
+    ok = area > div_eps * np.einsum('ij,ij->i', v0, v0) * np.einsum('ij,ij->i', v1, v1)
+    ok &= np.all(np.isfinite(data['weights']), axis=1)
+    if not np.all(ok):
+        b_log(['vps on flat tris that will not be plotted:', np.count_nonzero(~ok)])
+    return ok
+
+
+def seams_finite(data):
+    """Cheap NaN check run every frame after the solve.
+    A sum carries any NaN or inf so the full shape key
+    scrub only runs when something went wrong."""
+    if not np.isfinite(np.sum(data['cloth_co'])):
+        return False
+    if data['headless']:
+        return bool(np.isfinite(np.sum(data['headless_tris'].co)))
+    # the tri mesh callback wrote the solved coords here
+    return bool(np.isfinite(np.sum(get_co_shape(data['tri_mesh_ob'], 'MC_current'))))
+
+
+def scrub_nans(data):
+    """Full NaN scrub of the garment and tri mesh
+    shape keys and the headless triangle arrays"""
+    fix_all_shape_key_nans(data['ob'])
+    if data['tri_mesh_ob'] is not None:
+        fix_all_shape_key_nans(data['tri_mesh_ob'])
+    if data['headless']:
+        T = data['headless_tris']
+        np.nan_to_num(T.co, copy=False)
+        np.nan_to_num(T.velocity, copy=False)
+
+
+class Tris():
+    pass
+
+
+def headless_tris(data):
+    """Arrays the headless solver runs the triangles on.
+    Stands in for the mega_tri_mesh cloth object so the
+    MC_tools spring, bend and plot functions run on it."""
+    T = Tris()
+    M = data['mega_tri_mesh']
+    T.co = np.array(M['verts'], dtype=np.float32)
+    vc = T.co.shape[0]
+
+    # cloth settings. The MC_props defaults
+    #   the mega_tri_mesh object runs with.
+    T.settings = {'stretch': 1.0, 'push': 1.0, 'bend': 1.0, 'bend_iters': 2, 'feedback': 1.0, 'gravity': 0.0}
+
+    # stretch springs between every pair of verts
+    #   that share a face (like get_springs_2)
+    faces = np.array(M['faces'], dtype=np.int32)
+    T.basic_set = mct.unique_pairs(mct.face_pairs(faces), ordered=True)
+    T.basic_v_fancy = T.basic_set[:, 0]
+    T.lengths = mct.measure_edges(T.co, T.basic_set)[2]
+
+    # bend springs on the quads split into tris (like get_bend_sets)
+    tridex = faces[:, [0, 1, 2, 0, 2, 3]].reshape(-1, 3)
+    hinges = mct.bend_hinges(tridex)
+    if hinges is None:
+        T.settings['bend'] = 0.0
+    else:
+        T.bend_edges, T.bend_tri_tips, T.bend_tris, keys = hinges
+        T.bend_tri_tip_array = np.zeros(vc, dtype=np.float32)
+        mct.cpoe_bend_plot_values(T, T.co)
+
+    T.stretch_array = np.zeros(vc, dtype=np.float32)
+    T.velocity = np.zeros((vc, 3), dtype=np.float32)
+    T.vel_zero = np.zeros((vc, 3), dtype=np.float32)
+    T.feedback = np.zeros((vc, 3), dtype=np.float32)
+    T.vis_ob = None
+    return T
+
+
+def headless_vis(T, data):
+    """Debug mesh showing the headless triangles"""
+    if T.vis_ob is None:
+        M = data['mega_tri_mesh']
+        if 'sw_tris_view' not in bpy.data.objects:
+            link_mesh_arrays(T.co, M['edges'], M['faces'], 'sw_tris_view').hide_render = True
+        T.vis_ob = bpy.data.objects['sw_tris_view']
+    T.vis_ob.data.vertices.foreach_set('co', T.co.ravel())
+    T.vis_ob.data.update()
+
+
+def headless_step(data, run_type):
+    """Run one seam wrangler frame on the triangle arrays
+    the way cb_seam_wrangler runs spring_basic on the
+    mega_tri_mesh cloth. Only the garment shape key
+    gets written. run_type 1 positions the triangles,
+    run_type 2 moves the seams."""
+    T = data['headless_tris']
+    settings = T.settings
+
+    if run_type == 2:
+        # the garment stays put until the last iteration.
+        #   manage_seams read it for the convergence check
+        cloth_key = mct.seam_cloth_key(data)
+
+    iters = 7
+    for i in range(iters):
+        if run_type == 1:
+            if i == 0:
+                mct.seam_position(T, data)
+            if i < 3:
+                mct.pure_linear(T, data)
+
+        T.co += T.velocity
+        T.vel_zero[:] = T.co
+        T.feedback[:] = T.co
+
+        if settings['stretch'] > 0:
+            for s in range(data['stretch_iters']):
+                if run_type == 1:
+                    mct.pure_linear(T, data)
+                mct.spring_basic_stretch(T, T.lengths, settings['stretch'] * 0.5, settings['push'])
+                if settings['bend'] > 0:
+                    for b in range(settings['bend_iters']):
+                        mct.bend_spring_force_mixed(T, settings['bend'])
+
+        mct.spring_basic_velocity(T, data['velocity'], settings['feedback'], settings['gravity'] * 0.001)
+
+        if run_type == 2:
+            if i < iters - 1:
+                if i < 3:
+                    mct.pure_linear(T, data)
+                continue
+
+            # last iteration moves the seams
+            mct.seam_plot_update(T, data, cloth_key)
+
+    if data['vis_tris']:
+        headless_vis(T, data)
+
+
 class Slices():
     pass
 
-def generate_data(ob, test_val, cloth_key=None):
+
+# bump when the generated data changes so old caches are ignored
+seam_cache_version = 3
+
+# top level arrays from build_data saved to the seam cache
+seam_cache_keys = ['tri_tiler', 'vps', 'tri_means', 'tris', 'springs', 'dists',
+                   'weights', 'with_z', 'complete_ravel', 'good_ravel', 'slice_seam']
+
+
+def seam_data_key(ob, flat_co):
+    """Hash of everything the generated seam data
+    depends on. The slice targets, the flat coords
+    and the topology of the garment"""
+    h = hashlib.sha1(str(seam_cache_version).encode())
+    for vp, valid, xy in load_slice_targets():
+        h.update(str(vp.shape).encode())
+        h.update(vp.tobytes())
+        h.update(xy.tobytes())
+
+    h.update(np.ascontiguousarray(flat_co, dtype=np.float32).tobytes())
+
+    ed = np.empty(len(ob.data.edges) * 2, dtype=np.int32)
+    ob.data.edges.foreach_get('vertices', ed)
+    h.update(str(len(ob.data.vertices)).encode())
+    h.update(ed.tobytes())
+    return h.hexdigest()
+
+
+def seam_cache_path(key):
+    """Seam cache file for a key. Lives in sw_cache
+    next to the blend file or in the blender temp
+    folder if the file was never saved."""
+    if bpy.data.filepath != '':
+        folder = bpy.path.abspath('//sw_cache')
+    else:
+        folder = os.path.join(bpy.app.tempdir, 'sw_cache')
+    os.makedirs(folder, exist_ok=True)
+    return os.path.join(folder, key + '.npz')
+
+
+def save_seam_cache(Slice, key):
+    """Save the generated seam data so a run
+    with the same inputs can skip generating it"""
+    data = Slice.seam_sets
+    M = data['mega_tri_mesh']
+    arrays = {k: data[k] for k in seam_cache_keys}
+    arrays['verts'] = M['verts']
+    arrays['edges'] = M['edges']
+    arrays['faces'] = M['faces']
+    arrays['seam_ticks'] = np.array([data[i]['tri_tick'] for i in range(Slice.count)], dtype=np.int32)
+    arrays['unresolved_gaps'] = np.array(data['unresolved gaps'], dtype=np.int32)
+
+    path = seam_cache_path(key)
+    np.savez(path, **arrays)
+    b_log(['saved seam wrangler data to', path])
+
+
+def load_seam_cache(Slice, key):
+    """Rebuild the seam data from the seam cache.
+    Only the parts that depend on the current
+    cloth state get computed. Returns None when
+    there is no cache for the key."""
+    path = seam_cache_path(key)
+    if not os.path.exists(path):
+        return
+
+    with np.load(path) as file:
+        arrays = dict(file)
+
+    data = {k: arrays[k] for k in seam_cache_keys}
+    data['mega_tri_mesh'] = {'verts': arrays['verts'],
+                             'edges': arrays['edges'],
+                             'faces': arrays['faces']}
+    data['unresolved gaps'] = arrays['unresolved_gaps'].tolist()
+    data['cloth_key'] = Slice.cloth_key
+    data['ob'] = Slice.ob
+    data['cloth_co'] = Slice.cloth_co
+
+    # vp means come from the current cloth state
+    ticks = arrays['seam_ticks']
+    complete = data['complete_ravel'][::9]
+    counts = np.bincount(data['tri_tiler'], minlength=np.sum(ticks))
+    slice_vps = np.split(data['vps'], np.cumsum(counts)[:-1])
+
+    vp_means = []
+    start = 0
+    for t in ticks:
+        s = {'vps': slice_vps[start: start + t], 'complete': complete[start: start + t]}
+        vp_means += [seam_vp_means(s, Slice.cloth_co)]
+        start += t
+    data['vp_means'] = np.concatenate([np.empty((0, 3), dtype=np.float32)] + vp_means)
+
+    b_log(['loaded seam wrangler data from', path])
+    return data
+
+
+def seam_start(data_set, slice_seam, seam_count):
+    """Convergence and plotting state for a new data set.
+    slice_seam is the seam of each slice."""
+    # scaled weights get filled in as xy_scale settings come up
+    data_set['scaled_weights'] = {}
+    data_set['bary_grads'] = None
+
+    # every seam starts out active
+    data_set['seam_count'] = seam_count
+    data_set['spring_seam'] = slice_seam[data_set['springs'][:, 0] // 3]
+    data_set['vp_seam'] = slice_seam[data_set['tri_tiler']]
+    data_set['seam_converged'] = np.zeros(seam_count, dtype=np.bool)
+    data_set['seam_residuals'] = np.full(seam_count, np.inf, dtype=np.float32)
+    data_set['active_springs'] = data_set['springs']
+    data_set['active_dists'] = data_set['dists']
+    data_set['plot_ok'] = plot_ok(data_set)
+    data_set['active_vp'] = np.arange(data_set['vps'].shape[0])[data_set['plot_ok']]
+
+
+def generate_data(ob, test_val, cloth_key=None, headless=False):
 
     #global data
     Slice = Slices()
@@ -815,16 +1185,38 @@ def generate_data(ob, test_val, cloth_key=None):
     ob_name = ob.name
 
     # setup functions
-    slice_setup(Slice, cloth_key)
-    missing_distance(Slice, test_val)
-    data_set, test1 = build_data(Slice, test_val)
+    slice_state(Slice, cloth_key)
     test1 = test_val is not None
 
+    # reuse data generated from the same inputs
+    data_set = None
+    if not test1:
+        key = seam_data_key(ob, Slice.flat_co)
+        data_set = load_seam_cache(Slice, key)
+
+    if data_set is None:
+        slice_setup(Slice)
+        missing_distance(Slice, test_val)
+        data_set, test1 = build_data(Slice, test_val)
+        test1 = test_val is not None
+        if not test1:
+            save_seam_cache(Slice, key)
+
     if test1:
+        # the test seam runs on its own like a one seam data set
         data_set = data_set[test_val]
+        data_set['vps'] = np.concatenate([np.empty(0, dtype=np.int32)] + list(data_set['vps'])).astype(np.int32)
+        if headless:
+            mega_tri_mesh(data_set, headless)
+        seam_start(data_set, np.zeros(data_set['tris'].shape[0], dtype=np.int32), 1)
+    else:
+        mega_tri_mesh(data_set, headless)
+        seam_start(data_set, data_set['slice_seam'], Slice.count)
 
     # undo !!!!!!!!
 
+    if headless:
+        return data_set
 
     bpy.types.Scene.MC_seam_wrangler = True # so the continuous handler can auto_kill
 
@@ -872,9 +1264,37 @@ def generate_data(ob, test_val, cloth_key=None):
     return data_set
 
 
-def position_triangles(ob, test_val, debug=None, cloth_key=None):
+def position_triangles(ob, test_val, debug=None, cloth_key=None, headless=False):
     """Generates all the needed data using a number
-    of functions and positions triangles along seams"""
+    of functions and positions triangles along seams.
+    headless positions them with the headless solver
+    without creating the mega_tri_mesh object."""
+
+    if headless:
+        data = generate_data(ob, test_val, cloth_key, headless=True)
+        if debug == 2:
+            return
+
+        data['run_type'] = 1 # will run seam forces for positioning
+
+        # inital position:
+        data['stretch_iters'] = 10
+        data['linear_iters'] = 1
+        data['seam_influence'] = .5
+        data['partial_set'] = [0,1,2,3,4,5]
+        data['velocity'] = 0.5
+        data['sw_count'] = 0
+        data['count'] = 0
+        data['vis_mesh'] = False
+        data['vis_tris'] = debug == 1
+        data['headless'] = True
+        data['headless_tris'] = headless_tris(data)
+        data['stretch_array'] = np.zeros(data['headless_tris'].co.shape[0], dtype=np.float32)
+
+        # For the pin vertex group
+        setup_pin_group(ob, data['vps'])
+        headless_step(data, 1)
+        return data
 
     if 'mega_tri_mesh' not in bpy.data.objects:
         data = generate_data(ob, test_val, cloth_key)
@@ -897,6 +1317,7 @@ def position_triangles(ob, test_val, debug=None, cloth_key=None):
         data['run_frames'] = 7
         data['sw_count'] = 0
         data['count'] = 0
+        data['headless'] = False
         if debug == 1:
             tris.MC_props.continuous = True
             return
@@ -929,6 +1350,8 @@ def manage_seams(ob, cloth_key=None, settings={}, test_val=None, debug=None):
     data['tri_influence'] =     0.321 # triangles forcing seams to targets
     data['xy_scale'] =    [1.0, 1.0]# multiply the xy values by this amount
     data['vis_mesh'] = False # create points where the seams are being moved to
+    data['vis_tris'] = False # headless only. show the triangles as a mesh
+    data['converge_tol'] =     0.01 # seams with less error than this (fraction of seam spring length) stop solving. 0 to always solve
 
     for key, value in settings.items():
         if key in data:
@@ -937,6 +1360,22 @@ def manage_seams(ob, cloth_key=None, settings={}, test_val=None, debug=None):
             #print('!!! manage_seams setting did not match:', key, value, '!!!')
 
     data['run_type'] = 2 # will run seam forces for update
+
+    # per seam convergence from the current garment and tris
+    get_proxy_co(ob, data['cloth_co'])
+    if data['headless']:
+        tri_co = data['headless_tris'].co
+    else:
+        tri_co = get_co_shape(data['tri_mesh_ob'], 'MC_current')
+    if seam_convergence(data, tri_co):
+        b_log(['every seam converged. skipping seam wrangler at frame', bpy.context.scene.frame_current])
+        return
+
+    if data['headless']:
+        data['stretch_iters'] = data['iterations']
+        headless_step(data, 2)
+        return
+
     tris = data['tri_mesh_ob']
 
     tris.MC_props.stretch_iters = data['iterations']
@@ -944,10 +1383,12 @@ def manage_seams(ob, cloth_key=None, settings={}, test_val=None, debug=None):
 
 
 # !!! call this one to drop in the frame handler !!!
-def seam_manager(Bobj=None, frames=None, kill_frame=None, settings=None, cloth_key=None):
+def seam_manager(Bobj=None, frames=None, kill_frame=None, settings=None, cloth_key=None, headless=False):
     """Adds a frame handler that will
     force seams into submission at frames
-    in the list."""
+    in the list. headless runs the seams with
+    the headless solver instead of a
+    mega_tri_mesh cloth object."""
 
     global actual_frames
     actual_frames = np.hstack(frames)
@@ -978,6 +1419,7 @@ def seam_manager(Bobj=None, frames=None, kill_frame=None, settings=None, cloth_k
     data['frames'] = actual_frames
     data['init_frame'] = min(actual_frames)
     data['kill_frame'] = max(actual_frames)
+    data['headless'] = headless
 
     logs1 += ['init frame:', data['init_frame']]
     logs1 += ['kill frame from arg:', kill_frame, 'overwriting kill frame with:', data['kill_frame']]
@@ -991,7 +1433,7 @@ def seam_manager(Bobj=None, frames=None, kill_frame=None, settings=None, cloth_k
 
     data['settings'] = settings
 
-    bpy.types.Scene.seam_wrangler_data = {'init': False}
+    bpy.types.Scene.seam_wrangler_data = {'init': False, 'scrubbed': False}
     for k, v in data.items():
         bpy.context.scene.seam_wrangler_data[k] = v
 
@@ -1004,7 +1446,7 @@ def seam_manager(Bobj=None, frames=None, kill_frame=None, settings=None, cloth_k
         active_object = bpy.context.object
         
         if f == data['init_frame']:
-            tri_data = position_triangles(Bobj, test_val=None, debug=None, cloth_key=None)
+            tri_data = position_triangles(Bobj, test_val=None, debug=None, cloth_key=None, headless=data['headless'])
             for k, v in tri_data.items():
                 data[k] = v
             data['init'] = True    
@@ -1019,9 +1461,11 @@ def seam_manager(Bobj=None, frames=None, kill_frame=None, settings=None, cloth_k
         
         ob = data['ob']
 
-        fix_all_shape_key_nans(ob)
-        if 'mega_tri_mesh' in bpy.data.objects:
-            fix_all_shape_key_nans(bpy.data.objects['mega_tri_mesh'])
+        # one full scrub for whatever was there before we started.
+        #   after that only when the nan check trips
+        if not data['scrubbed']:
+            scrub_nans(data)
+            data['scrubbed'] = True
 
         sc = len(data['settings'])
         if sc == 0:
@@ -1060,9 +1504,9 @@ def seam_manager(Bobj=None, frames=None, kill_frame=None, settings=None, cloth_k
         manage_seams(ob, cloth_key, settings=settings, test_val=None, debug=None)
         bpy.context.view_layer.objects.active = active_object
 
-        if True:
-            fix_all_shape_key_nans(ob)
-            fix_all_shape_key_nans(bpy.data.objects['mega_tri_mesh'])
+        if not seams_finite(data):
+            b_log(['!!! NaNs in the seam wrangler at frame', f, 'scrubbing shape keys !!!'])
+            scrub_nans(data)
 
         if test_cache:
             cache_only(bpy.data.objects['mega_tri_mesh'], Bobj.MC_props.current_cache_frame)
@@ -1091,7 +1535,8 @@ def seam_manager(Bobj=None, frames=None, kill_frame=None, settings=None, cloth_k
                 if mod.type == "CLOTH":
                     mod.settings.vertex_group_mass = ''
 
-            bpy.data.objects['mega_tri_mesh'].name = 'used_tris'
+            if 'mega_tri_mesh' in bpy.data.objects:
+                bpy.data.objects['mega_tri_mesh'].name = 'used_tris'
             del(bpy.types.Scene.seam_wrangler_data)
 
     handler_names = np.array([i.__name__ for i in bpy.app.handlers.frame_change_post])